@@ -0,0 +1,125 @@
+# bodyFrame.py
+#
+# Packing and unpacking of Kuatro body frames.
+#
+# A body frame carries every tracked body seen by a device in a single OSC message,
+# instead of one message per joint, hand state, and processing coordinate.  Each body
+# is flattened into the OSC argument list as:
+#
+#    userID, leftHandState, rightHandState, jointCount,
+#       jointID, trackingState, x, y, z,      (repeated jointCount times)
+#
+# and bodies simply follow each other, preceded by the number of bodies in the frame.
+#
+# Frames are numbered by their sender, so that receivers can skip frames they have
+# already seen (or that arrive late, after a newer frame) - see isNewFrame().
+#
+# A device may leave joints that have not moved out of a frame.  Every so often it sends
+# a keyframe, carrying all joints, so that receivers can recover from lost frames.
+#
+# Once the server has told a device how to calibrate its coordinates, the device sends
+# calibrated body frames instead.  Their coordinates are already normalized to the virtual
+# world (0 to COORDINATE_MAX along each axis), and each joint is packed into two integers:
+#
+#    jointID * 2^24 + trackingState * 2^16 + z,   x * 2^16 + y
+#
+# (see decodeCalibratedBodies()), which is less than half the size of a joint in a body frame.
+#
+# This module is shared by the Kuatro Client (CPython), and the Kuatro Server and
+# Views (Jython), so it must stay compatible with both.
+
+# how far back (in frames) a sequence number may go before we assume the sender restarted
+# and started numbering its frames from scratch (about 10 seconds at 30 frames per second)
+SEQUENCE_RESTART_WINDOW = 300
+
+# calibrated coordinates go from 0 to COORDINATE_MAX (16 bits) along each axis of the virtual world
+COORDINATE_MAX = 65535
+
+
+def isNewFrame(sequence, lastSequence):
+   '''Returns True if a frame numbered 'sequence' should be processed, given that the 
+      last frame processed from the same sender was numbered 'lastSequence' (None if 
+      no frame has been processed yet).  Duplicate and late frames return False.'''
+
+   if lastSequence is None or sequence > lastSequence:
+      return True
+
+   # sequence went backwards - it is either a late / duplicate frame, or the sender restarted
+   return lastSequence - sequence > SEQUENCE_RESTART_WINDOW
+
+
+def encodeBodies(bodies):
+   '''Flattens a list of bodies into a list of OSC arguments.  Each body is a tuple
+      (userID, leftHandState, rightHandState, joints), where joints is a list of
+      (jointID, trackingState, x, y, z) tuples.'''
+
+   args = [len(bodies)]
+
+   for userID, leftHandState, rightHandState, joints in bodies:
+      args.append(userID)
+      args.append(leftHandState)
+      args.append(rightHandState)
+      args.append(len(joints))
+      for joint in joints:
+         args.extend(joint)
+
+   return args
+
+
+def decodeBodies(args, start=0):
+   '''Rebuilds the list of bodies from OSC arguments produced by encodeBodies(),
+      starting at index 'start'.  Returns bodies in the same form as encodeBodies()
+      accepts them.'''
+
+   bodies = []
+
+   bodyCount = args[start]
+   i = start + 1
+   for body in range(bodyCount):
+      userID = args[i]
+      leftHandState = args[i + 1]
+      rightHandState = args[i + 2]
+      jointCount = args[i + 3]
+      i = i + 4
+
+      joints = []
+      for joint in range(jointCount):
+         joints.append((args[i], args[i + 1], args[i + 2], args[i + 3], args[i + 4]))
+         i = i + 5
+
+      bodies.append((userID, leftHandState, rightHandState, joints))
+
+   return bodies
+
+
+def decodeCalibratedBodies(args, start, maxX, maxY, maxZ):
+   '''Rebuilds the list of bodies from the OSC arguments of a calibrated body frame, starting
+      at index 'start'.  Coordinates are scaled from 0 to COORDINATE_MAX to 0 to maxX, maxY, and
+      maxZ (rounded to whole units).  Returns bodies in the same form as decodeBodies().'''
+
+   scaleX = float(maxX) / COORDINATE_MAX
+   scaleY = float(maxY) / COORDINATE_MAX
+   scaleZ = float(maxZ) / COORDINATE_MAX
+
+   bodies = []
+
+   bodyCount = args[start]
+   i = start + 1
+   for body in range(bodyCount):
+      userID = args[i]
+      leftHandState = args[i + 1]
+      rightHandState = args[i + 2]
+      jointCount = args[i + 3]
+      i = i + 4
+
+      joints = []
+      for joint in range(jointCount):
+         first = args[i]
+         second = args[i + 1]
+         joints.append(((first >> 24) & 0xFF, (first >> 16) & 0xFF,
+                        int(((second >> 16) & 0xFFFF) * scaleX + 0.5), int((second & 0xFFFF) * scaleY + 0.5), int((first & 0xFFFF) * scaleZ + 0.5)))
+         i = i + 2
+
+      bodies.append((userID, leftHandState, rightHandState, joints))
+
+   return bodies
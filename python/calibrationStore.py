@@ -0,0 +1,391 @@
+# calibrationStore.py
+#
+# The Calibration Store keeps the calibration (the space each device senses, see calibrator.py) of
+# every device the Kuatro Server has seen, in one file.
+#
+# The file is read once, when the server starts, so registering a device needs no file I/O.  When a
+# device is calibrated, the store is written by a thread of its own (so the server never waits on the
+# disk), to a temporary file that then replaces the store in one step (see replaceFile), so the store
+# is never left half-written, or missing.
+#
+# Every calibration is kept as a new version, stamped with the time it was made (up to HISTORY_SIZE
+# versions per device), so a bad calibration can be rolled back to the one before (see rollback).
+# The file is plain text - one line per version:
+#
+#    clientID, time, restoredFrom, minX, minY, minZ, maxX, maxY, maxZ    (separated by tabs)
+#
+# where restoredFrom is the time of the version a roll back restored (0 for calibrations).  The file
+# may be edited (or replaced) while the server runs - reload() picks up the changes.  What the file
+# says goes (an edited line replaces the version with its time, and deleted lines are forgotten),
+# except for versions the store has not written yet.
+#
+# This module is used by the Kuatro Server only (Jython).
+#
+#  See README file for full instructions on using the Kuatro System
+
+from threading import Thread, Lock, Condition
+from java.io import File, IOException
+from java.nio.file import Files, CopyOption, StandardCopyOption, AtomicMoveNotSupportedException
+from java.lang.management import ManagementFactory
+import jarray
+import os
+import glob
+import pickle
+import time
+
+# how many versions of each device's calibration to keep
+HISTORY_SIZE = 10
+
+# calibration files of earlier versions of the server (one per device, see importLegacyFiles)
+LEGACY_FILE_PATTERN = "*.calibrationData.p"
+
+# this process, as "pid@host" (servers sharing a store, e.g., the workers of a sharded server, each write
+# their own temporary file, see kuatroAggregator.py)
+PROCESS_NAME = ManagementFactory.getRuntimeMXBean().getName()
+
+
+class CalibrationStore():
+
+   def __init__(self, fileName = "kuatroCalibrations.tsv"):
+
+      self.fileName = fileName
+      self.temporaryName = fileName + "." + PROCESS_NAME.split("@")[0] + "-" + str(id(self)) + ".tmp"   # what is written, before it replaces the file
+      self.versions = {}              # the versions of each device's calibration, oldest first, as {clientID: [(time, restoredFrom, bounds)]}
+      self.lock = Lock()              # guards the versions (read by the server, written by the writer thread and reloads)
+      self.lastModified = None        # (modification time, size) of the file, when we last read or wrote it
+      self.unwritten = []             # the versions added since the file was last written, as [(clientID, version)]
+      self.unreported = []            # the clientIDs whose calibration changed when the writer thread read the file (reported by the next reload)
+
+      self.isDirty = False            # whether there are versions not yet written
+      self.writeCondition = Condition()   # wakes up the writer thread
+      self.writesFailed = 0           # how many writes failed
+      self.isRunning = True           # whether the writer thread runs (until closed)
+
+      self.reload()
+      if self.importLegacyFiles() > 0:
+         self.save()
+
+      self.writerThread = Thread(target=self.run)
+      self.writerThread.setDaemon(True)
+      self.writerThread.start()
+
+   def get(self, clientID):
+      '''Returns a device's current calibration bounds, as [minX, minY, minZ, maxX, maxY, maxZ]
+         (or None, if the device was never calibrated)'''
+
+      self.lock.acquire()
+      try:
+         versions = self.versions.get(clientID)
+         if not versions:
+            return None
+         return list(versions[-1][2])
+      finally:
+         self.lock.release()
+
+   def history(self, clientID):
+      '''Returns the versions of a device's calibration, oldest first, as [(time, restoredFrom, bounds)]'''
+
+      self.lock.acquire()
+      try:
+         return list(self.versions.get(clientID, []))
+      finally:
+         self.lock.release()
+
+   def put(self, clientID, bounds, restoredFrom = 0):
+      '''Makes 'bounds' (minX, minY, minZ, maxX, maxY, maxZ) the device's current calibration, as a new
+         version, and saves the store (in the background)'''
+
+      self.lock.acquire()
+      try:
+         self.record(clientID, (round(time.time(), 3), restoredFrom, tuple(bounds)))
+      finally:
+         self.lock.release()
+      self.save()
+
+   def rollback(self, clientID):
+      '''Makes the calibration before the current one the device's current calibration (again), as
+         a new version, and returns its bounds (or None, if there is none before it).  Rolling back
+         again goes further back.'''
+
+      self.lock.acquire()
+      try:
+         versions = self.versions.get(clientID, [])
+         if not versions:
+            return None
+
+         # the calibration the current version came from (a roll back came from an earlier one)
+         currentTime, restoredFrom, bounds = versions[-1]
+         origin = restoredFrom or currentTime
+
+         previous = None   # the latest calibration (not a roll back) made before it
+         for versionTime, versionRestoredFrom, versionBounds in versions:
+            if versionRestoredFrom == 0 and versionTime < origin:
+               previous = (versionTime, versionBounds)
+         if previous is None:
+            return None
+
+         self.record(clientID, (round(time.time(), 3), previous[0], previous[1]))
+      finally:
+         self.lock.release()
+
+      self.save()
+      return list(previous[1])
+
+   def record(self, clientID, version):
+      '''Adds a new version of a device's calibration, to be written to the file (call with the lock held)'''
+
+      # versions are told apart by their times, so a new one never takes an existing one's time
+      times = [oldVersion[0] for oldVersion in self.versions.get(clientID, [])]
+      while version[0] in times:
+         version = (round(version[0] + 0.001, 3),) + version[1:]
+
+      self.addVersion(clientID, version)
+      self.unwritten.append((clientID, version))
+
+   def addVersion(self, clientID, version):
+      '''Adds a version of a device's calibration, in time order, keeping the latest HISTORY_SIZE
+         (a version with the same time is replaced - call with the lock held)'''
+
+      versions = [oldVersion for oldVersion in self.versions.get(clientID, []) if oldVersion[0] != version[0]]
+      versions.append(version)
+      versions.sort()
+      self.versions[clientID] = versions[-HISTORY_SIZE:]
+
+   ####################################
+   ###### Reading and Writing #########
+   ####################################
+
+   def fileStamp(self):
+      '''Returns the (modification time, size) of the file (or None, if there is no file)'''
+
+      try:
+         status = os.stat(self.fileName)
+      except OSError:
+         return None
+      return (status.st_mtime, status.st_size)
+
+   def reload(self):
+      '''Reads the file, if it changed since we last read or wrote it (e.g., it was edited), and makes
+         its versions (and those not written yet) the store's versions.  Returns the clientIDs whose
+         current calibration changed since the last reload (devices whose lines were all deleted are
+         left out - they keep the calibration they have).'''
+
+      changed = self.readFile()
+
+      self.lock.acquire()
+      try:
+         for clientID in self.unreported:   # (changes the writer thread read, see write)
+            if clientID not in changed and clientID in self.versions:
+               changed.append(clientID)
+         self.unreported = []
+      finally:
+         self.lock.release()
+
+      return changed
+
+   def readFile(self):
+      '''Reads the file, if it changed since we last read or wrote it, and makes its versions (and
+         those not written yet) the store's versions.  Returns the clientIDs whose current
+         calibration changed.'''
+
+      stamp = self.fileStamp()
+      if stamp is None and self.recover():   # (the server stopped while replacing it)
+         stamp = self.fileStamp()
+      if stamp is None or stamp == self.lastModified:
+         return []
+
+      try:
+         storeFile = open(self.fileName, "r")
+         try:
+            lines = storeFile.readlines()
+         finally:
+            storeFile.close()
+      except IOError, e:
+         print "Unable to read calibrations from", self.fileName, e
+         return []
+
+      fileVersions = []   # the versions in the file, as [(clientID, version)]
+      for lineNumber in range(len(lines)):
+         line = lines[lineNumber].strip()
+         if line == "" or line.startswith("#"):
+            continue
+
+         fields = line.split("\t")
+         try:
+            values = [float(field) for field in fields[1:]]
+         except ValueError:
+            values = []
+         if len(values) != 8:
+            print "Skipping line", lineNumber + 1, "of", self.fileName + " (expected clientID, time, restoredFrom and 6 bounds)"
+            continue
+
+         fileVersions.append((fields[0], (values[0], values[1], tuple(values[2:]))))
+
+      self.lock.acquire()
+      try:
+         current = {}
+         for clientID in self.versions.keys():
+            current[clientID] = self.versions[clientID][-1]
+
+         # the file's versions, followed by ours that are not in it yet
+         self.versions = {}
+         for clientID, version in fileVersions + self.unwritten:
+            self.addVersion(clientID, version)
+
+         self.lastModified = stamp
+
+         changed = []
+         for clientID in self.versions.keys():
+            if current.get(clientID) != self.versions[clientID][-1]:
+               changed.append(clientID)
+         return changed
+      finally:
+         self.lock.release()
+
+   def importLegacyFiles(self):
+      '''Adds the calibrations of devices found in the per-device files of earlier versions of the
+         server, next to the store (unless the store has them already), and returns how many were added'''
+
+      added = 0
+      for fileName in glob.glob(os.path.join(os.path.dirname(self.fileName), LEGACY_FILE_PATTERN)):
+         clientID = os.path.basename(fileName)[:-len(LEGACY_FILE_PATTERN) + 1]
+         if self.get(clientID) is not None:
+            continue
+
+         try:
+            legacyFile = open(fileName, "rb")
+            try:
+               data = pickle.load(legacyFile)
+            finally:
+               legacyFile.close()
+            bounds = (data["minX"], data["minY"], data["minZ"], data["maxX"], data["maxY"], data["maxZ"])
+         except (IOError, KeyError, pickle.UnpicklingError, EOFError), e:
+            print "Unable to import calibration from", fileName, e
+            continue
+
+         self.lock.acquire()
+         try:
+            self.record(clientID, (round(os.path.getmtime(fileName), 3), 0, bounds))
+         finally:
+            self.lock.release()
+         added = added + 1
+         print "Imported calibration of", clientID, "from", fileName
+
+      return added
+
+   def save(self):
+      '''Has the writer thread write the store (soon)'''
+
+      self.writeCondition.acquire()
+      try:
+         self.isDirty = True
+         self.writeCondition.notify()
+      finally:
+         self.writeCondition.release()
+
+   def run(self):
+      '''Writes the store whenever it changes (in the writer thread)'''
+
+      while True:
+         self.writeCondition.acquire()
+         try:
+            while self.isRunning and not self.isDirty:
+               self.writeCondition.wait()
+            if not self.isDirty:   # closed, and nothing left to write
+               return
+            self.isDirty = False
+         finally:
+            self.writeCondition.release()
+
+         self.write()
+
+   def write(self):
+      '''Writes all versions to a temporary file, which then replaces the store (so the store is
+         never half-written).  Versions written to the file meanwhile (e.g., by another server) are
+         read first, so they are kept (and the changes they make are reported by the next reload).'''
+
+      changed = self.readFile()
+
+      self.lock.acquire()
+      try:
+         for clientID in changed:
+            if clientID not in self.unreported:
+               self.unreported.append(clientID)
+
+         written = list(self.unwritten)
+         lines = ["# Kuatro calibration store - clientID, time, restoredFrom, minX, minY, minZ, maxX, maxY, maxZ (tab separated)\n"]
+         clientIDs = self.versions.keys()
+         clientIDs.sort()
+         for clientID in clientIDs:
+            for versionTime, restoredFrom, bounds in self.versions[clientID]:
+               fields = [clientID, "%.3f" % versionTime, "%.3f" % restoredFrom] + [str(float(value)) for value in bounds]
+               lines.append("\t".join(fields) + "\n")
+      finally:
+         self.lock.release()
+
+      try:
+         temporaryFile = open(self.temporaryName, "w")
+         try:
+            temporaryFile.writelines(lines)
+         finally:
+            temporaryFile.close()
+
+         replaceFile(self.temporaryName, self.fileName)
+
+         self.lastModified = self.fileStamp()   # so we do not read back what we wrote
+
+         self.lock.acquire()
+         try:
+            for clientIDAndVersion in written:
+               self.unwritten.remove(clientIDAndVersion)
+         finally:
+            self.lock.release()
+      except (IOError, OSError), e:
+         self.writesFailed = self.writesFailed + 1
+         print "Unable to write calibrations to", self.fileName, e
+         if os.path.exists(self.temporaryName) and os.path.exists(self.fileName):   # (the store is whole, so the temporary file is not needed)
+            os.remove(self.temporaryName)
+
+   def recover(self):
+      '''Puts the latest temporary file in place of the file, when the file is missing (e.g., the
+         server stopped while replacing it), and returns whether there was one'''
+
+      temporaryNames = glob.glob(self.fileName + "*.tmp")
+      if not temporaryNames:
+         return False
+
+      temporaryNames.sort(key=os.path.getmtime)
+      try:
+         replaceFile(temporaryNames[-1], self.fileName)
+      except OSError, e:
+         print "Unable to recover calibrations from", temporaryNames[-1], e
+         return False
+
+      print "Recovered calibrations from", temporaryNames[-1]
+      return True
+
+   def close(self):
+      '''Writes whatever versions are not written yet, and stops the writer thread'''
+
+      self.writeCondition.acquire()
+      try:
+         self.isRunning = False
+         self.writeCondition.notify()
+      finally:
+         self.writeCondition.release()
+      self.writerThread.join()
+
+
+def replaceFile(source, target):
+   '''Replaces file 'target' with file 'source' in one step, so 'target' is never missing (as it would
+      be, for a moment, if it were removed first - renaming does not replace files on Windows)'''
+
+   sourcePath = File(source).toPath()
+   targetPath = File(target).toPath()
+   try:
+      try:
+         Files.move(sourcePath, targetPath, jarray.array([StandardCopyOption.REPLACE_EXISTING, StandardCopyOption.ATOMIC_MOVE], CopyOption))
+      except AtomicMoveNotSupportedException:   # (some file systems cannot - the file is still replaced, not removed first)
+         Files.move(sourcePath, targetPath, jarray.array([StandardCopyOption.REPLACE_EXISTING], CopyOption))
+   except IOException, e:
+      raise OSError(str(e))
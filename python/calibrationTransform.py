@@ -0,0 +1,98 @@
+# calibrationTransform.py
+#
+# A Calibration Transform maps a device's coordinates to Virtual World coordinates.
+#
+# A device's calibration is the range of coordinates it can sense (minX, minY, minZ, maxX, maxY, maxZ),
+# as found by its Calibrator.  Each axis of that range is mapped onto the Virtual World (0 to virtualMax),
+# so calibrating a coordinate is a clamp to the range, followed by
+#
+#    virtual = (coordinate - min) * virtualMax / (max - min)
+#
+# The scale (virtualMax / (max - min)) of each axis is worked out once, when the transform is
+# created, so calibrating a coordinate is just a clamp, a subtraction and a multiplication.
+# Transforms never change - when a device is calibrated again, the server replaces its transform
+# with a new one, so a frame is always calibrated with one transform from start to end.
+#
+# This module is used by the Kuatro Server only (Jython).
+#
+#  See README file for full instructions on using the Kuatro System
+
+
+class CalibrationTransform():
+
+   def __init__(self, minX, minY, minZ, maxX, maxY, maxZ, virtualMaxX, virtualMaxY, virtualMaxZ):
+
+      self.bounds = (minX, minY, minZ, maxX, maxY, maxZ)   # the device's calibration data
+
+      self.minX = minX
+      self.minY = minY
+      self.minZ = minZ
+      self.maxX = maxX
+      self.maxY = maxY
+      self.maxZ = maxZ
+
+      # how many Virtual World units there are per device unit, along each axis (0 if the range is empty)
+      self.scaleX = scale(minX, maxX, virtualMaxX)
+      self.scaleY = scale(minY, maxY, virtualMaxY)
+      self.scaleZ = scale(minZ, maxZ, virtualMaxZ)
+
+   def calibrate(self, x, y, z):
+      '''Returns the Virtual World coordinates (integers) of device coordinates x, y, z
+         (clamped to the calibrated range)'''
+
+      if x < self.minX: x = self.minX   # keep x in range
+      elif x > self.maxX: x = self.maxX
+      if y < self.minY: y = self.minY   # keep y in range
+      elif y > self.maxY: y = self.maxY
+      if z < self.minZ: z = self.minZ   # keep z in range
+      elif z > self.maxZ: z = self.maxZ
+
+      return int((x - self.minX) * self.scaleX), int((y - self.minY) * self.scaleY), int((z - self.minZ) * self.scaleZ)
+
+   def calibrateJoints(self, joints):
+      '''Returns a list of joints - (jointID, trackingState, x, y, z) tuples - with their coordinates
+         calibrated to the Virtual World, all at once'''
+
+      minX = self.minX
+      minY = self.minY
+      minZ = self.minZ
+      maxX = self.maxX
+      maxY = self.maxY
+      maxZ = self.maxZ
+      scaleX = self.scaleX
+      scaleY = self.scaleY
+      scaleZ = self.scaleZ
+
+      calibratedJoints = []
+      for jointID, trackingState, x, y, z in joints:
+         if x < minX: x = minX   # keep coordinates in range
+         elif x > maxX: x = maxX
+         if y < minY: y = minY
+         elif y > maxY: y = maxY
+         if z < minZ: z = minZ
+         elif z > maxZ: z = maxZ
+         calibratedJoints.append((jointID, trackingState, int((x - minX) * scaleX), int((y - minY) * scaleY), int((z - minZ) * scaleZ)))
+
+      return calibratedJoints
+
+   def uncalibrate(self, x, y, z):
+      '''Returns the device coordinates (floats, within the calibrated range) of Virtual World
+         coordinates x, y, z'''
+
+      oldX = self.minX
+      oldY = self.minY
+      oldZ = self.minZ
+      if self.scaleX != 0: oldX = self.minX + x / self.scaleX
+      if self.scaleY != 0: oldY = self.minY + y / self.scaleY
+      if self.scaleZ != 0: oldZ = self.minZ + z / self.scaleZ
+
+      return float(oldX), float(oldY), float(oldZ)
+
+
+def scale(minValue, maxValue, virtualMax):
+   '''Returns how many Virtual World units (0 to virtualMax) there are per device unit, for a
+      device range of minValue to maxValue (0 if the range is empty)'''
+
+   if maxValue <= minValue:
+      return 0.0
+   return float(virtualMax) / (maxValue - minValue)
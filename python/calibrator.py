@@ -14,10 +14,9 @@
 from osc import OscOut
 from osc import OscIn
 from threading import *
+from array import array
 import sys
-import pickle
 import socket
-from gui import *
 
 # how often to get data from the Kinect (frames per second)
 # (increase to get data more often, but this slows down the system)
@@ -25,6 +24,23 @@ from gui import *
 # the corresponding kuatroKinectClient
 FRAME_RATE = 30 
 
+# calibration finds the space a device senses from the coordinates it sends - but a few of them are wild
+# (the Kinect sometimes puts a joint metres away), so the bounds are percentiles of the coordinates
+# (e.g., 1 and 99 leave out the lowest and highest 1%), not their min and max
+LOW_PERCENTILE = 1.0
+HIGH_PERCENTILE = 99.0
+
+# coordinates are counted in histograms of BIN_SIZE millimetre bins, from HISTOGRAM_MIN to HISTOGRAM_MAX
+# (coordinates outside it are counted in the first or last bin), so counting takes no memory,
+# however long calibration runs
+HISTOGRAM_MIN = -10000
+HISTOGRAM_MAX = 20000
+BIN_SIZE = 10
+BIN_COUNT = (HISTOGRAM_MAX - HISTOGRAM_MIN) / BIN_SIZE
+
+# fewest coordinates to calibrate from (with fewer, calibration keeps the bounds it had)
+MIN_SAMPLES = 100
+
 class Calibrator():
 
    ##### OSC Namespace #####
@@ -35,10 +51,11 @@ class Calibrator():
    CALIBRATE_DEVICE_MESSAGE = "/kuatro/calibrateDevice"
 
 
-   def __init__(self, clientID):
+   def __init__(self, clientID, calibrationStore = None, lowPercentile = LOW_PERCENTILE, highPercentile = HIGH_PERCENTILE):
 
       # initializing variables
       self.clientID = clientID                                                # used to identify the tied client
+      self.calibrationStore = calibrationStore                                # where calibrations are kept (see calibrationStore.py - None to keep them nowhere)
       self.minX = None                                                        # used to store current calibration data
       self.minY = None
       self.minZ = None
@@ -46,23 +63,54 @@ class Calibrator():
       self.maxY = None
       self.maxZ = None 
 
+      self.lowPercentile = lowPercentile                                      # which percentiles of the coordinates are the bounds
+      self.highPercentile = highPercentile
+      self.histogramX = array('l', [0] * BIN_COUNT)                           # how many coordinates fell in each bin (while calibrating)
+      self.histogramY = array('l', [0] * BIN_COUNT)
+      self.histogramZ = array('l', [0] * BIN_COUNT)
+      self.sampleCount = 0                                                    # how many coordinates were counted
+
 
    ####################################
    ######## Helper Functions ##########
    ####################################
 
    def calibrate(self, x, y, z):
-      '''Finds min and max of coordinate data'''
-
-      # update min values (if needed)
-      self.minX = min(x, self.minX)
-      self.minY = min(y, self.minY)
-      self.minZ = min(z, self.minZ)
-
-      # update max values (if needed)
-      self.maxX = max(x, self.maxX)
-      self.maxY = max(y, self.maxY)
-      self.maxZ = max(z, self.maxZ)
+      '''Counts a coordinate (see calibrateJoints, to count a frame's worth at once)'''
+
+      self.calibrateJoints([(0, 0, x, y, z)])
+
+   def calibrateJoints(self, joints):
+      '''Counts the coordinates of a list of (jointID, trackingState, x, y, z) joints (e.g., all the
+         joints of a body frame), in the histograms the bounds are found from (see calibrationStop)'''
+
+      histogramX = self.histogramX
+      histogramY = self.histogramY
+      histogramZ = self.histogramZ
+      last = BIN_COUNT - 1
+
+      for jointID, trackingState, x, y, z in joints:
+         binX = int((x - HISTOGRAM_MIN) / BIN_SIZE)
+         binY = int((y - HISTOGRAM_MIN) / BIN_SIZE)
+         binZ = int((z - HISTOGRAM_MIN) / BIN_SIZE)
+         histogramX[min(max(binX, 0), last)] += 1
+         histogramY[min(max(binY, 0), last)] += 1
+         histogramZ[min(max(binZ, 0), last)] += 1
+
+      self.sampleCount = self.sampleCount + len(joints)
+
+   def percentile(self, histogram, percent):
+      '''Returns (to within BIN_SIZE) the coordinate 'percent' percent of the counted coordinates are below'''
+
+      needed = percent / 100.0 * self.sampleCount
+      seen = 0
+      for i in range(BIN_COUNT):
+         seen = seen + histogram[i]
+         if seen >= needed and seen > 0:
+            if percent >= 50:
+               return HISTOGRAM_MIN + (i + 1) * BIN_SIZE   # the bin's upper edge (for upper bounds)
+            return HISTOGRAM_MIN + i * BIN_SIZE            # or its lower edge (for lower bounds)
+      return HISTOGRAM_MAX
       
 
    def getCalibratedData():
@@ -76,77 +124,61 @@ class Calibrator():
    ####################################
 
    def setup(self):
-      '''Check for existing calibration data on file, if there: return it, if not: return None'''
-
-      # Try to load the file if it is there...
-      try:
-         # load serialized data
-
-         # Uncomment out if too many files are being created by pickle.
-         # Make sure to uncomment the same line in calibrationStop
-         calibrationFile = open( self.clientID + ".calibrationData.p", "rb" )   # open the file to read calibration data (apend clientID to file for unique ID)
-         calibrationData = pickle.load(calibrationFile)        # read calibration data
-         calibrationFile.close()                               # close the file
-
-         # min and max values loaded from the file
-         self.minX = calibrationData["minX"]
-         self.minY = calibrationData["minY"]
-         self.minZ = calibrationData["minZ"]
-         self.maxX = calibrationData["maxX"]
-         self.maxY = calibrationData["maxY"]
-         self.maxZ = calibrationData["maxZ"]
-
-         return [self.minX, self.minY, self.minZ, self.maxX, self.maxY, self.maxZ, True]
-         
-         print "Kinect Calibrated:", self.clientID
-         print "Min Values", self.minX, self.minY, self.minZ
-         print "Max Values", self.maxX, self.maxY, self.maxZ
-      
-      # The file was not there, so let the user know there is no calibration data
-      except:
-         # should only reach here if server has never been calibrated.
+      '''Looks up the device's calibration in the calibration store (in memory, so no file I/O).  Returns
+         the 6 calibration values followed by True if there is one - or else default values
+         followed by False.'''
+
+      bounds = None
+      if self.calibrationStore is not None:
+         bounds = self.calibrationStore.get(self.clientID)
+
+      if bounds is not None:
+         self.useBounds(bounds)
+         return bounds + [True]
+
+      # should only reach here if the device has never been calibrated.
 
-         # There is no calibration data so let's send default values (default values are estimates of actual Kinect bounds)
-         minX = -5000
-         minY = -3000
-         minZ = 0
-         maxX = 5000
-         maxY = 3000
-         maxZ = 15000
+      # There is no calibration data so let's send default values (default values are estimates of actual Kinect bounds)
+      self.useBounds([-5000, -3000, 0, 5000, 3000, 15000])
+      return [self.minX, self.minY, self.minZ, self.maxX, self.maxY, self.maxZ, False]
 
-         return [minX, minY, minZ, maxX, maxY, maxZ, False]
+   def useBounds(self, bounds):
+      '''Makes 'bounds' (minX, minY, minZ, maxX, maxY, maxZ) the current calibration data (e.g., when
+         a calibration is rolled back, or the calibration store was edited)'''
 
-         print "No calibration data found for Kinect:", self.clientID
-         print "Using default values. Please run calibration process."
+      self.minX, self.minY, self.minZ, self.maxX, self.maxY, self.maxZ = bounds
 
 
    def  calibrationStart(self):
       ''' This is the Calibration Start Menu Item Callback function. It is 
           used to calibrate the Kinect Device with the installation space. '''
       
-      # Recalibrating so resetting starting min and max values to arbitary high and low values
-      self.minX = 1000000000  # set min values to an arbitrary high value so we know that min values will be smaller
-      self.minY = 1000000000
-      self.minZ = 1000000000
-      self.maxX = -1000000000 # set max values to an arbitrary low value so we know that max values will be larger
-      self.maxY = -1000000000
-      self.maxZ = -1000000000
+      # Recalibrating so start counting coordinates from scratch (the bounds stay, until calibrationStop)
+      self.histogramX = array('l', [0] * BIN_COUNT)
+      self.histogramY = array('l', [0] * BIN_COUNT)
+      self.histogramZ = array('l', [0] * BIN_COUNT)
+      self.sampleCount = 0
 
 
    def calibrationStop(self):
       ''' Callback function for the Menu Item, Stop.  Stops the Calbration process 
           and sends the updated information to the server '''
 
-      # save data with pickle
-      calibrationData = { "minX" : self.minX , "minY" : self.minY , "minZ" : self.minZ , "maxX" : self.maxX , "maxY" : self.maxY , "maxZ" : self.maxZ }
-
-      # Uncomment out if too many files are being created by pickle.
-      # Make sure to uncomment the same line in calibrateWithServer
-
-      calibrationFile = open( self.clientID + ".calibrationData.p", "wb" )   # open file to write data (apend clientID to file for unique ID)
-      pickle.dump( calibrationData,  calibrationFile)       # write calibration data
-      calibrationFile.close()                               # close the file
-
+      # the bounds are percentiles of the coordinates counted (so wild ones do not stretch them)
+      if self.sampleCount >= MIN_SAMPLES:
+         self.minX = self.percentile(self.histogramX, self.lowPercentile)
+         self.minY = self.percentile(self.histogramY, self.lowPercentile)
+         self.minZ = self.percentile(self.histogramZ, self.lowPercentile)
+         self.maxX = self.percentile(self.histogramX, self.highPercentile)
+         self.maxY = self.percentile(self.histogramY, self.highPercentile)
+         self.maxZ = self.percentile(self.histogramZ, self.highPercentile)
+
+         # save it, as a new version, in the calibration store (written in the background, so this does not wait on the disk)
+         if self.calibrationStore is not None:
+            self.calibrationStore.put(self.clientID, [self.minX, self.minY, self.minZ, self.maxX, self.maxY, self.maxZ])
+      else:
+         # (the calibration it keeps is already in the store - another version of it would only push older ones out)
+         print "Only", self.sampleCount, "coordinates received from", self.clientID + " - keeping its calibration"
 
       return [self.minX, self.minY, self.minZ, self.maxX, self.maxY, self.maxZ] # send final data to server
          
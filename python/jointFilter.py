@@ -0,0 +1,108 @@
+# jointFilter.py
+#
+# Smoothing of joint positions with the One-Euro filter (Casiez, Roussel and Vogel, 2012).
+#
+# Joint positions reported by a depth sensor jitter by a few millimetres from frame to frame,
+# even when the user stands still.  The One-Euro filter is a low-pass filter whose cutoff
+# frequency follows the speed of the joint: slow joints are smoothed a lot (no jitter), and
+# fast joints are smoothed little (no lag).  It is tuned with:
+#
+#    minCutoff        - cutoff frequency (Hz) of a joint standing still (lower means less jitter)
+#    beta             - how much the cutoff rises with speed, per millimetre per second (higher means less lag)
+#    derivativeCutoff - cutoff frequency (Hz) used to smooth the speed itself
+#
+# A JointFilter keeps the state of every joint of every body of one device in arrays
+# allocated up front, and filters the joints of a body all at once.  The Kuatro Client has
+# a numpy version of it, which filters whole skeleton frames (see skeletonFilter.py).
+#
+# This module is shared by the Kuatro Client (CPython) and the Kuatro Server (Jython),
+# so it must stay compatible with both.
+
+import math
+from array import array
+
+MIN_CUTOFF = 1.0          # Hz
+BETA = 0.007              # per mm/s
+DERIVATIVE_CUTOFF = 1.0   # Hz
+
+DEFAULT_FRAME_TIME = 1.0 / 30   # time between frames (seconds), when it cannot be measured
+
+
+def smoothingFactor(cutoff, frameTime):
+   '''Returns how much of a new value to blend in (0 to 1), for a low-pass filter with the given
+      cutoff frequency (Hz), when values arrive 'frameTime' seconds apart.'''
+
+   timeConstant = 1.0 / (2 * math.pi * cutoff)
+   return 1.0 / (1.0 + timeConstant / frameTime)
+
+
+class JointFilter():
+   ''' One-Euro filters for all joints of all bodies seen by one device. '''
+
+   def __init__(self, bodyCount=6, jointCount=25, minCutoff=MIN_CUTOFF, beta=BETA, derivativeCutoff=DERIVATIVE_CUTOFF):
+
+      self.bodyCount = bodyCount
+      self.jointCount = jointCount
+      self.minCutoff = minCutoff
+      self.beta = beta
+      self.derivativeCutoff = derivativeCutoff
+
+      # state of each joint of each body (joint 'j' of body 'b' is at index b * jointCount + j,
+      # and its x, y, z at three times that)
+      size = bodyCount * jointCount
+      self.positions = array('d', [0.0] * (size * 3))    # filtered x, y, z
+      self.speeds = array('d', [0.0] * (size * 3))       # filtered speed along x, y, z (mm per second)
+      self.times = array('d', [0.0] * size)              # when the joint was last filtered (seconds)
+      self.valid = array('b', [0] * size)                # 1 if the joint has been filtered before
+
+   def filterBody(self, userID, time, joints):
+      '''Returns the joints of a body - a list of (jointID, trackingState, x, y, z) - with their
+         positions smoothed.  'time' is when the frame was captured (in seconds).  Bodies with
+         IDs beyond the filter's size are returned as they are.'''
+
+      if userID >= self.bodyCount:
+         return joints
+
+      positions = self.positions
+      speeds = self.speeds
+      minCutoff = self.minCutoff
+      beta = self.beta
+
+      filtered = []
+      for jointID, trackingState, x, y, z in joints:
+
+         slot = userID * self.jointCount + jointID
+         frameTime = time - self.times[slot]
+         self.times[slot] = time
+
+         if not self.valid[slot] or x == 0 and y == 0 and z == 0:  # new (or lost) joint, so start over from here
+            self.valid[slot] = int(x != 0 or y != 0 or z != 0)
+            base = slot * 3
+            positions[base], positions[base + 1], positions[base + 2] = x, y, z
+            speeds[base] = speeds[base + 1] = speeds[base + 2] = 0.0
+            filtered.append((jointID, trackingState, x, y, z))
+            continue
+
+         if frameTime <= 0:
+            frameTime = DEFAULT_FRAME_TIME
+         speedFactor = smoothingFactor(self.derivativeCutoff, frameTime)
+
+         base = slot * 3
+         index = base
+         for value in (x, y, z):
+            speed = speeds[index] + speedFactor * ((value - positions[index]) / frameTime - speeds[index])
+            speeds[index] = speed
+            factor = smoothingFactor(minCutoff + beta * abs(speed), frameTime)
+            positions[index] = positions[index] + factor * (value - positions[index])
+            index = index + 1
+
+         filtered.append((jointID, trackingState, positions[base], positions[base + 1], positions[base + 2]))
+
+      return filtered
+
+   def reset(self, userID):
+      '''Forgets a body (e.g., when its user is lost), so its next joints are not smoothed towards old ones.'''
+
+      if userID < self.bodyCount:
+         for slot in range(userID * self.jointCount, (userID + 1) * self.jointCount):
+            self.valid[slot] = 0
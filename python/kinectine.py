@@ -30,6 +30,7 @@ from random import *
 from music import *
 from osc import *
 from time import time
+from bodyFrame import decodeBodies, isNewFrame
 
 import math
 
@@ -86,6 +87,12 @@ class Kinectine():
    HAND_STATE_MESSAGE = "/kuatro/handState"
    REGISTER_VIEW_MESSAGE = "/kuatro/registerView"
    PROCESSING_MESSAGE = "/kuatro/processing"
+   BODY_FRAME_MESSAGE = "/kuatro/bodyFrame"
+   WORLD_STATE_MESSAGE = "/kuatro/worldState"
+   SNAPSHOT_MESSAGE = "/kuatro/snapshot"
+   RESYNC_MESSAGE = "/kuatro/resync"
+
+   RESYNC_DELAY = 1.0   # least time between asking the server for a snapshot (seconds)
 
    def __init__(self, incomingPort = 60606, kuatroServerIP = "localhost", kuatroServerOscPort = 50505, processingOscPort = 57111):
    
@@ -103,6 +110,18 @@ class Kinectine():
       # (key is a userID (as returned by Kinect), value is a KinectineUser object)
       self.kinectineUsers = {}
 
+      # sequence number of the last body frame received from the server (used to skip duplicate frames)
+      self.lastFrameSequence = None
+
+      # sequence number of the last world state received from the server (when it broadcasts them),
+      # and how many we missed
+      self.lastWorldStateSequence = None
+      self.worldStatesMissed = 0
+
+      # version of the set of users, as last heard from the server (see updateSnapshot), and
+      # when we last asked for a snapshot because we missed a new or lost user
+      self.stateVersion = None
+      self.lastResyncTime = 0
 
       ######### Server-to-View API ############
       try:
@@ -116,6 +135,9 @@ class Kinectine():
          oscIn.onInput(Kinectine.HAND_STATE_MESSAGE, self.makeMusic)
          oscIn.onInput(Kinectine.PROCESSING_MESSAGE, self.visualizeWithProcessing)
          oscIn.onInput(Kinectine.JOINT_COORDINATES_MESSAGE, self.updateJoints)
+         oscIn.onInput(Kinectine.BODY_FRAME_MESSAGE, self.updateBodyFrame)
+         oscIn.onInput(Kinectine.WORLD_STATE_MESSAGE, self.updateWorldState)
+         oscIn.onInput(Kinectine.SNAPSHOT_MESSAGE, self.updateSnapshot)
 
       except:
          print "Error:  Unable to setup OSC In port. Port may already be in use."
@@ -125,15 +147,21 @@ class Kinectine():
 
       # ipAddress = socket.gethostbyname(socket.getfqdn())   # find the computer's IP Address
       ipAddress = "localhost"
+      self.ipAddress = ipAddress        # where the server reaches us (to ask it for snapshots)
+      self.incomingPort = incomingPort
 
       # Setup OSC Out and send the message
       try:
          oscOut = OscOut(kuatroServerIP, kuatroServerOscPort)           # configure OSC Out port and add to list of ports
+         self.oscOut = oscOut
          print "OSC Out Configured.  Sending messages to", kuatroServerIP, "on", kuatroServerOscPort
 
-         oscOut.sendMessage(Kinectine.REGISTER_VIEW_MESSAGE, ipAddress, incomingPort)         # send osc message through osc port
+         # tell the server which joints and message types we use (so devices send only those)
+         joints = [SPINE_BASE, SHOULDER_LEFT, HAND_LEFT, SHOULDER_RIGHT, HAND_RIGHT]
+         messages = [Kinectine.HAND_STATE_MESSAGE, Kinectine.PROCESSING_MESSAGE]
+         oscOut.sendMessage(Kinectine.REGISTER_VIEW_MESSAGE, ipAddress, incomingPort, len(joints), *(joints + messages))   # send osc message through osc port
          print "\nSent message to:", kuatroServerIP
-         print "  Data:", ipAddress, incomingPort
+         print "  Data:", ipAddress, incomingPort, joints, messages
 
       except Exception, e:
          print e
@@ -191,6 +219,8 @@ class Kinectine():
 
          print "Added User:", userID, "Location:", x, y, z
 
+      if len(args) > 4:   # the server's state version (see updateSnapshot)
+         self.checkStateVersion(args[4])
          
    def removeUser(self, message):
       ''' Callback function for LOST USER messages.  Removes the specified user from the view '''
@@ -207,6 +237,51 @@ class Kinectine():
 
          print "Removed User:", userID
 
+      if len(args) > 1:   # the server's state version (see updateSnapshot)
+         self.checkStateVersion(args[1])
+
+   def updateSnapshot(self, message):
+      ''' Callback function for SNAPSHOT messages.  Replaces the known users with all users in the
+          virtual world, as the server sees them:
+               stateVersion, userCount, (userID, x, y, z) * userCount
+
+          The server sends one when we register (so we know users that were already there), and
+          when we ask (see checkStateVersion).  New and lost user messages after it carry the next
+          stateVersion. '''
+
+      args = message.getArguments()
+      stateVersion = args[0]
+      userCount = args[1]
+
+      users = {}
+      for i in range(userCount):
+         userID, x, y, z = args[2 + i*4], args[3 + i*4], args[4 + i*4], args[5 + i*4]
+         if userID in self.kinectineUsers.keys():   # keep the users we know (and their state)
+            users[ userID ] = self.kinectineUsers[ userID ]
+         else:
+            users[ userID ] = KinectineUser( x, y, z, self.display )
+            print "Added User:", userID, "Location:", x, y, z
+
+      for userID in self.kinectineUsers.keys():
+         if userID not in users:
+            print "Removed User:", userID
+
+      self.kinectineUsers = users
+      self.stateVersion = stateVersion
+
+   def checkStateVersion(self, stateVersion):
+      ''' Follows the server's state version (one more with every new and lost user), and asks the
+          server for a snapshot if we missed one (at most once every RESYNC_DELAY seconds) '''
+
+      if self.stateVersion is not None and stateVersion > self.stateVersion + 1:
+         if time() - self.lastResyncTime >= Kinectine.RESYNC_DELAY:
+            self.lastResyncTime = time()
+            print "Missed", stateVersion - self.stateVersion - 1, "user changes - asking for a snapshot"
+            self.oscOut.sendMessage(Kinectine.RESYNC_MESSAGE, self.ipAddress, self.incomingPort)
+
+      if self.stateVersion is None or stateVersion > self.stateVersion:
+         self.stateVersion = stateVersion
+
 
    # callback function for HAND_STATE_MESSAGE
    def makeMusic(self, message):
@@ -265,6 +340,55 @@ class Kinectine():
          
 
 
+   # callback function for BODY_FRAME_MESSAGE
+   def updateBodyFrame(self, message):
+      """Updates joint data and hand states of all users in a frame (see bodyFrame.py)."""
+
+      # parse arguments from the OSC message.
+      args = message.getArguments()
+      frameSequence = args[0]
+
+      # skip frames we have already seen, or that arrived after a newer one
+      if not isNewFrame(frameSequence, self.lastFrameSequence):
+         return
+      self.lastFrameSequence = frameSequence
+
+      self.updateBodies(decodeBodies(args, 1))
+
+   # callback function for WORLD_STATE_MESSAGE
+   def updateWorldState(self, message):
+      """Updates joint data and hand states of all users in the virtual world (laid out like a body frame)."""
+
+      # parse arguments from the OSC message.
+      args = message.getArguments()
+      worldStateSequence = args[0]
+
+      # skip world states we have already seen, or that arrived after a newer one (and count the ones we missed)
+      if not isNewFrame(worldStateSequence, self.lastWorldStateSequence):
+         return
+      if self.lastWorldStateSequence is not None and worldStateSequence > self.lastWorldStateSequence + 1:
+         self.worldStatesMissed = self.worldStatesMissed + worldStateSequence - self.lastWorldStateSequence - 1
+      self.lastWorldStateSequence = worldStateSequence
+
+      self.updateBodies(decodeBodies(args, 1))
+
+   def updateBodies(self, bodies):
+      """Updates joint data and hand states of the given bodies (see bodyFrame.py)."""
+
+      for userID, leftHandState, rightHandState, joints in bodies:
+
+         if userID in self.kinectineUsers.keys():  # is this an existing user? 
+
+            # first update all joints, so that hand pitch and depth are current...
+            user = self.kinectineUsers[ userID ]
+            for jointID, trackingState, x, y, z in joints:
+               user.updateJoints( jointID, x, y, z )
+
+            # ...and then let the hands play
+            user.makeMusic( "left", leftHandState )
+            user.makeMusic( "right", rightHandState )
+         
+
 #################################################
 # User class - instrument supports multiple users
 #################################################
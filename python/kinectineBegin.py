@@ -3,8 +3,10 @@
 # This file starts all the components of the VisualVeil
 
 from kinectineServer import * 
+from kuatroServerDisplay import KuatroServerDisplay
 from kinectine import *
 
 server = KuatroServer(verbose = 0)   # start server
+serverDisplay = KuatroServerDisplay(server)   # and a window to watch and calibrate it
 
 view = Kinectine()   # start view
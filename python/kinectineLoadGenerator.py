@@ -0,0 +1,129 @@
+# kinectineLoadGenerator.py
+#
+# The Kuatro Load Generator simulates several Kuatro Kinect Clients at once, each tracking
+# up to six procedurally animated bodies (see skeletonSimulator.py).  Each simulated client
+# registers with the Kuatro Server as a separate device, and sends the same OSC messages
+# a real Kinect Client would (new and lost users, joint coordinates, and hand states),
+# at the given frame rate.
+#
+# This is used to find out how many sensors (and users) the Kuatro Server and the views
+# can keep up with.
+#
+# Usage (all arguments are optional):
+#
+#    python kinectineLoadGenerator.py --sensors 4 --users 6 --rate 30 --seconds 60
+#
+# Add --messages to send one message per joint (instead of body frames), and --smooth to
+# smooth joint positions before sending them.
+#
+#  See README file for full instructions on using the Kuatro System
+
+
+from kuatroClient import KuatroClient
+from skeletonFilter import SkeletonFilter
+from skeletonFrame import newFrame, BODY_COUNT
+from skeletonSimulator import SimulatedBody
+from jointConstants import TRACKED
+
+from time import sleep, perf_counter
+
+import argparse
+
+SERVER_IP_ADDRESS = "localhost"
+SERVER_PORT = 50505
+
+class KuatroSimulatedClient(KuatroClient):
+
+    def __init__(self, clientID, userCount=BODY_COUNT, frameRate=30, serverIpAddress=SERVER_IP_ADDRESS, serverPort=SERVER_PORT, seed=0):
+
+        # establish connection to server and register the client with the Kuatro Server
+        KuatroClient.__init__(self, clientID, serverIpAddress, serverPort)
+
+        # the bodies this client tracks (each client gets different ones)
+        self.bodies = [SimulatedBody(seed * BODY_COUNT + i) for i in range(min(userCount, BODY_COUNT))]
+
+        self.frameRate = frameRate  # how many frames to send per second
+        self.frame = newFrame()     # the latest skeleton frame (reused for every frame)
+        self.framesSent = 0         # how many frames we sent
+        self.lateFrames = 0         # how many frames we could not send on time
+
+    def updateFrame(self, t):
+        ''' Moves the simulated bodies to where they are at time 't' (in seconds) '''
+
+        for userID in range(len(self.bodies)):
+            body = self.bodies[userID]
+            present = body.isPresent(t)
+
+            self.frame['tracked'][userID] = present
+            if present:
+                self.frame['positions'][userID] = body.joints(t)
+                self.frame['trackingStates'][userID] = TRACKED
+                self.frame['handStates'][userID] = body.handStates(t)
+
+    def run(self):
+        '''Sends simulated frames at the client's frame rate, until stopped '''
+
+        period = 1.0 / self.frameRate  # time between frames
+        deadline = perf_counter()      # when the next frame is due
+
+        while self.isRunning:
+
+            t = perf_counter() - self.startTime
+            self.frame['timestamp'] = t
+            self.frame['sequence'] = self.framesSent
+            self.updateFrame(t)
+
+            self.sendFrame(self.frame)
+            self.framesSent = self.framesSent + 1
+
+            # sleep until the next frame is due (the time spent on this frame counts towards the wait)
+            deadline = deadline + period
+            delay = deadline - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            else:
+                self.lateFrames = self.lateFrames + 1
+                deadline = perf_counter()  # we fell behind, so start over instead of rushing to catch up
+
+        self.removeAllUsers()  # done, so the server should forget our users
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Simulates several Kuatro Kinect Clients.")
+    parser.add_argument("--sensors", type=int, default=1, help="number of simulated clients (default 1)")
+    parser.add_argument("--users", type=int, default=BODY_COUNT, help="bodies tracked by each client (default 6)")
+    parser.add_argument("--rate", type=float, default=30, help="frames per second sent by each client (default 30)")
+    parser.add_argument("--seconds", type=float, default=60, help="how long to run (default 60)")
+    parser.add_argument("--server", default=SERVER_IP_ADDRESS, help="Kuatro Server IP address")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="Kuatro Server port")
+    parser.add_argument("--messages", action="store_true", help="send one message per joint, instead of body frames")
+    parser.add_argument("--smooth", action="store_true", help="smooth joint positions before sending them")
+    options = parser.parse_args()
+
+    clients = []
+    for sensor in range(options.sensors):
+        client = KuatroSimulatedClient("sim-" + str(sensor), options.users, options.rate, options.server, options.port, seed=sensor)
+        client.sendBodyFrames = not options.messages
+        if options.smooth:
+            client.skeletonFilter = SkeletonFilter()
+        clients.append(client)
+
+    print("Simulating " + str(options.sensors) + " clients, " + str(options.users) + " users each, at " +
+          str(options.rate) + " frames per second")
+
+    for client in clients:
+        client.start()
+
+    try:
+        sleep(options.seconds)
+    except KeyboardInterrupt:
+        pass
+
+    for client in clients:
+        client.stop()
+    for client in clients:
+        client.clientThread.join()
+
+    for client in clients:
+        print(client.stats() + "\n   " + str(client.lateFrames) + " frames late")
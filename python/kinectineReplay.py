@@ -0,0 +1,116 @@
+# kinectineReplay.py
+#
+# The Kuatro Replay Client plays back a skeleton recording (see skeletonRecording.py),
+# made with the Kuatro Kinect Client, e.g.,
+#
+#    python kinectineClient.py session.skel
+#
+# It sends exactly the same OSC traffic to the Kuatro Server as the Kinect Client did
+# while recording, so the server and views can be tested without a Kinect (or on any
+# machine).  Frames may be replayed in real time, faster (or slower), or as fast as possible.
+#
+# Usage:
+#
+#    python kinectineReplay.py session.skel [speed] [serverIpAddress] [serverPort]
+#
+# where speed is 1 for real time (the default), 2 for twice as fast, etc., and 0 for as
+# fast as possible.
+#
+#  See README file for full instructions on using the Kuatro System
+
+
+from kuatroClient import KuatroClient
+from skeletonRecording import SkeletonRecording
+
+from time import sleep, perf_counter
+
+import sys
+
+SERVER_IP_ADDRESS = "localhost"
+SERVER_PORT = 50505
+
+class KuatroReplayClient(KuatroClient):
+
+    def __init__(self, filename, speed=1.0, serverIpAddress=SERVER_IP_ADDRESS, serverPort=SERVER_PORT, clientID=None, loop=False):
+
+        self.recording = SkeletonRecording(filename)  # the frames to replay
+        self.speed = speed                             # how fast to replay them (0 means as fast as possible)
+        self.loop = loop                               # start over when we reach the end of the recording?
+
+        # replay as the device that made the recording, unless told otherwise
+        if clientID is None:
+            clientID = self.recording.clientID
+
+        # establish connection to server and register the client with the Kuatro Server
+        KuatroClient.__init__(self, clientID, serverIpAddress, serverPort)
+
+        self.framesSent = 0  # how many frames we replayed
+
+    def replay(self, start=0.0):
+        ''' Replays the recording once, starting 'start' seconds into it '''
+
+        frames = self.recording.frames
+        first = self.recording.seek(start)  # find where to start
+
+        if first >= len(frames):  # nothing to replay
+            return
+
+        startTime = perf_counter()                      # when we started replaying
+        firstTimestamp = frames['timestamp'][first]     # and when the first frame was recorded
+
+        for index in range(first, len(frames)):
+
+            if not self.isRunning:
+                break
+
+            frame = frames[index]
+
+            # wait until it's time to send this frame (relative to the start, so that delays do not add up)
+            if self.speed > 0:
+                due = startTime + (frame['timestamp'] - firstTimestamp) / self.speed
+                delay = due - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+
+            self.sendFrame(frame)
+            self.framesSent = self.framesSent + 1
+
+    def run(self):
+        '''Replays the recording (once, or until stopped if looping) '''
+
+        elapsed = perf_counter()
+
+        self.replay()
+        while self.loop and self.isRunning:
+            self.removeAllUsers()  # the recording starts over, with its own users
+            self.replay()
+
+        self.removeAllUsers()  # done, so the server should forget our users
+        elapsed = perf_counter() - elapsed
+
+        print("Replayed " + str(self.framesSent) + " frames in " + str(round(elapsed, 2)) + " seconds (" +
+              str(round(self.framesSent / max(elapsed, 0.001), 1)) + " frames per second)")
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("Usage: python kinectineReplay.py recording [speed] [serverIpAddress] [serverPort]")
+        sys.exit(1)
+
+    filename = sys.argv[1]
+    speed = 1.0
+    serverIpAddress = SERVER_IP_ADDRESS
+    serverPort = SERVER_PORT
+
+    if len(sys.argv) > 2:
+        speed = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        serverIpAddress = sys.argv[3]
+    if len(sys.argv) > 4:
+        serverPort = int(sys.argv[4])
+
+    replayClient = KuatroReplayClient(filename, speed, serverIpAddress, serverPort)  # Create the Replay Client
+    print("Replaying " + str(len(replayClient.recording)) + " frames (" + str(round(replayClient.recording.duration(), 1)) +
+          " seconds) as " + replayClient.clientID)
+    replayClient.start()
@@ -8,10 +8,52 @@
 # The normalized data is also sent, via OSC, to one or more Kuatro Views,
 # as specified by the project's interaction design.
 #
+# The server itself has no GUI (so it runs on machines without a display).  To watch and
+# calibrate it from a window, attach a KuatroServerDisplay (see kuatroServerDisplay.py), as
+# running this file does (unless it is run with --headless).
+#
 # See README file for full instructions on using the Kuatro System
 #
 #
 #  LOG:
+#     17-Oct-26:  Processing coordinates of body frames carry the virtual world user ID (as other messages to views do)
+#     17-Oct-26:  Calibrations are kept in one calibration store (see calibrationStore.py), read once at startup, written
+#                 in the background, versioned (so a bad calibration can be rolled back), and reloaded when edited
+#     17-Oct-26:  Calibration bounds are percentiles of the coordinates (counted in histograms, a frame at a time),
+#                 so a few wild coordinates no longer stretch them (see calibrator.py)
+#     17-Oct-26:  Views may declare the users and region of the virtual world they care about, and each view is
+#                 sent only the joints, message types, users and region it declared (see viewFilter.py)
+#     17-Oct-26:  Views get a snapshot of the users in the virtual world when they register (or ask for one), and
+#                 new and lost user messages carry a state version, so views can tell when they missed one
+#     17-Oct-26:  Users not seen for a while, and all users of devices that went silent, are removed (and the views
+#                 told they are lost), so lost lost-user messages and crashed clients do not leave users behind
+#     17-Oct-26:  Sharded deployment - several servers (workers) each own the devices an aggregator hands
+#                 them, and the aggregator relays their messages to the views (see kuatroAggregator.py)
+#     17-Oct-26:  The server runs headless - calibration start/stop and device selection are OSC messages, and
+#                 the GUI is an optional front-end that attaches to it (see kuatroServerDisplay.py)
+#     17-Oct-26:  Verbose mode records user tracking data and messages sent to views in a trace ring buffer
+#                 (see traceBuffer.py) instead of printing them, dumped to a file on demand or when a handler fails
+#     17-Oct-26:  Runtime metrics (see serverMetrics.py) - per-device, per-message-type and per-view counters,
+#                 rates and handler times, available as JSON through /kuatro/stats and a periodic dump to a file
+#     17-Oct-26:  Each device's calibration is compiled into a CalibrationTransform (see calibrationTransform.py),
+#                 replaced as a whole when the device is calibrated again, and applied to all joints of a frame at once
+#     17-Oct-26:  Optional broadcast mode - views get one world state message (all users) per tick, at a
+#                 fixed rate, instead of every body frame and joint as it arrives
+#     17-Oct-26:  Messages to views are queued and sent from a ViewSender thread per view (see viewSender.py),
+#                 so a slow view does not hold up the server (joint coordinates may be replaced by newer ones)
+#     17-Oct-26:  Incoming messages only update counters - the display (device lights, message rates,
+#                 and the calibration background) is refreshed by one fixed-rate timer
+#     17-Oct-26:  Each device is a KuatroDevice record (calibration, light, calibrator, counters and users),
+#                 found by its clientID with a single dictionary lookup, instead of parallel lists
+#     17-Oct-26:  The server pushes each device's calibration to it, and devices send calibrated body frames
+#                 (coordinates already normalized to the virtual world, packed as 16-bit integers)
+#     17-Oct-26:  Joint positions may be smoothed (One-Euro filter, see jointFilter.py) before calibration
+#     17-Oct-26:  Views declare the joints and message types they use when they register, and the server
+#                 pushes the union of them to the devices, so devices only send what some view uses
+#     17-Oct-26:  Body frames may carry only the joints that moved (keyframes carry all of them), 
+#                 so the server keeps each device's skeletons to relay complete skeletons to the views
+#     17-Oct-26:  Body frames are numbered, so duplicate and late frames are skipped
+#     17-Oct-26:  Added body frames - one message per device frame carrying all users, joints and hand states
 #     03-Nov-17:  Updated to include a GUI to track client input and facilitate calibration
 #     30-Oct-17:  Updated with the ability to track multiple joints as well as hand states
 #     26-Oct-17:  Updated to include server-side calibration for clients
@@ -25,10 +67,57 @@
 
 
 from osc import OscIn, OscOut
-from gui import *
-from music import *
 from calibrator import Calibrator
+from calibrationStore import CalibrationStore
+from bodyFrame import decodeBodies, decodeCalibratedBodies, isNewFrame, COORDINATE_MAX
+from jointFilter import JointFilter
+from viewSender import ViewSender
+from viewFilter import parseViewRegistration, groupViews, sendFilteredValue, sendFilteredBodies
+from calibrationTransform import CalibrationTransform
+from serverMetrics import ServerMetrics, toJson
+from traceBuffer import TraceBuffer, messageType, FRAME, FRAME_SKIPPED, NEW_USER, LOST_USER, JOINT, VIEW_MESSAGE, ERROR
+from threading import Thread, Lock, Event
 import sys
+import time
+
+
+class KuatroDevice():
+   ''' Everything the Kuatro Server knows about a registered device (depth sensor). '''
+
+   def __init__(self, clientID, index):
+
+      self.clientID = clientID           # unique ID of the device
+      self.index = index                 # position of the device in the order devices registered (as shown on the display)
+
+      self.calibrator = None             # the device's calibrator
+      self.isSelected = False            # whether to include this device during calibration
+      self.calibrationFound = True       # whether calibration data was found on file (if not, the device should be calibrated)
+
+      self.calibration = None            # maps device coordinates to the virtual world (a CalibrationTransform, replaced whenever the device is calibrated)
+      self.calibrationVersion = 0        # increased whenever calibration changes
+
+      self.oscOut = None                 # OSC Port to the device, if it listens for messages (e.g., subscriptions)
+      self.frameSequence = None          # sequence number of the last body frame received from the device
+      self.skeletons = {}                # the latest calibrated joints of the device's users, as {userID: {jointID: joint}}
+      self.jointFilter = None            # smooths the device's joint positions (when smoothing)
+      self.users = {}                    # maps the device's user IDs to Virtual World user IDs
+      self.userLastSeen = {}             # when each of the device's users was last seen (seconds), as {userID: time}
+      self.lastSeen = time.time()        # when the device last sent anything (found from its counters, see expireUsers)
+
+      # counters
+      self.framesReceived = 0            # body frames processed
+      self.framesSkipped = 0             # body frames skipped (duplicate, late, or using an old calibration)
+      self.messagesReceived = 0          # other messages (joint coordinates, hand states, new and lost users)
+
+      # the counters at the last rate update (to find the rates since then), and the rates
+      self.lastFramesReceived = 0
+      self.lastFramesSkipped = 0
+      self.lastMessagesReceived = 0
+      self.lastActivity = 0              # framesReceived + framesSkipped + messagesReceived, when expireUsers last looked
+      self.frameRate = 0.0               # body frames processed per second
+      self.skipRate = 0.0                # body frames skipped per second
+      self.messageRate = 0.0             # other messages per second
+
 
 class KuatroServer():
 
@@ -41,66 +130,152 @@ class KuatroServer():
    CALIBRATE_DEVICE_MESSAGE = "/kuatro/calibrateDevice"
    REGISTER_VIEW_MESSAGE = "/kuatro/registerView"
    PROCESSING_MESSAGE = "/kuatro/processing"
-
-   def __init__(self, port = 50505, verbose = 0):
+   BODY_FRAME_MESSAGE = "/kuatro/bodyFrame"
+   SUBSCRIPTION_MESSAGE = "/kuatro/subscription"
+   CALIBRATION_MESSAGE = "/kuatro/calibration"
+   WORLD_STATE_MESSAGE = "/kuatro/worldState"
+   STATS_MESSAGE = "/kuatro/stats"
+   CALIBRATION_START_MESSAGE = "/kuatro/calibrationStart"
+   CALIBRATION_STOP_MESSAGE = "/kuatro/calibrationStop"
+   SELECT_DEVICE_MESSAGE = "/kuatro/selectDevice"
+   DUMP_TRACE_MESSAGE = "/kuatro/dumpTrace"
+   CALIBRATED_FRAME_MESSAGE = "/kuatro/calibratedFrame"
+   SNAPSHOT_MESSAGE = "/kuatro/snapshot"
+   RESYNC_MESSAGE = "/kuatro/resync"
+   ROLLBACK_CALIBRATION_MESSAGE = "/kuatro/rollbackCalibration"
+
+   SPINE_BASE = 0                   # Kinect joint ID used as a user's location in the virtual world
+   HAND_LEFT = 7                    # Kinect joint ID forwarded to the processing view
+
+   # what views that do not declare which joints and message types they use are sent
+   # (SPINE_BASE, SHOULDER_LEFT, ELBOW_LEFT, HAND_LEFT, SHOULDER_RIGHT, ELBOW_RIGHT, HAND_RIGHT, and all message types)
+   DEFAULT_VIEW_JOINTS = [0, 4, 5, 7, 8, 9, 11]
+   DEFAULT_VIEW_MESSAGES = [HAND_STATE_MESSAGE, PROCESSING_MESSAGE]
+
+   # messages to views that only matter until a newer one about the same thing (values), as {address: n},
+   # where the first n arguments say what it is about (e.g., the user ID and joint ID of joint coordinates).
+   # Views may miss older values if they fall behind - all other messages (events) are always delivered.
+   # (Body frames are values too, one per device - see updateBodies.)
+   VALUE_MESSAGES = {JOINT_COORDINATES_MESSAGE: 2, HAND_STATE_MESSAGE: 2, PROCESSING_MESSAGE: 1}
+
+   def __init__(self, port = 50505, verbose = 0, smoothing = False, broadcastRate = 0, statsFile = None,
+                firstUserID = 0, userIDStep = 1, calibrationFile = "kuatroCalibrations.tsv"):
 
       # *** add comments below
-      self.nextUserID = 0              # used to find the next available user ID (this is never decremented so IDs are not reused)
-      self.deviceUsers = {}            # maps a device user ID (combination of user ID and client ID) to a corresponding Virtual World user ID (This is needed so we can send views an integer value for the User ID)
+      self.nextUserID = firstUserID    # used to find the next available user ID (this is never decremented so IDs are not reused)
+      self.userIDStep = userIDStep     # how far apart user IDs are (workers of a sharded server take every n-th ID, see kuatroAggregator.py)
       self.virtualUsers = {}           # stores Virtual World User IDs and each user's coordinates within the Virtual World
+                                       # (each device maps its own user IDs to Virtual World user IDs, so we can send views an integer value for the User ID)
 
-      self.devices = []                # stores a list of clients/devices which have connected to the server
-      self.calibrators = []            # stores a list of the calibrators the server has created in the form [calibrator, isActiveCheckbox]
-      self.deviceLights = []           # stores circle "lights" for each registered device that show data flow
+      self.devices = {}                # stores the clients/devices which have connected to the server, as {clientID: KuatroDevice}
+      self.deviceList = []             # and the same devices, in the order they registered (a device's index is its position here)
 
       self.viewInfo = []               # stores a tuple including the IP Address and Port of all registered view.  Used to ensure that that same view does not register multiple times. 
-      self.viewPorts = []              # stores the OSC Port to all registered views
-      self.deviceCalibrationData = {}  # stores calibration data from calibrators
+      self.viewSenders = []            # stores the View Senders (OSC Port and queue) of all registered views
+      self.viewGroups = []             # and the same View Senders, grouped by their views' filters (see viewFilter.py)
+      self.viewSubscriptions = {}      # stores the joints and message types each view uses, as {(ipAddress, port): (joints, messages)}
+      self.subscription = ([KuatroServer.SPINE_BASE], [])  # the joints and message types devices should send (what the server and views use)
+      self.viewFrameSequence = 0       # sequence number of the next body frame sent to the views
+      self.stateVersion = 0            # version of the set of users in the virtual world (increased with every new and lost user)
+      self.stateLock = Lock()          # users are added and removed from more than one thread, so versions and snapshots take turns
+      self.broadcastRate = broadcastRate  # how many world states to send views per second (0 to send every body frame and joint as it arrives instead)
+      self.worldState = {}             # the latest joints and hand states of all users (when broadcasting), as {virtualWorldUserID: (leftHandState, rightHandState, joints)}
+      self.worldStateChanged = False   # whether the world state changed since it was last sent
+      self.worldStateSequence = 0      # sequence number of the next world state sent to the views
+      self.smoothing = smoothing       # whether to smooth the joint positions sent by devices (to remove jitter)
       self.calibrating = False         # whether the server is currently calibrating or not
-      self.lightDelay = 500            # delay between resetting device lights
+      self.calibrationDataReceived = False  # whether coordinates came in for calibration (a display may clear it, to see if more come in)
+      self.rateDelay = 0.5             # time between rate updates (seconds)
+      self.sweepDelay = 1.0            # time between looking for silent users and devices (seconds)
+      self.userTimeout = 10.0          # users not seen for this long are removed (their lost user message may have been lost)
+      self.deviceTimeout = 5.0         # devices silent for this long lose all their users (e.g., the client crashed)
+      self.lastRateTime = time.time()  # when the rates were last updated
+
+      self.calibrationStore = CalibrationStore(calibrationFile)  # all devices' calibrations (read once, here - see calibrationStore.py)
+      self.reloadDelay = 2.0           # time between looking for changes to the calibration store's file (seconds)
+
+      self.metrics = ServerMetrics()   # message counts and handler times
+      self.statsFile = statsFile       # file to append the server's metrics to, every statsDelay (None for no file)
+      self.statsDelay = 10             # time between metrics dumps (seconds)
+      self.statsOscOuts = {}           # stores the OSC Port to each address that asked for the metrics, as {(ipAddress, port): oscOut}
 
       # the max coordinates of the Virtual World
       self.virtualMaxX = 1000
       self.virtualMaxY = 1000
       self.virtualMaxZ = 750    # Virtual World is 2D using X and Z values
       
-      self.verbose = verbose  # turn on logging of user tracking. 0 = Off, 1 = User Tracking Data, 2 = User Tracking plus Echo OSC Messages
+      self.verbose = verbose  # turn on logging of user tracking. 0 = Off, 1 = User Tracking Data (traced), 2 = User Tracking plus Echo OSC Messages
 
+      # user tracking data is recorded in a trace (not printed, so it does not slow the server down)
+      self.trace = None                # the trace buffer (when verbose)
+      if verbose != 0:
+         self.trace = TraceBuffer()
+      self.traceFile = "kuatroTrace.bin"  # file to dump the trace to (read it with traceBuffer.py)
+      self.traceDelay = 10             # least time between dumps when handlers fail (seconds)
+      self.lastTraceDump = 0           # when the trace was last dumped because a handler failed
+
+
+      self.closed = Event()            # set when the server is closed (see close)
 
       # configure OSC protocol communication
+      self.oscIn = None
       try:
 
-         oscIn = OscIn(port)
+         self.oscIn = oscIn = OscIn(port)
          oscIn.hideMessages()  #***
 
          # if verbose logging is set to 2 turn on echo message
          if verbose == 2:
             oscIn.onInput("/.*", self.echoMessage)
          
-         # the Client-to-Server API
-         oscIn.onInput(KuatroServer.NEW_USER_MESSAGE, self.addUser)
-         oscIn.onInput(KuatroServer.LOST_USER_MESSAGE, self.removeUser)
-         oscIn.onInput(KuatroServer.JOINT_COORDINATES_MESSAGE, self.handleUserData)
-         oscIn.onInput(KuatroServer.HAND_STATE_MESSAGE, self.echoHandState)
-         oscIn.onInput(KuatroServer.REGISTER_DEVICE_MESSAGE, self.registerDevice)
-         oscIn.onInput(KuatroServer.PROCESSING_MESSAGE, self.visualize)
-
-         # the View-to-Server API
-         oscIn.onInput(KuatroServer.REGISTER_VIEW_MESSAGE, self.registerView)
+         handlers = [
+            # the Client-to-Server API
+            (KuatroServer.NEW_USER_MESSAGE, self.addUser),
+            (KuatroServer.LOST_USER_MESSAGE, self.removeUser),
+            (KuatroServer.JOINT_COORDINATES_MESSAGE, self.handleUserData),
+            (KuatroServer.HAND_STATE_MESSAGE, self.echoHandState),
+            (KuatroServer.REGISTER_DEVICE_MESSAGE, self.registerDevice),
+            (KuatroServer.PROCESSING_MESSAGE, self.visualize),
+            (KuatroServer.BODY_FRAME_MESSAGE, self.handleBodyFrame),
+            (KuatroServer.CALIBRATED_FRAME_MESSAGE, self.handleCalibratedFrame),
+
+            # the View-to-Server API
+            (KuatroServer.REGISTER_VIEW_MESSAGE, self.registerView),
+            (KuatroServer.RESYNC_MESSAGE, self.handleResync),
+
+            # calibration (for front-ends, e.g., the KuatroServerDisplay, or scripts)
+            (KuatroServer.CALIBRATION_START_MESSAGE, self.handleCalibrationStart),
+            (KuatroServer.CALIBRATION_STOP_MESSAGE, self.handleCalibrationStop),
+            (KuatroServer.SELECT_DEVICE_MESSAGE, self.handleSelectDevice),
+            (KuatroServer.ROLLBACK_CALIBRATION_MESSAGE, self.handleRollbackCalibration),
+
+            # metrics and trace (for monitoring tools)
+            (KuatroServer.STATS_MESSAGE, self.handleStatsQuery),
+            (KuatroServer.DUMP_TRACE_MESSAGE, self.handleDumpTrace)]
+
+         # count every message, and time its handler
+         for address, handler in handlers:
+            oscIn.onInput(address, self.metrics.timed(address, handler, self.handlerFailed))
 
       except:
          print "Error:  Unable to setup OSC In port. Port " + port + " may already be in use."
 
-      # create calibration GUI
-      self.display = Display("Kuatro Server", 600, 600, 0, 0, Color.BLACK)
+      # update the rates at a fixed rate (incoming messages only update counters)
+      self.repeat(self.rateDelay, self.updateRates)
+
+      # remove users (and devices' users) that went silent
+      self.repeat(self.sweepDelay, self.expireUsers)
 
-      # create Menu for calibration
-      calibrateMenu = Menu("Calibrate") 
-      calibrateMenu.addItemList(["Start", "Stop"], [self.calibrationStart, self.calibrationStop])
-      self.display.addMenu(calibrateMenu)
+      # apply calibrations edited in the calibration store's file (or written by other servers)
+      self.repeat(self.reloadDelay, self.reloadCalibrations)
 
-      # add label for instructions
-      self.instructions = self.display.drawLabel("Select Calibrate > Start to start the calibration process.", 20, 75, Color.WHITE)
+      # append the metrics to the stats file every so often (if given)
+      if self.statsFile is not None:
+         self.repeat(self.statsDelay, self.dumpStats)
+
+      # send the world state to views at a fixed rate (if broadcasting)
+      if self.broadcastRate > 0:
+         self.repeat(1.0 / self.broadcastRate, self.sendWorldState)
 
 
 
@@ -140,25 +315,37 @@ class KuatroServer():
       z = args[3]
       clientID = args[4]
 
-      user = (userID, clientID)  # make user from each device unique by creating tuple with userID and client id
+      device = self.devices.get(clientID)
+      if device is None:   # not a device we know
+         return
+      device.messagesReceived = device.messagesReceived + 1
+
       #### Update Virutal World with new User
-      if user not in self.deviceUsers:     # make sure user does not already exist
+      if userID not in device.users:     # make sure user does not already exist (user IDs are unique per device)
+         newX, newY, newZ = self.calibrateUserCoordinates(x, y, z, device)   # get new set of user coordinates calibrated to the Virtual World
+         self.addVirtualUser(device, userID, newX, newY, newZ)
+
+   def addVirtualUser(self, device, userID, newX, newY, newZ):
+      ''' Gives a device's user a Virtual World user ID, and tells the views about the new user
+          (at the given calibrated coordinates, followed by the new stateVersion - see sendSnapshot) '''
 
+      virtualWorldUserID = self.nextUserID   # get a new user ID for the virtual World
+      self.nextUserID = self.nextUserID + self.userIDStep  # increment user ID
 
-         virtualWorldUserID = self.nextUserID   # then get a new user ID for the virtual World
-         self.nextUserID = self.nextUserID + 1  # increment user ID
+      if self.trace is not None:
+         self.trace.record(NEW_USER, device.index, virtualWorldUserID, -1, userID)
 
-         self.deviceUsers[user] = virtualWorldUserID  # map user to virtual world ID 
-        
-         newX, newY, newZ = self.calibrateUserCoordinates(x, y, z, clientID)   # get new set of user coordinates calibrated to the Virtual World
+      self.stateLock.acquire()
+      try:
+         device.users[userID] = virtualWorldUserID  # map user to virtual world ID 
+         device.userLastSeen[userID] = time.time()
          self.virtualUsers[virtualWorldUserID] = (newX, newY, newZ)            # update User dictionary with new user and tuple of user coordinates
 
-         if self.verbose !=0:
-            print "Added User:", virtualWorldUserID, "Coords:", newX, newY, newZ
+         self.stateVersion = self.stateVersion + 1
+         self.sendMessage(KuatroServer.NEW_USER_MESSAGE, virtualWorldUserID, newX, newY, newZ, self.stateVersion)  # send message with calibrated user coordinates to registered views
+      finally:
+         self.stateLock.release()
 
-         self.sendMessage(KuatroServer.NEW_USER_MESSAGE, virtualWorldUserID, newX, newY, newZ)  # send message with calibrated user coordinates to registered views
-
-         
 
 
    def removeUser(self, message):
@@ -172,22 +359,43 @@ class KuatroServer():
       userID = args[0]
       clientID = args[1]
 
-      user = (userID, clientID)
+      device = self.devices.get(clientID)
+      if device is None:   # not a device we know
+         return
+      device.messagesReceived = device.messagesReceived + 1
+
+      self.forgetUser(device, userID)
+
+   def forgetUser(self, device, userID):
+      ''' Removes a device's user from the Virtual World (if it is there), and tells the views
+          (called for lost users, and for users that went silent - see expireUsers).  The lost user
+          message is followed by the new stateVersion (see sendSnapshot). '''
 
       ##### Remove user from Virtual World
-      if user in self.deviceUsers:                     # verify that user exists in virtual world
-         virtualWorldUserID = self.deviceUsers[user]      # then get the virtual world user ID           
-         del self.virtualUsers[virtualWorldUserID]        # and remove user from user dictionaries
-         del self.deviceUsers[user]
+      virtualWorldUserID = device.users.pop(userID, None)   # (the sweeper and the OSC listener may both try)
+      if virtualWorldUserID is None:                        # the user is not in the virtual world
+         return
+
+      device.userLastSeen.pop(userID, None)
+      if virtualWorldUserID in self.worldState:
+         self.worldState.pop(virtualWorldUserID, None)
+         self.worldStateChanged = True
 
-         self.sendMessage(KuatroServer.LOST_USER_MESSAGE, virtualWorldUserID)  # send lost user message to registered views
+      device.skeletons.pop(userID, None)                   # and forget the user's joints
+      if device.jointFilter is not None:
+         device.jointFilter.reset(userID)
 
-         # if there are no users during calibration, set display to RED
-         if self.calibrating and not self.deviceUsers:
-            self.display.setColor(Color.RED)
+      self.stateLock.acquire()
+      try:
+         self.virtualUsers.pop(virtualWorldUserID, None)   # remove user from user dictionaries
+
+         self.stateVersion = self.stateVersion + 1
+         self.sendMessage(KuatroServer.LOST_USER_MESSAGE, virtualWorldUserID, self.stateVersion)  # send lost user message to registered views
+      finally:
+         self.stateLock.release()
 
-         if self.verbose !=0:
-            print "Removed User:", virtualWorldUserID
+      if self.trace is not None:
+         self.trace.record(LOST_USER, device.index, virtualWorldUserID, -1, userID)
 
 
    def handleUserData(self, message):
@@ -206,38 +414,208 @@ class KuatroServer():
       trackingState = args[5]
       clientID = args[6]
 
-      user = (userID, clientID)
-
-      # this device is transmitting data, turn its dataLight green
-      lightSet = self.deviceLights[self.devices.index(clientID)]
-      light = lightSet[0]
-      light.setColor(Color.GREEN)
+      device = self.devices.get(clientID)
+      if device is None:   # not a device we know
+         return
+      device.messagesReceived = device.messagesReceived + 1
 
       ##### Calibration
       if self.calibrating: # if we're calibrating, forward the coordinate data to the right calibrator
-         calSet = self.calibrators[self.devices.index(clientID)]
-         calibrator = calSet[0]
-         isActiveCheckbox = calSet[1]
-
-         if isActiveCheckbox.isChecked(): # if the calibrator is supposed to be calibrated, send it data
-            calibrator.calibrate(x, y, z)
+         if device.isSelected: # if the calibrator is supposed to be calibrated, send it data
+            device.calibrator.calibrate(x, y, z)
 
          # we are calibrating and a user is in the space (we're receiving data)
-         # set display background to GREEN
-         self.display.setColor(Color.GREEN)
+         self.calibrationDataReceived = True
 
       ##### Update User Coordinates      
-      if user in self.deviceUsers:                           # verify that user exists in device users
+      if userID in device.users:                             # verify that user exists in device users
+
+         virtualWorldUserID = device.users[userID]                             # then get the virtual world user ID    
+         device.userLastSeen[userID] = time.time()
+         newX, newY, newZ = self.calibrateUserCoordinates(x, y, z, device)     # get calibrated coordinates for user
+         if jointID == KuatroServer.SPINE_BASE:                                # (a user is located at their SPINE_BASE)
+            self.virtualUsers[virtualWorldUserID] = (newX, newY, newZ)         # add new coordinates user dictionary
+
+         if self.broadcastRate > 0:   # update the world state (with the joint replaced)
+            leftHandState, rightHandState, joints = self.worldState.get(virtualWorldUserID, (0, 0, []))
+            joints = [joint for joint in joints if joint[0] != jointID]
+            joints.append((jointID, trackingState, newX, newY, newZ))
+            self.worldState[virtualWorldUserID] = (leftHandState, rightHandState, joints)
+            self.worldStateChanged = True
+
+         else:                        # send message with calibrated user coordinates
+            self.sendMessage(KuatroServer.JOINT_COORDINATES_MESSAGE, virtualWorldUserID, jointID, trackingState, newX, newY, newZ)  
+
+         if self.trace is not None:
+            self.trace.record(JOINT, device.index, virtualWorldUserID, jointID, trackingState)
+
+   def handleBodyFrame(self, message):
+      ''' Moves all users seen by a device to their new locations in the virtual world, 
+          and relays the whole frame to the views as a single message.  The OSC Message
+          should contain the values:
+               clientID, frameSequence, captureTime, isKeyframe, bodyCount, 
+               (userID, leftHandState, rightHandState, jointCount, 
+               (jointID, trackingState, x, y, z) * jointCount) * bodyCount
+          (see bodyFrame.py).  Keyframes carry all joints of all users; other frames
+          only carry the joints that moved, so the rest are taken from the device's skeletons.
+      '''
 
-         virtualWorldUserID = self.deviceUsers[user]                           # then get the virtual world user ID    
-         newX, newY, newZ = self.calibrateUserCoordinates(x, y, z, clientID)   # get calibrated coordinates for user
-         self.virtualUsers[virtualWorldUserID] = (newX, newY, newZ)            # add new coordinates user dictionary
+      # parse arguments from OSC Message
+      args = message.getArguments()
+      clientID = args[0]
+      frameSequence = args[1]
+      captureTime = args[2]
+      isKeyframe = args[3]
+
+      device = self.devices.get(clientID)
+      if device is None:   # not a device we know
+         return
+
+      # skip frames we have already seen, or that arrived after a newer one
+      if not isNewFrame(frameSequence, device.frameSequence):
+         device.framesSkipped = device.framesSkipped + 1
+         if self.trace is not None:
+            self.trace.record(FRAME_SKIPPED, device.index, -1, -1, frameSequence)
+         return
+      device.frameSequence = frameSequence
+
+      if self.trace is not None:
+         self.trace.record(FRAME, device.index, -1, -1, frameSequence)
+
+      bodies = decodeBodies(args, 4)
+      self.updateBodies(device, captureTime, isKeyframe, bodies, False)
+
+   def handleCalibratedFrame(self, message):
+      ''' Same as handleBodyFrame(), for devices that calibrate their own coordinates (see 
+          sendCalibration()).  The OSC Message should contain the values:
+               deviceIndex, frameSequence, captureTime, isKeyframe, calibrationVersion, bodyCount, 
+               (userID, leftHandState, rightHandState, jointCount, 
+               (packedJoint1, packedJoint2) * jointCount) * bodyCount
+          where deviceIndex is the device's index (see KuatroDevice), and each joint is
+          packed into two integers (see bodyFrame.py).
+      '''
+
+      # parse arguments from OSC Message
+      args = message.getArguments()
+      deviceIndex = args[0]
+      frameSequence = args[1]
+      captureTime = args[2]
+      isKeyframe = args[3]
+      calibrationVersion = args[4]
+
+      if deviceIndex >= len(self.deviceList):   # not a device we know
+         return
+      device = self.deviceList[deviceIndex]
+
+      # the device used an old calibration (e.g., it missed an update), so tell it again, and skip the frame
+      if calibrationVersion != self.getCalibrationVersion(device):
+         device.framesSkipped = device.framesSkipped + 1
+         if self.trace is not None:
+            self.trace.record(FRAME_SKIPPED, device.index, -1, -1, frameSequence)
+         self.sendCalibration(device)
+         return
+
+      # skip frames we have already seen, or that arrived after a newer one
+      if not isNewFrame(frameSequence, device.frameSequence):
+         device.framesSkipped = device.framesSkipped + 1
+         if self.trace is not None:
+            self.trace.record(FRAME_SKIPPED, device.index, -1, -1, frameSequence)
+         return
+      device.frameSequence = frameSequence
+
+      if self.trace is not None:
+         self.trace.record(FRAME, device.index, -1, -1, frameSequence)
+
+      bodies = decodeCalibratedBodies(args, 5, self.virtualMaxX, self.virtualMaxY, self.virtualMaxZ)
+      self.updateBodies(device, captureTime, isKeyframe, bodies, True)
+
+   def updateBodies(self, device, captureTime, isKeyframe, bodies, calibrated):
+      ''' Moves the users in a device's body frame to their new locations in the virtual world,
+          and relays the frame to the views.  'calibrated' says whether the joint coordinates are
+          already calibrated (virtual world coordinates), or as measured by the device. '''
+
+      ##### Smoothing (of coordinates as measured by the device - calibrated ones are smoothed by the device)
+      if self.smoothing and not calibrated:
+         if device.jointFilter is None:
+            device.jointFilter = JointFilter()
+         jointFilter = device.jointFilter
+         frameTime = captureTime / 1000.0   # in seconds
+         bodies = [(userID, leftHandState, rightHandState, jointFilter.filterBody(userID, frameTime, joints))
+                   for userID, leftHandState, rightHandState, joints in bodies]
+
+      device.framesReceived = device.framesReceived + 1
+
+      ##### Calibration
+      if self.calibrating and bodies and not calibrated: # if we're calibrating, forward the coordinate data to the right calibrator
+         calibrator = device.calibrator
+
+         if device.isSelected: # if the calibrator is supposed to be calibrated, send it the whole frame at once
+            frameJoints = []
+            for userID, leftHandState, rightHandState, joints in bodies:
+               frameJoints.extend(joints)
+            calibrator.calibrateJoints(frameJoints)
+
+         # we are calibrating and a user is in the space (we're receiving data)
+         self.calibrationDataReceived = True
+
+      ##### Update Device Skeletons
+      if isKeyframe:   # a keyframe replaces everything we know about the device's users
+         device.skeletons = {}
+      skeletons = device.skeletons
+
+      calibration = device.calibration   # the whole frame is calibrated the same way (even if the device is calibrated meanwhile)
+      now = time.time()                  # when the frame's users were last seen
+
+      ##### Update User Coordinates
+      viewBodies = []   # the frame, as seen by the views (virtual world user IDs and coordinates)
+      for userID, leftHandState, rightHandState, joints in bodies:
+
+         if userID not in skeletons:
+            skeletons[userID] = {}
+         skeleton = skeletons[userID]
+
+         if calibrated:
+            calibratedJoints = joints
+         else:
+            calibratedJoints = calibration.calibrateJoints(joints)   # get calibrated coordinates for all the user's joints at once
+         skeleton.update([(joint[0], joint) for joint in calibratedJoints])   # and remember them
+
+         # a user the device still sends, but is not in the virtual world (its new user message was lost,
+         # or it was silent for so long it expired), is added again
+         if userID not in device.users and KuatroServer.SPINE_BASE in skeleton:
+            newX, newY, newZ = skeleton[KuatroServer.SPINE_BASE][2:]
+            self.addVirtualUser(device, userID, newX, newY, newZ)
+
+         if userID in device.users and skeleton:                # verify that user exists in device users
+
+            device.userLastSeen[userID] = now
+
+            virtualWorldUserID = device.users[userID]           # then get the virtual world user ID    
+            viewJoints = skeleton.values()                      # views get the complete skeleton
+            self.virtualUsers[virtualWorldUserID] = skeleton.get(KuatroServer.SPINE_BASE, viewJoints[0])[2:]   # add new coordinates user dictionary
+            viewBodies.append((virtualWorldUserID, leftHandState, rightHandState, viewJoints))
 
-         # send message with calibrated user coordinates
-         self.sendMessage(KuatroServer.JOINT_COORDINATES_MESSAGE, virtualWorldUserID, jointID, trackingState, newX, newY, newZ)  
+            for jointID, trackingState, x, y, z in joints:
+               if jointID == KuatroServer.HAND_LEFT:   # the processing view follows the left hand (uncalibrated, as sent by the device)
+                  if calibrated:
+                     x, y, z = calibration.uncalibrate(x, y, z)
+                  self.sendMessage(KuatroServer.PROCESSING_MESSAGE, virtualWorldUserID, x, y)
+
+            if self.broadcastRate > 0:   # update the world state
+               self.worldState[virtualWorldUserID] = (leftHandState, rightHandState, viewJoints)
+               self.worldStateChanged = True
+
+            if self.trace is not None:
+               for jointID, trackingState, newX, newY, newZ in calibratedJoints:   # (the joints in this frame)
+                  self.trace.record(JOINT, device.index, virtualWorldUserID, jointID, trackingState)
+
+      # send one message with all calibrated user coordinates (numbered, so views can skip duplicates)
+      # - a view that falls behind gets only the device's latest frame (when broadcasting, views get the world state instead)
+      if viewBodies and self.broadcastRate == 0:
+         self.sendBodiesMessage((KuatroServer.BODY_FRAME_MESSAGE, device.clientID), KuatroServer.BODY_FRAME_MESSAGE,
+                                self.viewFrameSequence, viewBodies)
+         self.viewFrameSequence = self.viewFrameSequence + 1
 
-         if self.verbose !=0:
-            print "User:", virtualWorldUserID, "Joint:", jointID, "Coords:", newX, newY, newZ
 
    def echoHandState(self, message):
       ''' Sends the state of existing user's hand to View. The OSC Message
@@ -251,17 +629,23 @@ class KuatroServer():
       handState = args[2]
       clientID = args[3]
 
-      user = (userID, clientID)
+      device = self.devices.get(clientID)
+      if device is None:   # not a device we know
+         return
+      device.messagesReceived = device.messagesReceived + 1
 
       ##### Update User Hand State
-      if user in self.deviceUsers:
-         virtualWorldUserID = self.deviceUsers[user]
+      if userID in device.users:
+         virtualWorldUserID = device.users[userID]
          self.sendMessage(KuatroServer.HAND_STATE_MESSAGE, virtualWorldUserID, hand, handState)
 
    def registerDevice(self, message):
       ''' Registers a device with the Kuatro Server.  The OSC Message should
           contain the values: 
-               clientID, sensorType
+               clientID, replyIpAddress, replyPort
+
+          where replyIpAddress and replyPort are where the device listens for messages
+          from the server (devices that do not listen leave them out).
       '''
 
       # parse the arguments from the OSC Message
@@ -269,16 +653,23 @@ class KuatroServer():
       clientID = args[0]
 
       # have we already registered this client?
-      try:
-         self.devices.index(clientID) # if we haven't registered, throw an exception
+      device = self.devices.get(clientID)
+      if device is not None:
          print "Client Reconnected:", clientID # if we have already registered, client must have reconnected
 
-      except ValueError: # we haven't registered, do so now
-         self.devices.append(clientID)
+         # a reregistering device numbers its frames from scratch (and starts with a keyframe)
+         device.frameSequence = None
+         device.skeletons = {}
+         device.jointFilter = None
 
-         # create a Calibrator and add the device to devices list
-         calibrator = Calibrator(clientID)
-         startingValues = calibrator.setup() # returns an array of 6 starting calibration values followed by a boolean of if a data file existed
+      else: # we haven't registered, do so now
+         device = KuatroDevice(clientID, len(self.deviceList))
+         self.devices[clientID] = device
+         self.deviceList.append(device)
+
+         # create a Calibrator for the device
+         device.calibrator = Calibrator(clientID, self.calibrationStore)
+         startingValues = device.calibrator.setup() # returns an array of 6 starting calibration values followed by a boolean of if the store had some
 
          minX = startingValues[0]
          minY = startingValues[1]
@@ -288,27 +679,19 @@ class KuatroServer():
          maxZ = startingValues[5]
          dataFound = startingValues[6]
 
-         self.calibrateDevice([minX, minY, minZ, maxX, maxY, maxZ], clientID) # update calibration data
+         self.calibrateDevice([minX, minY, minZ, maxX, maxY, maxZ], device) # update calibration data
 
+         device.calibrationFound = dataFound
          if not dataFound: # if there was no calibration data found, inform the user they need to run the calibration process
-            self.display.drawLabel("No calibration data found.  Please run calibration process.", 20, 20, Color.WHITE)
-         
-         isActiveCheckbox = Checkbox("") # create a checkbox representing whether or not to include this device during calibration
-         self.calibrators.append([calibrator, isActiveCheckbox])
-
-         # add device to the display
-         radius = 7
-         horizontal = self.devices.index(clientID)*20 + 20
-      
-         dataLight = Circle(horizontal+10, 525, radius, Color.GREEN, True) # a "light" which is green when this client receives data, grey otherwise
-         timer = Timer(self.lightDelay, self.resetLight, [dataLight], True)  # continually turn light grey if no data coming in
-         timer.start()
-         self.deviceLights.append([dataLight, timer])
-         self.display.add(dataLight)
-         deviceLabel = self.display.drawLabel(str(self.devices.index(clientID)), horizontal+radius, 500, Color.WHITE) # create a label for the device
-         self.display.add(isActiveCheckbox, horizontal, 540)
+            print "No calibration data found for", clientID + ".  Please run calibration process."
 
          print "Client Registered:", clientID
+
+      # tell the device which joints and message types to send, and how to calibrate its coordinates
+      if len(args) >= 3:
+         device.oscOut = OscOut(args[1], args[2])
+         self.sendSubscription(device)
+         self.sendCalibration(device)
          
 
 
@@ -317,25 +700,116 @@ class KuatroServer():
       ''' Callback function for Kuatro View Registration. To register with this server,
           views send an OSC message containing the IP address and OSC Port of the view
           to the server.  The server then creates list of OSC connections to all registered
-          views. '''
+          views.
+
+          Views may also declare the joints and message types they use, and the users and
+          region of the virtual world they care about:
+               ipAddress, port, jointCount, jointID*jointCount, messageType*,
+                  ["users", userCount, userID*userCount], ["region", minX, minY, minZ, maxX, maxY, maxZ]
+
+          (e.g., "localhost", 60606, 2, 7, 11, "/kuatro/handState", "region", 0, 0, 0, 500, 1000, 750).
+          Devices are asked to send only what some view (or the server itself) uses, and each view
+          is sent only what it declared (see viewFilter.py).  Views that do not declare them get
+          DEFAULT_VIEW_JOINTS and DEFAULT_VIEW_MESSAGES. '''
 
       # parse arguments from OSC Message
       args = message.getArguments()
-      ipAddress = args[0]
-      port = args[1]
+      ipAddress, port, viewFilter = parseViewRegistration(args, KuatroServer.DEFAULT_VIEW_JOINTS, KuatroServer.DEFAULT_VIEW_MESSAGES)
+
+      self.viewSubscriptions[(ipAddress, port)] = (viewFilter.joints, viewFilter.messages)  # a view may change them by registering again
+      self.updateSubscription()
 
-      # When a view registers with the server an OSC Out port is created and added to the 
-      # list of ports.  When sending OSC messages, the server will send the same message 
-      # to all OSC Ports.  
+      # When a view registers with the server a View Sender (an OSC Out port with its own queue
+      # and thread) is created and added to the list of senders.  When sending OSC messages, the
+      # server queues the same message with all View Senders.
 
       if (ipAddress, port) not in self.viewInfo:  # only add view if it is not already registered
          try:     
-            self.viewInfo.append((ipAddress, port))          # add view details to 
-            self.viewPorts.append(OscOut(ipAddress, port))   # configure OSC Out port and add to list of ports
+            self.viewInfo.append((ipAddress, port))                 # add view details to 
+            self.viewSenders.append(ViewSender(ipAddress, port))    # configure OSC Out port and add to list of senders
             print "OSC Configured.  Sending messages to", ipAddress, "on", port
          except Exception, e:
             print e
             sys.exit(1)
+
+      viewSender = self.viewSenders[self.viewInfo.index((ipAddress, port))]
+      viewSender.viewFilter = viewFilter             # send the view only what it wants
+      self.viewGroups = groupViews(self.viewSenders)   # (replaced as a whole, as messages are being sent)
+
+      # tell the view about the users already in the virtual world (it may have just started, or restarted)
+      self.sendSnapshot(viewSender)
+
+   def handleResync(self, message):
+      ''' Sends a view the users in the virtual world again (see sendSnapshot), e.g., when it
+          missed a new or lost user message.  The OSC Message should contain the values:
+               ipAddress, port
+
+          where the view registered (see registerView).
+      '''
+
+      args = message.getArguments()
+      if (args[0], args[1]) in self.viewInfo:   # only registered views
+         self.sendSnapshot(self.viewSenders[self.viewInfo.index((args[0], args[1]))])
+
+   def sendSnapshot(self, viewSender):
+      ''' Sends a view all users in the virtual world, as one SNAPSHOT_MESSAGE:
+               stateVersion, userCount, (userID, x, y, z) * userCount
+
+          Every new and lost user message after it carries the next stateVersion (as its last value),
+          so a view that sees one skipped knows it missed something, and may ask for a snapshot
+          again (see handleResync).  Joints come with the next body frame.
+      '''
+
+      self.stateLock.acquire()
+      try:
+         args = [self.stateVersion, 0]
+         for device in self.deviceList:
+            for virtualWorldUserID in device.users.values():
+               x, y, z = self.virtualUsers.get(virtualWorldUserID, (0, 0, 0))
+               args.extend([virtualWorldUserID, x, y, z])
+               args[1] = args[1] + 1
+
+         viewSender.sendEvent(KuatroServer.SNAPSHOT_MESSAGE, tuple(args))   # queued behind the messages before it
+      finally:
+         self.stateLock.release()
+
+   def updateSubscription(self):
+      ''' Finds the joints and message types the views (and the server itself) use, and if they
+          changed, tells all devices '''
+
+      joints = [KuatroServer.SPINE_BASE]   # the server uses it as the user's location
+      messages = []
+      for viewJoints, viewMessages in self.viewSubscriptions.values():
+         for jointID in viewJoints:
+            if jointID not in joints:
+               joints.append(jointID)
+         for messageType in viewMessages:
+            if messageType not in messages:
+               messages.append(messageType)
+
+      # the server turns HAND_LEFT into processing messages
+      if KuatroServer.PROCESSING_MESSAGE in messages and KuatroServer.HAND_LEFT not in joints:
+         joints.append(KuatroServer.HAND_LEFT)
+
+      joints.sort()
+      messages.sort()
+
+      if (joints, messages) != self.subscription:
+         self.subscription = (joints, messages)
+         print "Devices now send joints", joints, "and messages", messages
+         for device in self.deviceList:
+            self.sendSubscription(device)
+
+   def sendSubscription(self, device):
+      ''' Tells a device which joints and message types to send.  The OSC Message contains:
+               jointCount, jointID*jointCount, messageType*
+      '''
+
+      if device.oscOut is None:   # the device does not listen
+         return
+
+      joints, messages = self.subscription
+      device.oscOut.sendMessage(KuatroServer.SUBSCRIPTION_MESSAGE, len(joints), *(joints + messages))
             
 
    ####################################
@@ -344,53 +818,126 @@ class KuatroServer():
 
 
    def calibrationStart(self):
+      ''' Starts the Calibration process - the selected devices' calibrators find the space
+          each device can sense, from the coordinates it sends, until calibrationStop() '''
+
+      if self.calibrating:   # already calibrating
+         return
 
       # start calibrating
       self.calibrating = True
+      self.calibrationDataReceived = False
 
-      # remove initial instructions
-      self.display.remove(self.instructions)
+      # Get calibrators ready (calibration data will be relayed through the handleUserData method)
+      for device in self.deviceList:
+         if device.isSelected:
+            device.calibrator.calibrationStart()
 
-      # add label for instructions
-      self.instructionsLine1 = self.display.drawLabel("Zig-Zag through the room for the system to find", 20, 175, Color.WHITE)
-      self.instructionsLine2 = self.display.drawLabel("the space that it can sense (the light will be green).", 20, 200, Color.WHITE)
-      self.instructionsLine3 = self.display.drawLabel("Select Calibrate > Stop when done.", 20, 225, Color.WHITE)
+      # devices being calibrated send the coordinates they measure (not calibrated ones)
+      for device in self.deviceList:
+         self.sendCalibration(device)
 
-      # Get calibrators ready (calibration data will be relayed through the handleUserData method)
-      for calSet in self.calibrators:
-         calibrator = calSet[0]
-         isActiveCheckbox = calSet[1]
-         if isActiveCheckbox.isChecked():
-            calibrator.calibrationStart()
+      print "Calibration started"
          
 
    def calibrationStop(self):
-      ''' Callback function for the Menu Item, Stop.  Stops the Calbration process 
-          and sends the updated information to the server '''
+      ''' Stops the Calbration process and sends the updated information to the server '''
+
+      if not self.calibrating:   # not calibrating
+         return
 
       # stop calibrating
       self.calibrating = False
 
-      # now that we are done remove labels
-      self.display.remove(self.instructionsLine1)
-      self.display.remove(self.instructionsLine2)
-      self.display.remove(self.instructionsLine3)
+      # stop calibrators
+      for device in self.deviceList:
+         if device.isSelected:
+            data = device.calibrator.calibrationStop()              # stop calibrator (returns final calibration data)
+            self.calibrateDevice(data, device)                      # store calibration data to server
+            device.calibrationFound = True
+
+      # devices may calibrate their coordinates again (with the new calibration data)
+      for device in self.deviceList:
+         self.sendCalibration(device)
 
-      self.display.setColor(Color.BLACK)  # set background to black since we are no longer calibrating
+      print "Calibration complete and data saved"
 
-      # stop calibrators
-      for calSet in self.calibrators:
-         calibrator = calSet[0]
-         isActiveCheckbox = calSet[1]
-         if isActiveCheckbox.isChecked():
-            data = calibrator.calibrationStop()                     # stop calibrator (returns final calibration data)
-            clientID = self.devices[self.calibrators.index(calSet)] # get clientID
-            self.calibrateDevice(data, clientID)                    # store calibration data to server
-
-         self.instructions = self.display.drawLabel("Calibration complete and data saved", 20, 200, Color.WHITE)
+   def selectDevice(self, device, isSelected):
+      ''' Includes a device in (or excludes it from) the Calibration process.  Devices
+          selected while calibrating start calibrating with the next calibrationStart() '''
+
+      device.isSelected = isSelected
+
+   def handleCalibrationStart(self, message):
+      ''' Starts the Calibration process (see calibrationStart).  The OSC Message has no values. '''
+
+      self.calibrationStart()
+
+   def handleCalibrationStop(self, message):
+      ''' Stops the Calibration process (see calibrationStop).  The OSC Message has no values. '''
+
+      self.calibrationStop()
+
+   def handleSelectDevice(self, message):
+      ''' Includes a device in (or excludes it from) the Calibration process.  The OSC Message
+          should contain the values:
+               clientID, isSelected
+
+          where isSelected is 1 to include the device, or 0 to exclude it.
+      '''
+
+      args = message.getArguments()
+      device = self.devices.get(args[0])
+      if device is None:   # not a device we know
+         return
+      self.selectDevice(device, args[1] != 0)
+
+   def rollbackCalibration(self, device):
+      ''' Gives a device back the calibration it had before its current one (from the calibration
+          store).  Rolling back again goes further back.  Returns whether there was one to go back to. '''
+
+      bounds = self.calibrationStore.rollback(device.clientID)
+      if bounds is None:
+         print "No earlier calibration of", device.clientID, "to roll back to"
+         return False
+
+      self.useCalibration(device, bounds)
+      print "Calibration of", device.clientID, "rolled back"
+      return True
+
+   def handleRollbackCalibration(self, message):
+      ''' Rolls back a device's calibration (see rollbackCalibration).  The OSC Message should
+          contain the values:
+               clientID
+      '''
+
+      device = self.devices.get(message.getArguments()[0])
+      if device is None:   # not a device we know
+         return
+      self.rollbackCalibration(device)
+
+   def reloadCalibrations(self):
+      ''' Applies the calibrations that changed in the calibration store's file (e.g., it was edited,
+          or another server calibrated a device) to the devices (called every reloadDelay seconds) '''
+
+      for clientID in self.calibrationStore.reload():
+         device = self.devices.get(clientID)
+         bounds = self.calibrationStore.get(clientID)
+         if device is None or bounds is None or (self.calibrating and device.isSelected):   # not a device we know (or it is being calibrated)
+            continue
+         self.useCalibration(device, bounds)
+         print "Calibration of", clientID, "reloaded"
+
+   def useCalibration(self, device, bounds):
+      ''' Makes 'bounds' (minX, minY, minZ, maxX, maxY, maxZ) a device's calibration, and tells the device '''
+
+      device.calibrator.useBounds(bounds)
+      self.calibrateDevice(bounds, device)
+      device.calibrationFound = True
+      self.sendCalibration(device)
       
 
-   def calibrateDevice(self, data, clientID):
+   def calibrateDevice(self, data, device):
       '''Updates calibration data from calibrators so the Kuatro Server can 
          normalize client data to Virtual World Coordinates. 
          'data' should contain the following values:
@@ -405,50 +952,60 @@ class KuatroServer():
       maxY = data[4]
       maxZ = data[5]
 
-      self.deviceCalibrationData[clientID] = (minX, minY, minZ, maxX, maxY, maxZ)
+      device.calibration = CalibrationTransform(minX, minY, minZ, maxX, maxY, maxZ,
+                                                self.virtualMaxX, self.virtualMaxY, self.virtualMaxZ)
+      device.calibrationVersion = device.calibrationVersion + 1   # devices using the old one are told again
 
 
       if self.verbose !=0:
-         print "Device", clientID, "calibrated"
+         print "Device", device.clientID, "calibrated"
          print minX, minY, minZ, maxX, maxY, maxZ
          print "-----------------------------------"
 
 
 
+   def getCalibrationVersion(self, device):
+      '''Returns the version of the calibration a device should use - 0 means it should not calibrate
+         its coordinates (e.g., while it is being calibrated, the calibrator needs them as measured)'''
+
+      if self.calibrating and device.isSelected:
+         return 0
+      return device.calibrationVersion
+
+   def sendCalibration(self, device):
+      '''Tells a device how to calibrate its coordinates.  The OSC Message contains:
+               deviceIndex, calibrationVersion, minX, minY, minZ, maxX, maxY, maxZ
+
+         The device then sends calibrated body frames, with its deviceIndex (instead of its 
+         clientID), and calibrationVersion.  A calibrationVersion of 0 means the device should 
+         send body frames with the coordinates it measures instead.
+      '''
+
+      if device.oscOut is None:   # the device does not listen
+         return
+
+      version = self.getCalibrationVersion(device)
+      minX, minY, minZ, maxX, maxY, maxZ = device.calibration.bounds
+      device.oscOut.sendMessage(KuatroServer.CALIBRATION_MESSAGE, device.index, version,
+                                float(minX), float(minY), float(minZ), float(maxX), float(maxY), float(maxZ))
+
+
    #####################################
    ###### Kuatro Helper Functions ######
    #####################################
 
 
-   def calibrateUserCoordinates(self, x, y, z, clientID):
+   def calibrateUserCoordinates(self, x, y, z, device):
       '''Takes User Coordinate data from a device and translates it to Virtual World 
          coordinates'''
 
-      ### Get Coordination Data ###
-      minX = self.deviceCalibrationData[clientID][0]
-      minY = self.deviceCalibrationData[clientID][1]
-      minZ = self.deviceCalibrationData[clientID][2]
-      maxX = self.deviceCalibrationData[clientID][3]
-      maxY = self.deviceCalibrationData[clientID][4]
-      maxZ = self.deviceCalibrationData[clientID][5]
-
+      return device.calibration.calibrate(x, y, z)
 
-      # Now calibrate the input values
+   def uncalibrateUserCoordinates(self, x, y, z, device):
+      '''Takes Virtual World coordinates of a device's user and translates them back to
+         device coordinates (within the device's calibrated range)'''
 
-      x = max(x, minX)   # keep x in range
-      x = min(x, maxX)
-      #print x,y,minX,maxX
-      newX = mapValue(x, minX, maxX, 0, self.virtualMaxX)  # find the normalized value of X
-
-      y = max(y, minY)   # keep y in range
-      y = min(y, maxY)
-      newY = mapValue(y, minY, maxY, 0, self.virtualMaxY)  # find the normalized value of Y
-
-      z = max(z, minZ)   # keep z in range
-      z = min(z, maxZ)
-      newZ = mapValue(z, minZ, maxZ, 0, self.virtualMaxZ)  # find the normalized value of Z
-
-      return newX, newY, newZ
+      return device.calibration.uncalibrate(x, y, z)
 
 #####################################
    
@@ -463,28 +1020,250 @@ class KuatroServer():
 
 #####################################
          
-   def resetLight(self, light):
-      '''Resets a client's light to GRAY'''
-      light.setColor(Color.GRAY)
-      
+   def sendWorldState(self):
+      '''Sends the world state - the latest joints and hand states of all users - to the views (called
+         at a fixed rate, when broadcasting).  It is sent only when it changed, as one message:
+               worldStateSequence, bodyCount, body*bodyCount
+
+         laid out like a body frame (see bodyFrame.py).  The world states are numbered, so views
+         can skip late ones, and tell if they missed some.'''
+
+      if self.worldStateChanged:
+         self.worldStateChanged = False
+         bodies = [(virtualWorldUserID, leftHandState, rightHandState, joints)
+                   for virtualWorldUserID, (leftHandState, rightHandState, joints) in self.worldState.items()]
+         self.sendBodiesMessage((KuatroServer.WORLD_STATE_MESSAGE,), KuatroServer.WORLD_STATE_MESSAGE,
+                                self.worldStateSequence, bodies)
+         self.worldStateSequence = self.worldStateSequence + 1
+
+   def repeat(self, delay, function):
+      '''Calls 'function' every 'delay' seconds, in its own thread (the time 'function' takes counts
+         towards the wait, and if it falls behind, it starts over instead of rushing to catch up),
+         until the server is closed'''
+
+      def run():
+         deadline = time.time()   # when the next call is due
+         while not self.closed.isSet():
+            deadline = deadline + delay
+            wait = deadline - time.time()
+            if wait > 0:
+               self.closed.wait(wait)   # (closing the server ends the wait)
+            else:
+               deadline = time.time()
+
+            if self.closed.isSet():
+               return
+
+            try:
+               function()
+            except Exception, e:
+               print "Error in", function.__name__ + ":", e
+
+      thread = Thread(target=run)
+      thread.setDaemon(True)
+      thread.start()
+      return thread
+
+   def close(self):
+      '''Shuts the server down - stops listening and the repeated tasks, sends the views what is
+         still queued, and writes the calibration store'''
+
+      self.closed.set()
+
+      if self.oscIn is not None:
+         self.oscIn.oscPortIn.stopListening()
+         self.oscIn.oscPortIn.close()
+
+      for viewSender in self.viewSenders:
+         viewSender.close()
+
+      self.calibrationStore.close()
+
+   def expireUsers(self):
+      '''Removes users not seen for userTimeout seconds (e.g., their lost user message was lost), and
+         all users of devices silent for deviceTimeout seconds (e.g., the client crashed), telling the
+         views they are lost (called every sweepDelay seconds)'''
+
+      now = time.time()
+
+      for device in self.deviceList:
+
+         # a device's counters only change when it sends something
+         activity = device.framesReceived + device.framesSkipped + device.messagesReceived
+         if activity != device.lastActivity:
+            device.lastActivity = activity
+            device.lastSeen = now
+
+         if now - device.lastSeen > self.deviceTimeout:   # a silent device loses all its users
+            expired = device.users.keys()
+            if expired:
+               print "Device", device.clientID, "went silent - removing its users"
+         else:
+            expired = [userID for userID, lastSeen in device.userLastSeen.items() if now - lastSeen > self.userTimeout]
+
+         for userID in expired:
+            self.forgetUser(device, userID)
+
+   def getStats(self):
+      '''Returns the server's metrics, as a dictionary - uptime (seconds), and
+            messages - count and handler time (microseconds) of each message type
+            devices  - counters and rates (per second, over the last rate update) of each device
+            views    - counters, send rate, queue length and lag (milliseconds) of each view'''
+
+      stats = self.metrics.stats()
+
+      devices = []
+      for device in self.deviceList:
+         devices.append({"clientID": device.clientID, "index": device.index, "users": len(device.users),
+                         "framesReceived": device.framesReceived, "framesSkipped": device.framesSkipped,
+                         "messagesReceived": device.messagesReceived, "frameRate": round(device.frameRate, 1),
+                         "skipRate": round(device.skipRate, 1), "messageRate": round(device.messageRate, 1)})
+      stats["devices"] = devices
+
+      views = []
+      for viewSender in self.viewSenders:
+         views.append({"ipAddress": viewSender.ipAddress, "port": viewSender.port,
+                       "eventsSent": viewSender.eventsSent, "valuesSent": viewSender.valuesSent,
+                       "valuesReplaced": viewSender.valuesReplaced, "valuesDropped": viewSender.valuesDropped,
+                       "sendErrors": viewSender.sendErrors, "sendRate": round(viewSender.sendRate, 1),
+                       "queueLength": len(viewSender.queue), "lastLag": round(viewSender.lastLag * 1000, 1),
+                       "maxLag": round(viewSender.maxLag * 1000, 1)})
+      stats["views"] = views
+
+      return stats
+
+   def handleStatsQuery(self, message):
+      ''' Sends the server's metrics (see getStats) as JSON text, in one STATS_MESSAGE.  The OSC
+          Message should contain the values:
+               replyIpAddress, replyPort
+      '''
+
+      args = message.getArguments()
+      replyAddress = (args[0], args[1])
+
+      if replyAddress not in self.statsOscOuts:
+         self.statsOscOuts[replyAddress] = OscOut(args[0], args[1])
+      self.statsOscOuts[replyAddress].sendMessage(KuatroServer.STATS_MESSAGE, toJson(self.getStats()))
+
+   def dumpStats(self):
+      '''Appends the server's metrics (see getStats) to the stats file, as one line of JSON text'''
+
+      stats = self.getStats()
+      stats["time"] = time.time()
+
+      try:
+         statsFile = open(self.statsFile, "a")
+         try:
+            statsFile.write(toJson(stats) + "\n")
+         finally:
+            statsFile.close()
+      except IOError, e:
+         print "Unable to write stats to", self.statsFile, e
+
+   def handlerFailed(self, address, exception):
+      '''Records a message handler's failure in the trace (when verbose), and dumps the trace
+         (unless it was dumped for a failure less than traceDelay seconds ago)'''
+
+      if self.trace is None:
+         return
+
+      self.trace.record(ERROR, -1, -1, -1, messageType(address))
+
+      now = time.time()
+      if now - self.lastTraceDump >= self.traceDelay:
+         self.lastTraceDump = now
+         print "Handler for", address, "failed:", exception
+         self.dumpTrace()
+
+   def handleDumpTrace(self, message):
+      ''' Writes the trace to the trace file (see dumpTrace).  The OSC Message has no values. '''
+
+      if self.trace is not None:
+         self.dumpTrace()
+
+   def dumpTrace(self):
+      '''Writes the trace to the trace file (when verbose)'''
+
+      try:
+         count = self.trace.dump(self.traceFile)
+         print "Trace dumped to", self.traceFile, "(" + str(count) + " records)"
+      except IOError, e:
+         print "Unable to dump trace to", self.traceFile, e
+
+   def updateRates(self):
+      '''Updates the rates (per second) of each device and view, from their counters (called at
+         a fixed rate, so incoming messages only have to update the counters)'''
+
+      now = time.time()
+      elapsed = now - self.lastRateTime
+      self.lastRateTime = now
+      if elapsed <= 0:
+         return
+
+      for device in self.deviceList:
+
+         # take the counters once (they keep changing as messages come in)
+         framesReceived = device.framesReceived
+         framesSkipped = device.framesSkipped
+         messagesReceived = device.messagesReceived
+
+         device.frameRate = (framesReceived - device.lastFramesReceived) / elapsed
+         device.skipRate = (framesSkipped - device.lastFramesSkipped) / elapsed
+         device.messageRate = (messagesReceived - device.lastMessagesReceived) / elapsed
+         device.lastFramesReceived = framesReceived
+         device.lastFramesSkipped = framesSkipped
+         device.lastMessagesReceived = messagesReceived
+
+      for viewSender in self.viewSenders:
+         messagesSent = viewSender.eventsSent + viewSender.valuesSent
+         viewSender.sendRate = (messagesSent - viewSender.lastMessagesSent) / elapsed
+         viewSender.lastMessagesSent = messagesSent
 
    def sendMessage(self, address, *args):
-      '''Helper method to send OSC messages using OSC Out port.
-         *args allows calling method to send any number of parameters'''
+      '''Helper method to send OSC messages to all views (they are queued, and sent by each
+         view's View Sender).  *args allows calling method to send any number of parameters'''
+
 
+      if len(self.viewSenders) > 0:      # make sure at least one view is registered
 
-      if len(self.viewPorts) > 0:      # make sure at least one oscOut port is setup
+         if address in KuatroServer.VALUE_MESSAGES:   # a newer value replaces this one, if the view falls behind
+            key = (address,) + args[:KuatroServer.VALUE_MESSAGES[address]]
+            self.sendValueMessage(key, address, *args)
+            return
 
-         for oscOut in self.viewPorts:  # loop through all osc ports
-            oscOut.sendMessage(address, *args)  # send osc message through osc port
-            if self.verbose !=0:
-               print "Sending message to:", address
-               print "Data:", args
+         for viewSender in self.viewSenders:          # an event, always delivered
+            viewSender.sendEvent(address, args)
+
+         if self.trace is not None:
+            self.trace.record(VIEW_MESSAGE, -1, -1, -1, messageType(address))
 
       else:
          print "No OSC out ports are setup"
 
+   def sendValueMessage(self, key, address, *args):
+      '''Helper method to send OSC messages that only matter until a newer one about the same
+         thing, 'key', to all views (a view that falls behind gets only the newest one).'''
+
+      sendFilteredValue(self.viewGroups, key, address, args, self.virtualUsers)   # (to the views that want it, given where users are)
+
+      if self.trace is not None:
+         self.trace.record(VIEW_MESSAGE, -1, -1, -1, messageType(address))
+
+   def sendBodiesMessage(self, key, address, sequence, bodies):
+      '''Helper method to send body frames and world states (see bodyFrame.py) to all views, as values
+         (see sendValueMessage), each view with only the users and joints it wants.'''
+
+      sendFilteredBodies(self.viewGroups, key, address, sequence, bodies)
+
+      if self.trace is not None:
+         self.trace.record(VIEW_MESSAGE, -1, -1, -1, messageType(address))
+
 
 ##### Instantiate a Server
 if __name__ == '__main__':
    kuatroServer = KuatroServer(verbose=1)
+
+   # watch and calibrate it from a window (unless there is no display)
+   if "--headless" not in sys.argv:
+      from kuatroServerDisplay import KuatroServerDisplay
+      kuatroServerDisplay = KuatroServerDisplay(kuatroServer)
@@ -0,0 +1,391 @@
+# kuatroAggregator.py
+#
+# The Kuatro Aggregator lets several Kuatro Servers share the work of a large installation
+# (many devices), each in its own process, so the server scales with the machine's cores.
+#
+# Each worker is a Kuatro Server (see kinectineServer.py) that owns some of the devices - it
+# decodes their body frames, calibrates their coordinates, and maps their users to virtual world
+# users.  The aggregator is what devices and views talk to (on the usual port):
+#
+#    - a registering device is handed to a worker, picked from its clientID (see shardOf), by
+#      a REDIRECT_MESSAGE - the device then sends everything to that worker's port instead
+#    - views register with the aggregator, which registers itself with every worker as a view
+#      (subscribing to what any view uses), and relays what the workers send to all views
+#    - calibration and monitoring messages (see CONTROL_MESSAGES) are forwarded to all workers
+#    - the aggregator keeps the set of users in the virtual world (from the workers' new and lost
+#      user messages), to send views snapshots of it, as a single Kuatro Server does
+#
+# Workers and the aggregator talk OSC over the local machine, each worker on its own pair of ports
+# (FIRST_WORKER_PORT + i to listen to its devices, FIRST_RELAY_PORT + i to relay to the aggregator).
+# Each worker takes every n-th virtual world user ID (worker i of n starts at i), so user IDs are
+# unique across workers without asking each other.  To run a sharded server with, e.g., 4 workers:
+#
+#    jython kuatroAggregator.py 4 --worker 0
+#    jython kuatroAggregator.py 4 --worker 1
+#    jython kuatroAggregator.py 4 --worker 2
+#    jython kuatroAggregator.py 4 --worker 3
+#    jython kuatroAggregator.py 4
+#
+# (in any order - the aggregator registers with the workers again every REGISTRATION_DELAY seconds).
+# Workers run headless, so calibrate with the CALIBRATION_START and CALIBRATION_STOP messages.
+# Devices that do not listen for messages from the server cannot be redirected, so they need a
+# single server (they are told so when they register).
+#
+#  See README file for full instructions on using the Kuatro System
+
+from osc import OscIn, OscOut
+from kinectineServer import KuatroServer
+from viewSender import ViewSender
+from viewFilter import parseViewRegistration, groupViews, sendFilteredValue, sendFilteredBodies
+from bodyFrame import decodeBodies
+from threading import Thread, Lock
+import sys
+import time
+
+# where workers listen for their devices (worker i on FIRST_WORKER_PORT + i),
+# and where the aggregator listens for what worker i relays (on FIRST_RELAY_PORT + i)
+FIRST_WORKER_PORT = 50510
+FIRST_RELAY_PORT = 50530
+
+# time between registrations with the workers (seconds), so workers that started late (or restarted) get one
+REGISTRATION_DELAY = 2.0
+
+
+def shardOf(clientID, workerCount):
+   '''Returns which worker owns a device (the same every time, in every process)'''
+
+   checksum = 0
+   for character in clientID:
+      checksum = (checksum * 31 + ord(character)) % 1000003
+   return checksum % workerCount
+
+
+class KuatroAggregator():
+
+   ##### OSC Namespace #####
+   REDIRECT_MESSAGE = "/kuatro/redirect"
+
+   # messages for the whole server, forwarded to every worker as they are
+   CONTROL_MESSAGES = [KuatroServer.CALIBRATION_START_MESSAGE, KuatroServer.CALIBRATION_STOP_MESSAGE,
+                       KuatroServer.SELECT_DEVICE_MESSAGE, KuatroServer.ROLLBACK_CALIBRATION_MESSAGE,
+                       KuatroServer.STATS_MESSAGE, KuatroServer.DUMP_TRACE_MESSAGE]
+
+   # messages the workers send (to their views), relayed to the views
+   RELAYED_MESSAGES = [KuatroServer.NEW_USER_MESSAGE, KuatroServer.LOST_USER_MESSAGE, KuatroServer.JOINT_COORDINATES_MESSAGE,
+                       KuatroServer.HAND_STATE_MESSAGE, KuatroServer.PROCESSING_MESSAGE,
+                       KuatroServer.BODY_FRAME_MESSAGE, KuatroServer.WORLD_STATE_MESSAGE, KuatroServer.SNAPSHOT_MESSAGE]
+
+   def __init__(self, workerCount, port = 50505, relayIpAddress = "localhost"):
+
+      self.workerCount = workerCount   # how many workers share the devices
+      self.relayIpAddress = relayIpAddress  # where workers reach the aggregator (they run on the same machine)
+
+      self.workerOscOuts = []          # OSC Port to each worker
+      for worker in range(workerCount):
+         self.workerOscOuts.append(OscOut("localhost", FIRST_WORKER_PORT + worker))
+      self.deviceWorkers = {}          # which worker owns each device, as {clientID: worker}
+
+      self.viewInfo = []               # the IP Address and Port of all registered views
+      self.viewSenders = []            # and their View Senders (OSC Port and queue)
+      self.viewGroups = []             # and the same View Senders, grouped by their views' filters (see viewFilter.py)
+      self.viewSubscriptions = {}      # stores the joints and message types each view uses, as {(ipAddress, port): (joints, messages)}
+      self.viewFrameSequence = 0       # sequence number of the next body frame sent to the views
+      self.frameDevices = {}           # the device each user's body frames come from (see deviceKey), as {virtualWorldUserID: key}
+      self.frameDeviceCount = 0        # how many devices body frames came from
+      self.worldStateSequence = 0      # sequence number of the next world state sent to the views
+      self.messagesRelayed = [0] * workerCount   # how many messages each worker relayed
+      self.virtualUsers = {}           # the users in the virtual world (from all workers), as {virtualWorldUserID: (x, y, z)}
+      self.stateVersion = 0            # version of the set of users (increased with every new and lost user)
+      self.relayLock = Lock()          # workers relay from separate threads, so numbering (and queueing) takes turns
+
+      # configure OSC protocol communication
+      try:
+
+         oscIn = OscIn(port)
+         oscIn.hideMessages()
+
+         oscIn.onInput(KuatroServer.REGISTER_DEVICE_MESSAGE, self.redirectDevice)
+         oscIn.onInput(KuatroServer.REGISTER_VIEW_MESSAGE, self.registerView)
+         oscIn.onInput(KuatroServer.RESYNC_MESSAGE, self.handleResync)
+         for address in KuatroAggregator.CONTROL_MESSAGES:
+            oscIn.onInput(address, self.forward)
+
+         for worker in range(workerCount):
+            relayIn = OscIn(FIRST_RELAY_PORT + worker)
+            relayIn.hideMessages()
+            relayIn.onInput("/.*", self.relayHandler(worker))
+
+      except:
+         print "Error:  Unable to setup OSC In port. Port " + str(port) + " or a relay port may already be in use."
+
+      # register with the workers (again and again, for workers that start late)
+      thread = Thread(target=self.keepRegistering)
+      thread.setDaemon(True)
+      thread.start()
+
+      print "Kuatro Aggregator started, for", workerCount, "workers"
+
+
+   ####################################
+   ###### Devices and Workers #########
+   ####################################
+
+   def redirectDevice(self, message):
+      ''' Hands a registering device to its worker.  The OSC Message is the device's registration
+          (see KuatroServer.registerDevice):
+               clientID, replyIpAddress, replyPort
+
+          and the device is sent a REDIRECT_MESSAGE, with the port of its worker:
+               port
+      '''
+
+      args = message.getArguments()
+      clientID = args[0]
+
+      if len(args) < 3:   # the device does not listen, so it cannot be redirected
+         print "Device", clientID, "does not listen for messages, so it cannot join a sharded server"
+         return
+
+      worker = shardOf(clientID, self.workerCount)
+      self.deviceWorkers[clientID] = worker
+
+      OscOut(args[1], args[2]).sendMessage(KuatroAggregator.REDIRECT_MESSAGE, FIRST_WORKER_PORT + worker)
+      print "Device", clientID, "handed to worker", worker
+
+   def forward(self, message):
+      ''' Forwards a message for the whole server (see CONTROL_MESSAGES) to every worker '''
+
+      args = message.getArguments()
+      for oscOut in self.workerOscOuts:
+         oscOut.sendMessage(message.getAddress(), *tuple(args))
+
+   def keepRegistering(self):
+      ''' Registers with the workers every REGISTRATION_DELAY seconds (in its own thread) '''
+
+      while True:
+         try:
+            self.registerWithWorkers()
+         except Exception, e:
+            print "Error in registerWithWorkers:", e
+         time.sleep(REGISTRATION_DELAY)
+
+   def registerWithWorkers(self):
+      ''' Registers with every worker as a view, using the joints and message types any view
+          uses (see KuatroServer.registerView), and SPINE_BASE (where users are, for views' regions) '''
+
+      joints = [KuatroServer.SPINE_BASE]
+      messages = []
+      for viewJoints, viewMessages in self.viewSubscriptions.values():
+         for jointID in viewJoints:
+            if jointID not in joints:
+               joints.append(jointID)
+         for messageType in viewMessages:
+            if messageType not in messages:
+               messages.append(messageType)
+      joints.sort()
+      messages.sort()
+
+      for worker in range(self.workerCount):
+         self.workerOscOuts[worker].sendMessage(KuatroServer.REGISTER_VIEW_MESSAGE, self.relayIpAddress,
+                                                FIRST_RELAY_PORT + worker, len(joints), *(joints + messages))
+
+
+   ####################################
+   ###### Views #######################
+   ####################################
+
+   def registerView(self, message):
+      ''' Registers a view with the aggregator, the same way as with a single Kuatro Server
+          (see KuatroServer.registerView):
+               ipAddress, port, jointCount, jointID*jointCount, messageType*, ["users", ...], ["region", ...]
+
+          Workers send the aggregator what any view uses, and the aggregator sends each view
+          only what it declared (see viewFilter.py).
+      '''
+
+      args = message.getArguments()
+      ipAddress, port, viewFilter = parseViewRegistration(args, KuatroServer.DEFAULT_VIEW_JOINTS, KuatroServer.DEFAULT_VIEW_MESSAGES)
+
+      self.viewSubscriptions[(ipAddress, port)] = (viewFilter.joints, viewFilter.messages)
+      self.registerWithWorkers()   # so devices start sending what the view uses
+
+      if (ipAddress, port) not in self.viewInfo:  # only add view if it is not already registered
+         self.viewInfo.append((ipAddress, port))
+         self.viewSenders.append(ViewSender(ipAddress, port))
+         print "OSC Configured.  Sending messages to", ipAddress, "on", port
+
+      viewSender = self.viewSenders[self.viewInfo.index((ipAddress, port))]
+      viewSender.viewFilter = viewFilter             # send the view only what it wants
+      self.viewGroups = groupViews(self.viewSenders)
+
+      # tell the view about the users already in the virtual world
+      self.sendSnapshot(viewSender)
+
+   def handleResync(self, message):
+      ''' Sends a view the users in the virtual world again (see KuatroServer.handleResync) '''
+
+      args = message.getArguments()
+      if (args[0], args[1]) in self.viewInfo:   # only registered views
+         self.sendSnapshot(self.viewSenders[self.viewInfo.index((args[0], args[1]))])
+
+   def sendSnapshot(self, viewSender):
+      ''' Sends a view all users in the virtual world, as one SNAPSHOT_MESSAGE (see KuatroServer.sendSnapshot) '''
+
+      self.relayLock.acquire()
+      try:
+         args = [self.stateVersion, len(self.virtualUsers)]
+         for virtualWorldUserID, (x, y, z) in self.virtualUsers.items():
+            args.extend([virtualWorldUserID, x, y, z])
+         viewSender.sendEvent(KuatroServer.SNAPSHOT_MESSAGE, tuple(args))
+      finally:
+         self.relayLock.release()
+
+   def updateLocations(self, bodies):
+      '''Moves the users in a body frame (or world state) to their new locations (their SPINE_BASE, as
+         in viewFilter.py), which views' regions are checked against'''
+
+      for userID, leftHandState, rightHandState, joints in bodies:
+         if userID in self.virtualUsers:
+            for joint in joints:
+               if joint[0] == KuatroServer.SPINE_BASE:
+                  self.virtualUsers[userID] = tuple(joint[2:5])
+
+   def relayHandler(self, worker):
+      '''Returns the OSC message handler for what a worker relays'''
+
+      def relay(message):
+         self.messagesRelayed[worker] = self.messagesRelayed[worker] + 1
+         address = message.getAddress()
+         if address in KuatroAggregator.RELAYED_MESSAGES:
+            self.relayLock.acquire()
+            try:
+               self.relay(worker, address, tuple(message.getArguments()))
+            finally:
+               self.relayLock.release()
+
+      return relay
+
+   def relay(self, worker, address, args):
+      '''Sends a message from a worker to all views, the way the worker would have (values that
+         only matter until a newer one replace each other, if a view falls behind).  Body frames and
+         world states are numbered again, so views see a single sequence from all workers, and so are
+         the state versions of new and lost users.'''
+
+      if address == KuatroServer.SNAPSHOT_MESSAGE:   # the worker's users, sent whenever we register (see updateUsers)
+         self.updateUsers(worker, args)
+         return
+
+      if address == KuatroServer.NEW_USER_MESSAGE:
+         if args[0] in self.virtualUsers:   # (a worker's snapshot told us already)
+            return
+         self.virtualUsers[args[0]] = args[1:4]
+         self.stateVersion = self.stateVersion + 1
+         args = args[:4] + (self.stateVersion,)
+
+      elif address == KuatroServer.LOST_USER_MESSAGE:
+         if args[0] not in self.virtualUsers:
+            return
+         del self.virtualUsers[args[0]]
+         if args[0] in self.frameDevices:
+            del self.frameDevices[args[0]]
+         self.stateVersion = self.stateVersion + 1
+         args = (args[0], self.stateVersion)
+
+      if address == KuatroServer.BODY_FRAME_MESSAGE or address == KuatroServer.WORLD_STATE_MESSAGE:
+
+         # the same device's frame replaces it (see KuatroServer.updateBodies, and deviceKey),
+         # and world states replace the same worker's world state
+         if address == KuatroServer.BODY_FRAME_MESSAGE:
+            key = self.deviceKey(worker, self.userIDs(args))
+            sequence = self.viewFrameSequence
+            self.viewFrameSequence = self.viewFrameSequence + 1
+         else:
+            key = (address, worker)
+            sequence = self.worldStateSequence
+            self.worldStateSequence = self.worldStateSequence + 1
+
+         viewGroups = self.viewGroups
+         everything = True   # whether all views want the whole message (so it need not be unpacked)
+         for viewFilter, viewSenders in viewGroups:
+            everything = everything and viewFilter.passesAllBodies
+
+         if everything:
+            args = (sequence,) + args[1:]
+            for viewSender in self.viewSenders:
+               viewSender.sendValue(key, address, args)
+         else:
+            bodies = decodeBodies(args, 1)
+            self.updateLocations(bodies)
+            sendFilteredBodies(viewGroups, key, address, sequence, bodies)
+
+      elif address in KuatroServer.VALUE_MESSAGES:
+         if address == KuatroServer.JOINT_COORDINATES_MESSAGE and args[1] == KuatroServer.SPINE_BASE and args[0] in self.virtualUsers:
+            self.virtualUsers[args[0]] = args[3:6]   # (a user is located at their SPINE_BASE)
+         key = (address,) + args[:KuatroServer.VALUE_MESSAGES[address]]
+         sendFilteredValue(self.viewGroups, key, address, args, self.virtualUsers)
+
+      else:   # an event, always delivered
+         for viewSender in self.viewSenders:
+            viewSender.sendEvent(address, args)
+
+   def updateUsers(self, worker, args):
+      '''Makes the users of a worker (those whose user IDs it hands out) match its snapshot, telling the
+         views about any new or lost user messages we missed (workers send a snapshot whenever we
+         register with them, so the aggregator catches up every REGISTRATION_DELAY seconds)'''
+
+      users = {}
+      for i in range(args[1]):
+         users[args[2 + i*4]] = (args[3 + i*4], args[4 + i*4], args[5 + i*4])
+
+      for virtualWorldUserID in self.virtualUsers.keys():
+         if virtualWorldUserID % self.workerCount == worker and virtualWorldUserID not in users:
+            self.relay(worker, KuatroServer.LOST_USER_MESSAGE, (virtualWorldUserID, 0))
+
+      for virtualWorldUserID, (x, y, z) in users.items():
+         if virtualWorldUserID not in self.virtualUsers:
+            self.relay(worker, KuatroServer.NEW_USER_MESSAGE, (virtualWorldUserID, x, y, z, 0))
+
+   def deviceKey(self, worker, userIDs):
+      '''Returns the key of the device a body frame with 'userIDs' comes from.  Frames do not say which
+         device sent them, but a user is only ever in one device's frames, so a frame with a user seen
+         before comes from that user's device (and its new users are remembered as that device's);
+         a frame with none comes from a device not seen before (or whose users were all lost).'''
+
+      key = None
+      for userID in userIDs:
+         if userID in self.frameDevices:
+            key = self.frameDevices[userID]
+            break
+
+      if key is None:
+         key = (KuatroServer.BODY_FRAME_MESSAGE, worker, self.frameDeviceCount)
+         self.frameDeviceCount = self.frameDeviceCount + 1
+
+      for userID in userIDs:
+         self.frameDevices[userID] = key
+      return key
+
+   def userIDs(self, args):
+      '''Returns the user IDs in a body frame (laid out as in bodyFrame.py, after its sequence number)'''
+
+      userIDs = ()
+      index = 2                       # the first body (after the sequence number and bodyCount)
+      for body in range(args[1]):
+         userIDs = userIDs + (args[index],)
+         index = index + 4 + 5 * args[index + 3]   # userID, hand states, jointCount, and 5 values per joint
+      return userIDs
+
+
+##### Start an Aggregator (or one of its workers)
+if __name__ == '__main__':
+
+   workerCount = int(sys.argv[1])
+
+   if "--worker" in sys.argv:   # a headless Kuatro Server, owning the devices the aggregator hands it
+      worker = int(sys.argv[sys.argv.index("--worker") + 1])
+
+      # workers share the calibration store (each writes its own temporary file, and keeps what the others wrote, see calibrationStore.py)
+      kuatroServer = KuatroServer(port = FIRST_WORKER_PORT + worker, verbose = 1,
+                                  firstUserID = worker, userIDStep = workerCount)
+   else:
+      kuatroAggregator = KuatroAggregator(workerCount)
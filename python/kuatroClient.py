@@ -0,0 +1,537 @@
+# kuatroClient.py
+#
+# The Kuatro Client base class.  It turns skeleton frames (see skeletonFrame.py) into
+# OSC messages for the Kuatro Server - registering the device, announcing new and lost
+# users, and sending their joint coordinates and hand states.
+#
+# It does not know where frames come from.  Subclasses capture them from a depth sensor
+# (see kinectineClient.py), replay them from a recording (see kinectineReplay.py), etc.,
+# and pass each new frame to sendFrame().  This way all of them produce the same OSC traffic.
+#
+# Messages are not sent by the thread that produces the frames.  Each destination (the Kuatro
+# Server, and any twin servers) has its own OSC Sender (see oscSender.py), which sends them from
+# a separate thread, so a slow network never holds up capture, and a slow destination never
+# holds up the others.
+#
+# The client also listens for messages from the Kuatro Server.  The server tells it which
+# joints and message types the views use (a subscription), and the client sends only those.
+# The server also tells it how to calibrate its coordinates to the virtual world, and then the
+# client sends calibrated body frames, which are much smaller (see bodyFrame.py).
+#
+#  See README file for full instructions on using the Kuatro System
+
+
+from pythonosc import dispatcher, osc_server
+from jointConstants import *
+from skeletonFrame import BODY_COUNT, JOINT_COUNT, newFrame
+from skeletonFilter import SkeletonFilter
+from skeletonRecording import SkeletonRecorder
+from bodyFrame import COORDINATE_MAX
+from oscSender import OscSender, buildMessage
+
+from threading import *
+from time import perf_counter, sleep
+
+import struct
+import socket
+import numpy
+
+# which body joints to pull position data for (including a hand will send that hand's state as well)
+# (this is where the client starts - once the Kuatro Server says which joints the views use, it sends those instead)
+# choose from: SPINE_BASE, SPINE_MID, NECK, HEAD, SHOULDER_LEFT, ELBOW_LEFT, WRIST_LEFT, HAND_LEFT, SHOULDER_RIGHT, ELBOW_RIGHT, WRIST_RIGHT,
+# HAND_RIGHT, HIP_LEFT, KNEE_LEFT, ANKLE_LEFT, FOOT_LEFT, HIP_RIGHT, KNEE_RIGHT, ANKLE_RIGHT, FOOT_RIGHT, SPINE_SHOULDER, HAND_TIP_LEFT,
+# THUMB_LEFT, HAND_TIP_RIGHT, THUMB_RIGHT
+JOINTS_LIST = [SPINE_BASE, SHOULDER_LEFT, ELBOW_LEFT, HAND_LEFT, SHOULDER_RIGHT, ELBOW_RIGHT, HAND_RIGHT]
+
+#JOINTS_LIST = [HAND_LEFT]
+
+# send each Kinect frame as a single body frame message (all users, joints, and hand states in one packet),
+# instead of a separate message per joint, hand state, and processing coordinate
+# (set to False when talking to a server that does not understand body frames)
+SEND_BODY_FRAMES = True
+
+# which optional messages to send, until the Kuatro Server says which ones the views use
+# (hand states and processing coordinates - body frames always carry hand states)
+MESSAGES_LIST = ["/kuatro/handState", "/kuatro/processing"]
+
+# body frames only carry the joints that moved more than DEADBAND millimetres since they were last sent
+# (or whose tracking state changed), except for every KEYFRAME_INTERVAL-th frame, which carries all joints
+# so that the server can recover from lost packets (set KEYFRAME_INTERVAL to 1 to always send all joints)
+DEADBAND = 10
+KEYFRAME_INTERVAL = 30
+
+# smooth joint positions before sending them (see skeletonFilter.py), so that sensor jitter does not
+# reach the server and views (with smoothing, DEADBAND may be lowered, as jitter no longer crosses it)
+SMOOTH_JOINTS = False
+
+# body frames are packed for the wire directly from arrays (see packBodyFrame() and packCalibratedFrame()),
+# using these big endian OSC layouts for a body and for each of its joints (see bodyFrame.py)
+BODY_HEADER_DTYPE = numpy.dtype([('userID', '>i4'), ('leftHandState', '>i4'), ('rightHandState', '>i4'), ('jointCount', '>i4')])
+JOINT_RECORD_DTYPE = numpy.dtype([('jointID', '>i4'), ('trackingState', '>i4'), ('position', '>f4', (3,))])
+CALIBRATED_JOINT_DTYPE = numpy.dtype([('first', '>u4'), ('second', '>u4')])   # two integers per joint
+
+# how often a client with no frames of its own checks whether it was stopped (seconds, see run())
+STOP_POLL_DELAY = 0.1
+
+class OscPacket():
+    ''' An OSC message that is already packed for the wire (what an OSC Sender sends) '''
+
+    def __init__(self, dgram):
+        self.dgram = dgram
+
+def oscString(string):
+    ''' Packs a string as an OSC string (zero terminated, padded to 4 bytes) '''
+
+    data = string.encode("utf-8")
+    return data + b"\0" * (4 - len(data) % 4)
+
+def packBodyFrame(clientID, frameSequence, captureTime, isKeyframe, tracked, handStates, send, trackingStates, positions):
+    ''' Packs a BODY_FRAME_MESSAGE (see bodyFrame.py) with the joints marked in 'send' (a bodies x joints
+      array of booleans) of the 'tracked' bodies.  Joints are packed all at once, as arrays. '''
+
+    bodyIndices, jointIDs = numpy.nonzero(send)  # joints grouped by body, in joint order
+    joints = numpy.empty(len(jointIDs), dtype=JOINT_RECORD_DTYPE)
+    joints['jointID'] = jointIDs
+    joints['trackingState'] = trackingStates[bodyIndices, jointIDs]
+    joints['position'] = positions[bodyIndices, jointIDs]
+
+    arguments = oscString(clientID) + struct.pack(">iii", frameSequence, captureTime, int(isKeyframe))
+    return packFrame(KuatroClient.BODY_FRAME_MESSAGE, ",siii", arguments, tracked, handStates, send, joints, "iifff")
+
+def packCalibratedFrame(calibration, frameSequence, captureTime, isKeyframe, tracked, handStates, send, trackingStates, positions):
+    ''' Packs a CALIBRATED_FRAME_MESSAGE (see bodyFrame.py), like packBodyFrame(), with coordinates
+      calibrated with 'calibration' (see updateCalibration()) '''
+
+    deviceIndex, calibrationVersion, offsets, scales = calibration
+
+    bodyIndices, jointIDs = numpy.nonzero(send)  # joints grouped by body, in joint order
+    coordinates = (positions[bodyIndices, jointIDs] - offsets) * scales
+    coordinates = numpy.rint(numpy.clip(coordinates, 0, COORDINATE_MAX, out=coordinates), out=coordinates).astype(numpy.uint32)
+
+    joints = numpy.empty(len(jointIDs), dtype=CALIBRATED_JOINT_DTYPE)
+    joints['first'] = (jointIDs.astype(numpy.uint32) << 24) | (trackingStates[bodyIndices, jointIDs].astype(numpy.uint32) << 16) | coordinates[:, 2]
+    joints['second'] = (coordinates[:, 0] << 16) | coordinates[:, 1]
+
+    arguments = struct.pack(">iiiii", deviceIndex, frameSequence, captureTime, int(isKeyframe), calibrationVersion)
+    return packFrame(KuatroClient.CALIBRATED_FRAME_MESSAGE, ",iiiii", arguments, tracked, handStates, send, joints, "ii")
+
+def packFrame(address, typeTags, arguments, tracked, handStates, send, joints, jointTypeTags):
+    ''' Packs a frame message - its leading 'arguments' (already packed, with their 'typeTags'),
+      followed by the 'tracked' bodies and their 'joints' (already packed, with 'jointTypeTags' each) '''
+
+    userIDs = numpy.flatnonzero(tracked)
+    jointCounts = send[userIDs].sum(axis=1)
+
+    headers = numpy.empty(len(userIDs), dtype=BODY_HEADER_DTYPE)
+    headers['userID'] = userIDs
+    headers['leftHandState'] = handStates[userIDs, 0]
+    headers['rightHandState'] = handStates[userIDs, 1]
+    headers['jointCount'] = jointCounts
+
+    # each body's header is followed by its joints (in the type tags, as in the payload)
+    typeTags = typeTags + "i" + "".join(["iiii" + jointTypeTags * int(count) for count in jointCounts])
+    data = [oscString(address), oscString(typeTags), arguments, struct.pack(">i", len(userIDs))]
+
+    first = 0
+    for body in range(len(userIDs)):  # interleave headers and joints
+        last = first + int(jointCounts[body])
+        data.append(headers[body].tobytes())
+        data.append(joints[first:last].tobytes())
+        first = last
+
+    return OscPacket(b"".join(data))
+
+def localIpAddress(ipAddress, port):
+    ''' Returns the IP address of this computer, as seen from the given destination '''
+
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect((ipAddress, port))  # nothing is sent, but this picks the network interface
+        return probe.getsockname()[0]
+    finally:
+        probe.close()
+
+class KuatroClient():
+
+    ##### OSC Namespace #####
+    NEW_USER_MESSAGE = "/kuatro/newUser"
+    LOST_USER_MESSAGE = "/kuatro/lostUser"
+    JOINT_COORDINATES_MESSAGE = "/kuatro/jointCoordinates"
+    HAND_STATE_MESSAGE = "/kuatro/handState"
+    REGISTER_DEVICE_MESSAGE = "/kuatro/registerDevice"
+    CALIBRATE_DEVICE_MESSAGE = "/kuatro/calibrateDevice"
+    PROCESSING_MESSAGE = "/kuatro/processing"
+    BODY_FRAME_MESSAGE = "/kuatro/bodyFrame"
+    SUBSCRIPTION_MESSAGE = "/kuatro/subscription"
+    CALIBRATION_MESSAGE = "/kuatro/calibration"
+    CALIBRATED_FRAME_MESSAGE = "/kuatro/calibratedFrame"
+    REDIRECT_MESSAGE = "/kuatro/redirect"
+
+    def __init__(self, clientID, serverIpAddress, serverPort, recordFile=None):
+
+        self.clientID = clientID  # unique ID of this device used by Kuatro Server
+        self.frameSequence = 0  # sequence number of the next body frame (lets the server skip duplicate or out of order frames)
+        self.captureTime = 0  # when the current body frame was captured (in milliseconds since the client started)
+        self.startTime = perf_counter()  # when the client started (capture times are relative to this)
+        self.framesCaptured = 0  # how many frames were passed to sendFrame()
+        self.forceKeyframe = False  # set when a destination dropped a frame, so that the next frame carries all joints
+
+        # the joints to send, and the (trackingState, x, y, z) of each joint of each body, as last sent to the server (used by the deadband)
+        self.jointsSelected = numpy.zeros(JOINT_COUNT, dtype=bool)
+        self.jointsSelected[JOINTS_LIST] = True
+        self.messagesSelected = set(MESSAGES_LIST)  # the optional messages to send
+        self.subscriptions = {}  # the joints and message types each Kuatro Server asked for, as {serverIpAddress: (joints, messages)}
+        self.sentPositions = numpy.zeros((BODY_COUNT, JOINT_COUNT, 3), dtype=numpy.float32)
+        self.sentStates = numpy.zeros((BODY_COUNT, JOINT_COUNT), dtype=numpy.uint8)
+        self.sentValid = numpy.zeros((BODY_COUNT, JOINT_COUNT), dtype=bool)
+        self.sendBodyFrames = SEND_BODY_FRAMES  # send body frames, or one message per joint? (see SEND_BODY_FRAMES)
+
+        # if smoothing, frames are smoothed into a frame of our own (the original is recorded as captured)
+        self.skeletonFilter = None
+        if SMOOTH_JOINTS:
+            self.skeletonFilter = SkeletonFilter()
+        self.filteredFrame = newFrame()
+
+        # create array of booleans to say if a body WAS tracked, instantiate all to False
+        self.was_tracked = numpy.zeros(BODY_COUNT, dtype=bool)
+
+        # if asked, record every frame we send (to replay it later - see kinectineReplay.py)
+        self.recorder = None
+        if recordFile is not None:
+            self.recorder = SkeletonRecorder(recordFile, self.clientID)
+
+        self.isRunning = True  # value is set to false to turn off the thread that is running the client
+
+        # listen for messages from the Kuatro Server (on any free port - it is sent to the server when registering)
+        serverMessages = dispatcher.Dispatcher()
+        serverMessages.map(KuatroClient.SUBSCRIPTION_MESSAGE, self.updateSubscription, needs_reply_address=True)
+        serverMessages.map(KuatroClient.CALIBRATION_MESSAGE, self.updateCalibration, needs_reply_address=True)
+        serverMessages.map(KuatroClient.REDIRECT_MESSAGE, self.redirect, needs_reply_address=True)
+        self.listener = osc_server.BlockingOSCUDPServer(("0.0.0.0", 0), serverMessages)
+        self.listenPort = self.listener.server_address[1]
+        Thread(target=self.listener.serve_forever, daemon=True).start()
+
+        # establish connection to server and register the client with the Kuatro Server
+        self.destinations = []  # where to send messages (one OSC Sender for each)
+        self.destinationIpAddresses = []  # and their IP addresses (where their messages come from)
+        self.calibrations = {}  # how to calibrate coordinates for each destination, as {ipAddress: (deviceIndex, calibrationVersion, offsets, scales)}
+        self.addDestination(serverIpAddress, serverPort)
+
+        # send identical messages to another destination
+        #self.addDestination(EXTERNAL_IP_ADDRESS, EXTERNAL_PORT)
+
+        # setup thread to run the client (see run() in subclasses)
+        self.clientThread = Thread(target=self.runClient)
+
+    ##############################
+    ###### Destinations ##########
+    ##############################
+
+    def addDestination(self, ipAddress, port):
+        ''' Starts sending all messages to another Kuatro Server as well, and registers the client with it
+          (telling it where we listen for its messages) '''
+
+        destination = OscSender(ipAddress, port, onDrop=self.frameDropped)
+        registration = [self.clientID, localIpAddress(ipAddress, port), self.listenPort]
+        destination.sendEvent([buildMessage(KuatroClient.REGISTER_DEVICE_MESSAGE, registration)])  # register client with server
+        self.destinations.append(destination)
+        self.destinationIpAddresses.append(socket.gethostbyname(ipAddress))
+
+    def redirect(self, serverAddress, address, port):
+        ''' Callback for REDIRECT_MESSAGE, which tells the client that a Kuatro Server hands it to another
+          server on the same machine, at the given port (e.g., the aggregator of a sharded server hands
+          each device to one of its workers - see kuatroAggregator.py).  The client sends everything to
+          that port from now on, and registers with it. '''
+
+        if serverAddress[0] not in self.destinationIpAddresses:  # not one of our destinations
+            return
+        index = self.destinationIpAddresses.index(serverAddress[0])
+        oldDestination = self.destinations[index]
+
+        destination = OscSender(oldDestination.ipAddress, port, onDrop=self.frameDropped)
+        registration = [self.clientID, localIpAddress(oldDestination.ipAddress, port), self.listenPort]
+        destination.sendEvent([buildMessage(KuatroClient.REGISTER_DEVICE_MESSAGE, registration)])  # register client with the new server
+
+        # replace the list as a whole, so a frame being sent goes either to the old or the new destination
+        destinations = list(self.destinations)
+        destinations[index] = destination
+        self.destinations = destinations
+
+        # the new server knows nothing yet, so announce the users being tracked again, with all their joints
+        self.was_tracked = numpy.zeros(BODY_COUNT, dtype=bool)
+        self.forceKeyframe = True
+
+        oldDestination.close()
+        print(self.clientID + " now sends to " + oldDestination.ipAddress + " on port " + str(port))
+
+    def sendEvent(self, address, arguments):
+        ''' Sends a message that must get to all destinations (it is never dropped) '''
+
+        packets = [buildMessage(address, arguments)]  # packed once, for all destinations
+        for destination in self.destinations:
+            destination.sendEvent(packets)
+
+    def sendFramePackets(self, packets):
+        ''' Sends the messages of one frame to all destinations (a destination that falls behind
+          drops its oldest frames) '''
+
+        for destination in self.destinations:
+            destination.sendFrame(packets)
+
+    def frameDropped(self):
+        ''' Called when a destination drops a frame.  Since body frames only carry the joints that moved,
+          the next one carries all joints, so the server does not miss any movement '''
+
+        self.forceKeyframe = True
+
+    def closeDestinations(self):
+        ''' Sends whatever is still queued to all destinations, and stops their senders '''
+
+        for destination in self.destinations:
+            destination.close()
+
+    def stats(self):
+        ''' Returns the client's counters, as text '''
+
+        text = self.clientID + ": " + str(self.framesCaptured) + " frames captured"
+        for destination in self.destinations:
+            text = text + "\n   " + destination.stats()
+        return text
+
+    def updateSubscription(self, serverAddress, address, jointCount, *args):
+        ''' Callback for SUBSCRIPTION_MESSAGE, which tells the client which joints and message types
+          a Kuatro Server's views use.  Its arguments are:
+               jointCount, jointID*jointCount, messageType*
+
+          The client sends what any of its servers asked for (from the next frame on). '''
+
+        self.subscriptions[serverAddress[0]] = (args[:jointCount], args[jointCount:])
+
+        jointsSelected = numpy.zeros(JOINT_COUNT, dtype=bool)
+        messagesSelected = set()
+        for joints, messages in self.subscriptions.values():
+            jointsSelected[list(joints)] = True
+            messagesSelected.update(messages)
+
+        # replace them as a whole, so a frame being sent sees either the old or the new subscription
+        self.jointsSelected = jointsSelected
+        self.messagesSelected = messagesSelected
+        print(self.clientID + " now sends joints " + str(numpy.flatnonzero(jointsSelected).tolist()) +
+              " and messages " + str(sorted(messagesSelected)))
+
+    def updateCalibration(self, serverAddress, address, deviceIndex, calibrationVersion, minX, minY, minZ, maxX, maxY, maxZ):
+        ''' Callback for CALIBRATION_MESSAGE, which tells the client how a Kuatro Server calibrates its
+          coordinates (the range it maps to the virtual world).  From the next frame on, the client sends
+          that server calibrated body frames, with the given deviceIndex and calibrationVersion (a
+          calibrationVersion of 0 means it should send the coordinates it measures instead). '''
+
+        if calibrationVersion == 0:
+            self.calibrations.pop(serverAddress[0], None)
+        else:
+            offsets = numpy.array([minX, minY, minZ], dtype=numpy.float32)
+            scales = COORDINATE_MAX / numpy.maximum(numpy.array([maxX, maxY, maxZ], dtype=numpy.float32) - offsets, 1)
+            self.calibrations[serverAddress[0]] = (deviceIndex, calibrationVersion, offsets, scales)
+
+        self.forceKeyframe = True  # so the server gets all joints, calibrated the new way
+
+    ##############################
+    ###### Event Functions #######
+    ##############################
+
+    def addUser(self, userID, x, y, z):
+        ''' Adds a new user to the Client when a new user is detected by the Kinect.
+          Send the corresponding OSC Message to the Kuatro Server '''
+
+        self.was_tracked[userID] = True # we now know this body has been tracked
+        self.sendEvent(KuatroClient.NEW_USER_MESSAGE, [userID, x, y, z, self.clientID])  # tell the server we found a new user
+
+    def removeUser(self, userID):
+        ''' Removes a user from the Client when a lost user is detected by the Kinect.
+          Send the corresponding OSC message to the Kuatro Server '''
+
+        self.was_tracked[userID] = False  # we lost tracking on this user
+        self.sentValid[userID] = False  # the next user in this slot starts from scratch
+        self.sendEvent(KuatroClient.LOST_USER_MESSAGE, [userID, self.clientID])  # tell the server we lost this user
+
+    def sendFrame(self, frame):
+        ''' Sends a new skeleton frame to the Kuatro Server (and records it, if recording) '''
+
+        if self.recorder is not None:
+            self.recorder.record(frame)
+
+        self.framesCaptured = self.framesCaptured + 1
+
+        if self.skeletonFilter is not None:
+            self.skeletonFilter.filter(frame, self.filteredFrame)
+            frame = self.filteredFrame
+
+        self.captureTime = int(frame['timestamp'] * 1000)  # when the frame was captured (in milliseconds)
+        self.sendAllUserCoords(frame)
+
+    def sendAllUserCoords(self, frame):
+        ''' Sends all user coordinates via OSC Messages to the Kuatro Server.
+          This happens for each Kuatro Frame '''
+
+        tracked = frame['tracked'] != 0  # which bodies are being tracked
+        positions = frame['positions']  # x, y, z of every joint of every body (in millimetres)
+
+        # this logic allows BasicView to work, but should probably be changed (should we include coordinate data with user lost/found?)
+        for userID in numpy.flatnonzero(tracked & ~self.was_tracked).tolist():  # bodies that weren't already being tracked
+            x, y, z = positions[userID, SPINE_BASE].tolist()
+            self.addUser(userID, x, y, z)  # we found a new user
+
+        for userID in numpy.flatnonzero(~tracked & self.was_tracked).tolist():  # bodies that are not being tracked but were before
+            self.removeUser(userID)  # we lost a user
+
+        if self.sendBodyFrames:
+            self.sendBodyFrame(frame, tracked)
+        else:
+            self.sendUserMessages(self.getBodies(frame, tracked))
+
+    def getBodies(self, frame, tracked):
+        ''' Returns (userID, leftHandState, rightHandState, joints) for every tracked body, where joints
+          holds (jointID, trackingState, x, y, z) for every selected joint '''
+
+        jointsSelected = numpy.flatnonzero(self.jointsSelected).tolist()
+        bodies = []
+        for userID in numpy.flatnonzero(tracked).tolist():
+            positions = frame['positions'][userID].tolist()
+            trackingStates = frame['trackingStates'][userID].tolist()  # 0 if not tracked, 1 if inferred, 2 if tracked
+            joints = [(jointID, trackingStates[jointID]) + tuple(positions[jointID]) for jointID in jointsSelected]
+
+            # hand states: unknown = 0, not tracked = 1, open = 2, closed = 3, lasso = 4
+            leftHandState, rightHandState = frame['handStates'][userID].tolist()
+            bodies.append((userID, leftHandState, rightHandState, joints))
+
+        return bodies
+
+    def sendBodyFrame(self, frame, tracked):
+        ''' Sends all tracked bodies to the Kuatro Server as a single BODY_FRAME_MESSAGE (or
+          CALIBRATED_FRAME_MESSAGE, once the server told us how to calibrate our coordinates),
+          preceded by the frame's sequence number, capture time and whether it is a keyframe
+          (see bodyFrame.py for the layout of its arguments).  All bodies and joints are
+          processed at once (as arrays), rather than one at a time. '''
+
+        isKeyframe = self.frameSequence % KEYFRAME_INTERVAL == 0 or self.forceKeyframe  # is it time to send all joints?
+        self.forceKeyframe = False
+
+        positions = frame['positions']
+        trackingStates = frame['trackingStates']
+
+        # send the selected joints of tracked bodies - coordinates of 0, 0, 0 means the joint
+        # is temporarily lost, so leave it out of the frame
+        send = tracked[:, None] & self.jointsSelected[None, :] & positions.any(axis=2)
+
+        # leave out joints that have not moved (the server remembers where they are)
+        if not isKeyframe:
+            moved = (numpy.abs(positions - self.sentPositions) > DEADBAND).any(axis=2)
+            moved |= trackingStates != self.sentStates
+            moved |= ~self.sentValid
+            send &= moved
+
+        self.sentPositions[send] = positions[send]
+        self.sentStates[send] = trackingStates[send]
+        self.sentValid |= send
+
+        # servers that calibrated us get calibrated frames, the rest get the coordinates we measure
+        # (each kind of frame is packed once, no matter how many servers it goes to)
+        packets = {}
+        for destination, ipAddress in zip(self.destinations, self.destinationIpAddresses):
+            calibration = self.calibrations.get(ipAddress)
+            key = None
+            if calibration is not None:
+                key = ipAddress
+            if key not in packets:
+                if calibration is None:
+                    packets[key] = packBodyFrame(self.clientID, self.frameSequence, self.captureTime, isKeyframe,
+                                                 tracked, frame['handStates'], send, trackingStates, positions)
+                else:
+                    packets[key] = packCalibratedFrame(calibration, self.frameSequence, self.captureTime, isKeyframe,
+                                                       tracked, frame['handStates'], send, trackingStates, positions)
+            destination.sendFrame([packets[key]])
+
+        self.frameSequence = self.frameSequence + 1
+
+    def sendUserMessages(self, bodies):
+        ''' Sends all tracked bodies to the Kuatro Server one message per joint, hand state
+          and processing coordinate (all of them together, as one frame) '''
+
+        messagesSelected = self.messagesSelected
+        sendHandStates = KuatroClient.HAND_STATE_MESSAGE in messagesSelected
+        sendProcessing = KuatroClient.PROCESSING_MESSAGE in messagesSelected
+
+        packets = []
+        for userID, leftHandState, rightHandState, jointData in bodies:
+            for jointID, trackingState, x, y, z in jointData:
+
+                # if the joint is a HAND joint, send that hand's current state
+                if jointID == HAND_LEFT and sendHandStates:
+                    packets.append(buildMessage(KuatroClient.HAND_STATE_MESSAGE, [userID, "left", leftHandState, self.clientID]))
+                if jointID == HAND_LEFT and sendProcessing:
+                    packets.append(buildMessage(KuatroClient.PROCESSING_MESSAGE, [userID, x, y, self.clientID]))
+
+                if jointID == HAND_RIGHT and sendHandStates:
+                    packets.append(buildMessage(KuatroClient.HAND_STATE_MESSAGE, [userID, "right", rightHandState, self.clientID]))
+
+                # coordinates of 0, 0, 0 means user is temporarily lost
+                # reduce OSC messages by not sending if all 3 are 0
+                if x != 0 or y != 0 or z != 0:
+                    packets.append(buildMessage(KuatroClient.JOINT_COORDINATES_MESSAGE,
+                                                [userID, jointID, x, y, z, trackingState, self.clientID]))  # and send it to the Server
+                    ## print ("User:", userID, "location", x, y, z)
+
+        self.sendFramePackets(packets)
+
+    def removeAllUsers(self):
+        ''' Tells the Kuatro Server that all users this client is tracking are gone '''
+
+        for userID in range(0, BODY_COUNT):
+            if self.was_tracked[userID]:
+                self.removeUser(userID)
+
+
+    ####################################
+    ###### Calibration Process #########
+    ####################################
+
+    def calibrateWithServer(self):
+        ''' Calibrate the device with the Kuatro Server by finding the
+          minimum and maximum coordinate values that the device outputs '''
+
+        # hard-coded placeholder values for calibration, only use if the Calibrator isn't working
+        self.sendEvent(KuatroClient.CALIBRATE_DEVICE_MESSAGE, [self.clientID, -3000, -3000, 0, 3000, 3000, 3000])
+
+    ####################################
+    ######### Client Setup #############
+    ####################################
+
+    def run(self):
+        '''Produces frames and passes them to sendFrame(), until the client is stopped.  Subclasses
+          provide the frames (see kinectineClient.py) - this one has none, so it just waits, still
+          registered with (and listening to) the server, until the client is stopped. '''
+
+        while self.isRunning:
+            sleep(STOP_POLL_DELAY)
+
+    def runClient(self):
+        '''Runs the client (in its own thread), and finishes the recording and sending when done '''
+
+        try:
+            self.run()
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
+            self.closeDestinations()
+            self.listener.shutdown()  # stop listening to the server
+            self.listener.server_close()
+
+    def start(self):
+        ''' Start the client '''
+
+        self.isRunning = True
+        self.clientThread.start()
+
+    def stop(self):
+        ''' Stop the client '''
+
+        self.isRunning = False
@@ -0,0 +1,265 @@
+# kuatroServerBenchmark.py
+#
+# The Kuatro Server Benchmark measures how fast the Kuatro Server (see kinectineServer.py) takes in
+# device messages - without the network, so it measures the server alone, and gives the same results
+# on every run (to catch a slower ingest path before a show, rather than during one).
+#
+# It replays synthetic traffic (procedurally animated bodies, see skeletonSimulator.py) straight into
+# the server's message handlers - new and lost users, joint coordinates and hand states (or, with
+# --bodyFrames, body frames) - for 1 to 16 devices with 1 to 6 users each.  Views are stub OSC ports
+# that only note when each message would have been sent.  For each combination it reports:
+#
+#    messages/s     - how many messages the handlers took in per second
+#    p50, p99, max  - how long a handler took (microseconds - p50 and p99 are accurate to a factor of 2)
+#    bytes/msg      - how much memory the handlers allocated per message (if the JVM can tell)
+#    GCs            - how many garbage collections ran meanwhile
+#    delivered      - how many messages reached the (stub) views
+#
+# Usage (all arguments are optional):
+#
+#    jython kuatroServerBenchmark.py --devices 1,2,4,8,16 --users 1,2,4,6 --frames 150 --views 1 --bodyFrames
+#
+#  See README file for full instructions on using the Kuatro System
+
+from kinectineServer import KuatroServer
+from skeletonSimulator import SimulatedBody
+from serverMetrics import LatencyHistogram
+from bodyFrame import encodeBodies
+from java.lang import System, Thread
+from java.lang.management import ManagementFactory
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+FIRST_PORT = 50600       # each benchmarked server listens on its own port (though nothing is sent to it)
+FRAME_RATE = 30          # frames per second of the simulated devices
+JOINTS = [0, 4, 5, 7, 8, 9, 11]   # the joints devices send (SPINE_BASE, SHOULDER_LEFT, ELBOW_LEFT, HAND_LEFT, SHOULDER_RIGHT, ELBOW_RIGHT, HAND_RIGHT)
+TRACKED = 2              # Kinect tracking state of the joints
+
+
+class BenchmarkMessage():
+   ''' An OSC message, as the server's handlers see it '''
+
+   def __init__(self, address, arguments):
+      self.address = address
+      self.arguments = arguments
+
+   def getAddress(self):
+      return self.address
+
+   def getArguments(self):
+      return self.arguments
+
+
+class StubOscOut():
+   ''' Stands in for a view's OSC port - notes when each message would have been sent '''
+
+   def __init__(self):
+      self.sendTimes = []
+
+   def sendMessage(self, address, *args):
+      self.sendTimes.append(time.time())
+
+
+class KuatroServerBenchmark():
+
+   def __init__(self, frames = 150, viewCount = 1, bodyFrames = False):
+
+      self.frames = frames           # how many frames each device sends
+      self.viewCount = viewCount     # how many (stub) views are registered
+      self.bodyFrames = bodyFrames   # send body frames (instead of one message per joint and hand state)
+      self.nextPort = FIRST_PORT
+
+      # allocated bytes are counted by the JVM's thread bean (when it supports it)
+      self.threadBean = ManagementFactory.getThreadMXBean()
+      try:
+         self.threadBean.getThreadAllocatedBytes(Thread.currentThread().getId())
+         self.countsAllocations = True
+      except Exception:
+         self.countsAllocations = False
+
+   def quietly(self, function, *args):
+      '''Calls 'function', without printing (the server prints as devices and views register)'''
+
+      stdout = sys.stdout
+      sys.stdout = NullOutput()
+      try:
+         return function(*args)
+      finally:
+         sys.stdout = stdout
+
+   def createServer(self, deviceCount, calibrationFile):
+      '''Returns a new Kuatro Server, with 'deviceCount' devices and the views registered, keeping
+         calibrations in 'calibrationFile' '''
+
+      server = self.quietly(lambda: KuatroServer(self.nextPort, calibrationFile = calibrationFile))
+      self.nextPort = self.nextPort + 1
+      server.userTimeout = server.deviceTimeout = 1000000   # users stay, however long the benchmark takes
+
+      for view in range(self.viewCount):
+         self.quietly(server.registerView, BenchmarkMessage(KuatroServer.REGISTER_VIEW_MESSAGE, ["localhost", 60000 + view]))
+      for viewSender in server.viewSenders:
+         viewSender.oscOut = StubOscOut()
+
+      for device in range(deviceCount):
+         self.quietly(server.registerDevice, BenchmarkMessage(KuatroServer.REGISTER_DEVICE_MESSAGE, ["benchmark" + str(device)]))
+
+      return server
+
+   def createMessages(self, server, deviceCount, userCount):
+      '''Returns the messages of all frames of all devices, in the order they would arrive, as
+         [(handler, message)] (made up front, so making them is not measured)'''
+
+      messages = []
+      for device in range(deviceCount):
+         clientID = "benchmark" + str(device)
+         bodies = [SimulatedBody(device * 6 + user, 3.0, 1.0) for user in range(userCount)]   # bodies come and go every few seconds
+         wasPresent = [False] * userCount
+
+         deviceMessages = []
+         for frame in range(self.frames):
+            t = frame / float(FRAME_RATE)
+            frameMessages = []
+            frameBodies = []
+
+            for user in range(userCount):
+               body = bodies[user]
+               present = body.isPresent(t)
+
+               if present:
+                  positions = body.joints(t)
+                  leftHandState, rightHandState = body.handStates(t)
+                  x, y, z = positions[0]
+
+                  if not wasPresent[user]:
+                     frameMessages.append((server.addUser, BenchmarkMessage(KuatroServer.NEW_USER_MESSAGE, [user, x, y, z, clientID])))
+
+                  joints = [(jointID, TRACKED) + tuple(positions[jointID]) for jointID in JOINTS]
+                  if self.bodyFrames:
+                     frameBodies.append((user, leftHandState, rightHandState, joints))
+                  else:
+                     for jointID, trackingState, x, y, z in joints:
+                        frameMessages.append((server.handleUserData, BenchmarkMessage(KuatroServer.JOINT_COORDINATES_MESSAGE,
+                                                                                      [user, jointID, x, y, z, trackingState, clientID])))
+                     frameMessages.append((server.echoHandState, BenchmarkMessage(KuatroServer.HAND_STATE_MESSAGE, [user, "left", leftHandState, clientID])))
+                     frameMessages.append((server.echoHandState, BenchmarkMessage(KuatroServer.HAND_STATE_MESSAGE, [user, "right", rightHandState, clientID])))
+
+               elif wasPresent[user]:
+                  frameMessages.append((server.removeUser, BenchmarkMessage(KuatroServer.LOST_USER_MESSAGE, [user, clientID])))
+
+               wasPresent[user] = present
+
+            if self.bodyFrames:
+               args = [clientID, frame, int(t * 1000), 1] + encodeBodies(frameBodies)   # every frame a keyframe
+               frameMessages.append((server.handleBodyFrame, BenchmarkMessage(KuatroServer.BODY_FRAME_MESSAGE, args)))
+
+            deviceMessages.append(frameMessages)
+
+         for frame in range(self.frames):   # devices' frames are interleaved
+            if len(messages) <= frame:
+               messages.append([])
+            messages[frame].extend(deviceMessages[frame])
+
+      allMessages = []
+      for frameMessages in messages:
+         allMessages.extend(frameMessages)
+      return allMessages
+
+   def run(self, deviceCount, userCount):
+      '''Replays 'frames' frames of 'deviceCount' devices with 'userCount' users each into a new server,
+         and returns the results, as a dictionary'''
+
+      # a throwaway calibration store (so the benchmark never reads or writes the one in the working directory)
+      calibrationDirectory = tempfile.mkdtemp()
+      server = self.createServer(deviceCount, os.path.join(calibrationDirectory, "kuatroCalibrations.tsv"))
+      try:
+         return self.measure(server, self.createMessages(server, deviceCount, userCount), deviceCount, userCount)
+      finally:
+         server.close()   # so its threads do not run alongside later measurements
+         shutil.rmtree(calibrationDirectory)
+
+   def measure(self, server, messages, deviceCount, userCount):
+      '''Replays 'messages' (see createMessages) into 'server', and returns the results, as a dictionary'''
+
+      histogram = LatencyHistogram()
+      threadID = Thread.currentThread().getId()
+      gcCount = self.collections()
+      allocated = 0
+      if self.countsAllocations:
+         allocated = self.threadBean.getThreadAllocatedBytes(threadID)
+
+      start = System.nanoTime()
+      for handler, message in messages:
+         handlerStart = System.nanoTime()
+         handler(message)
+         histogram.record(System.nanoTime() - handlerStart)
+      elapsed = (System.nanoTime() - start) / 1e9
+
+      bytesPerMessage = None
+      if self.countsAllocations:
+         bytesPerMessage = (self.threadBean.getThreadAllocatedBytes(threadID) - allocated) / max(len(messages), 1)
+      gcCount = self.collections() - gcCount
+
+      # let the views' senders finish
+      deadline = time.time() + 5
+      while time.time() < deadline and [viewSender for viewSender in server.viewSenders if len(viewSender.queue) > 0]:
+         time.sleep(0.01)
+      delivered = 0
+      for viewSender in server.viewSenders:
+         delivered = delivered + len(viewSender.oscOut.sendTimes)
+
+      stats = histogram.stats()
+      return {"devices": deviceCount, "users": userCount, "messages": len(messages),
+              "rate": len(messages) / max(elapsed, 1e-9), "p50": stats["p50"], "p99": stats["p99"], "max": stats["max"],
+              "bytesPerMessage": bytesPerMessage, "collections": gcCount, "delivered": delivered}
+
+   def collections(self):
+      '''Returns how many garbage collections ran so far'''
+
+      count = 0
+      for collector in ManagementFactory.getGarbageCollectorMXBeans():
+         count = count + max(collector.getCollectionCount(), 0)
+      return count
+
+
+class NullOutput():
+   ''' Swallows printed text '''
+
+   def write(self, text):
+      pass
+
+
+def formatResult(result):
+   '''Returns a benchmark result as a line of the report'''
+
+   bytesPerMessage = "n/a"
+   if result["bytesPerMessage"] is not None:
+      bytesPerMessage = str(int(result["bytesPerMessage"]))
+
+   return "%7d %5d %9d %11d %7d %7d %9.1f %9s %4d %10d" % (result["devices"], result["users"], result["messages"],
+          int(result["rate"]), result["p50"], result["p99"], result["max"], bytesPerMessage, result["collections"], result["delivered"])
+
+
+def option(name, default):
+   '''Returns the value after --name on the command line (or default, if it is not there)'''
+
+   if name in sys.argv:
+      return sys.argv[sys.argv.index(name) + 1]
+   return default
+
+
+##### Run the Benchmark
+if __name__ == '__main__':
+
+   deviceCounts = [int(count) for count in option("--devices", "1,2,4,8,16").split(",")]
+   userCounts = [int(count) for count in option("--users", "1,2,4,6").split(",")]
+   benchmark = KuatroServerBenchmark(int(option("--frames", "150")), int(option("--views", "1")), "--bodyFrames" in sys.argv)
+
+   benchmark.run(4, 6)   # warm up (so the JVM has compiled the handlers before we measure them)
+
+   print "devices users  messages  messages/s p50(us) p99(us)   max(us) bytes/msg  GCs  delivered"
+   for deviceCount in deviceCounts:
+      for userCount in userCounts:
+         print formatResult(benchmark.run(deviceCount, userCount))
@@ -0,0 +1,151 @@
+# kuatroServerDisplay.py
+#
+# The Kuatro Server Display is a window to watch and calibrate a Kuatro Server (see kinectineServer.py).
+#
+# The server runs without it (e.g., on machines without a display).  The display attaches to a
+# running server, and refreshes itself at a fixed rate from what the server knows - each device
+# gets a "light" (green when the device sends data, grey otherwise), a checkbox to include it in
+# calibration, and a line with its frame and message rates.  The Calibrate menu starts and stops
+# calibration (as do the server's calibration OSC messages - the display shows either), and rolls
+# back the checked devices' calibrations.
+#
+#  See README file for full instructions on using the Kuatro System
+
+from gui import *
+
+
+class KuatroServerDisplay():
+
+   def __init__(self, server, refreshDelay = 500):
+
+      self.server = server               # the Kuatro Server to watch
+      self.refreshDelay = refreshDelay   # delay between display refreshes
+
+      self.deviceWidgets = []            # the light, checkbox, and rate label of each device (in the order devices registered)
+      self.wasCalibrating = False        # whether the server was calibrating at the last refresh
+      self.backgroundColor = Color.BLACK # the display's background color
+      self.warningLabel = None           # tells the user to calibrate (if some device has no calibration data)
+
+      # create calibration GUI
+      self.display = Display("Kuatro Server", 600, 600, 0, 0, Color.BLACK)
+
+      # create Menu for calibration
+      calibrateMenu = Menu("Calibrate")
+      calibrateMenu.addItemList(["Start", "Stop", "Roll Back"], [self.server.calibrationStart, self.server.calibrationStop, self.rollbackCalibration])
+      self.display.addMenu(calibrateMenu)
+
+      # create Menu for the trace (when the server is verbose)
+      if self.server.trace is not None:
+         traceMenu = Menu("Trace")
+         traceMenu.addItem("Dump", self.server.dumpTrace)
+         self.display.addMenu(traceMenu)
+
+      # add label for instructions
+      self.instructions = [self.display.drawLabel("Select Calibrate > Start to start the calibration process.", 20, 75, Color.WHITE)]
+
+      # refresh the display at a fixed rate (so it never slows down the server)
+      self.refreshTimer = Timer(self.refreshDelay, self.refresh, [], True)
+      self.refreshTimer.start()
+
+   def addDevice(self, device):
+      '''Adds a newly registered device to the display'''
+
+      radius = 7
+      horizontal = device.index*20 + 20
+
+      light = Circle(horizontal+10, 525, radius, Color.GREEN, True) # a "light" which is green when this client receives data, grey otherwise
+      self.display.add(light)
+      self.display.drawLabel(str(device.index), horizontal+radius, 500, Color.WHITE) # create a label for the device
+
+      # create a checkbox representing whether or not to include this device during calibration
+      checkbox = Checkbox("", lambda isChecked: self.server.selectDevice(device, isChecked))
+      self.display.add(checkbox, horizontal, 540)
+
+      # and a line with its message rates
+      rateLabel = self.display.drawLabel("Device " + str(device.index) + ": waiting for data", 20, 300 + device.index*20, Color.WHITE)
+
+      self.deviceWidgets.append([light, True, checkbox, rateLabel])
+
+   def showInstructions(self, lines):
+      '''Replaces the instructions with the given lines of text'''
+
+      for label in self.instructions:
+         self.display.remove(label)
+
+      self.instructions = []
+      for i in range(len(lines)):
+         self.instructions.append(self.display.drawLabel(lines[i], 20, 175 + i*25, Color.WHITE))
+
+   def refresh(self):
+      '''Shows what the server knows - each device's light is green if the device sent data lately
+         (grey otherwise), followed by its frame and message rates.  While calibrating, the
+         background is green if coordinates came in, and red if there are no users.'''
+
+      server = self.server
+
+      # add devices that registered since the last refresh
+      while len(self.deviceWidgets) < len(server.deviceList):
+         self.addDevice(server.deviceList[len(self.deviceWidgets)])
+
+      for device in server.deviceList:
+         widgets = self.deviceWidgets[device.index]
+         light, isLightOn, checkbox, rateLabel = widgets
+
+         isLightOn = device.frameRate > 0 or device.messageRate > 0
+         if isLightOn != widgets[1]:   # only repaint when it changes
+            widgets[1] = isLightOn
+            if isLightOn:
+               light.setColor(Color.GREEN)
+            else:
+               light.setColor(Color.GRAY)
+
+         if checkbox.isChecked() != device.isSelected:   # selected some other way (e.g., an OSC message)
+            if device.isSelected:
+               checkbox.check()
+            else:
+               checkbox.uncheck()
+
+         rateLabel.setText("Device " + str(device.index) + ": " +
+                           str(round(device.frameRate, 1)) + " frames/s (" + str(round(device.skipRate, 1)) + " skipped), " +
+                           str(round(device.messageRate, 1)) + " messages/s, " + str(len(device.users)) + " users")
+
+         # if there was no calibration data found, inform the user they need to run the calibration process
+         if not device.calibrationFound and self.warningLabel is None:
+            self.warningLabel = self.display.drawLabel("No calibration data found.  Please run calibration process.", 20, 20, Color.WHITE)
+
+      # calibration started or stopped (from the menu, or some other way)
+      if server.calibrating != self.wasCalibrating:
+         self.wasCalibrating = server.calibrating
+
+         if server.calibrating:
+            self.showInstructions(["Zig-Zag through the room for the system to find",
+                                   "the space that it can sense (the light will be green).",
+                                   "Select Calibrate > Stop when done."])
+         else:
+            self.showInstructions(["Calibration complete and data saved"])
+            self.setBackground(Color.BLACK)  # set background to black since we are no longer calibrating
+
+            if self.warningLabel is not None:
+               self.display.remove(self.warningLabel)
+               self.warningLabel = None
+
+      if server.calibrating:
+         if server.calibrationDataReceived:    # a user is in the space
+            server.calibrationDataReceived = False
+            self.setBackground(Color.GREEN)
+         elif not server.virtualUsers:         # nobody is in the space
+            self.setBackground(Color.RED)
+
+   def rollbackCalibration(self):
+      '''Rolls back the calibration of the devices checked (see KuatroServer.rollbackCalibration)'''
+
+      for device in self.server.deviceList:
+         if device.isSelected:
+            self.server.rollbackCalibration(device)
+
+   def setBackground(self, color):
+      '''Sets the display's background color (only repainting when it changes)'''
+
+      if color != self.backgroundColor:
+         self.display.setColor(color)
+         self.backgroundColor = color
@@ -0,0 +1,123 @@
+# oscSender.py
+#
+# An OSC Sender sends packets to one destination (e.g., the Kuatro Server) from its own thread,
+# so that whoever produces the packets (e.g., the Kuatro Client's capture loop) never waits on
+# the network.
+#
+# Packets wait in a bounded queue.  Frames (e.g., body frames) are only worth sending while they
+# are fresh, so when the queue already holds SEND_QUEUE_SIZE frames, the oldest frame is dropped to
+# make room for the new one.  Events (e.g., new and lost users) are never dropped, and everything
+# is sent in the order it was queued.
+#
+#  See README file for full instructions on using the Kuatro System
+
+
+from pythonosc import udp_client
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from threading import *
+from collections import deque
+
+# how many frames may wait to be sent to a destination (older frames are dropped beyond this)
+SEND_QUEUE_SIZE = 4
+
+def buildMessage(address, arguments):
+    ''' Packs an OSC message with the given address and arguments (a list), ready to be queued '''
+
+    builder = OscMessageBuilder(address=address)
+    for argument in arguments:
+        builder.add_arg(argument)
+    return builder.build()
+
+class OscSender():
+
+    def __init__(self, ipAddress, port, queueSize=SEND_QUEUE_SIZE, onDrop=None):
+
+        self.ipAddress = ipAddress
+        self.port = port
+        self.queueSize = queueSize  # how many frames may wait to be sent
+        self.onDrop = onDrop        # called (from the producer's thread) whenever a frame is dropped
+
+        self.queue = deque()         # (packets, isFrame) items, in the order they were queued
+        self.framesQueued = 0        # how many of them are frames
+        self.lock = Condition()      # guards the queue, and wakes up the sender thread
+
+        # counters
+        self.framesSent = 0          # frames sent to the destination
+        self.framesDropped = 0       # frames dropped because the destination fell behind
+        self.eventsSent = 0          # events sent to the destination
+        self.sendErrors = 0          # packets the network refused (e.g., send buffer full)
+
+        self.oscClient = udp_client.UDPClient(ipAddress, port)  # setup the OSC Connection to the destination
+
+        self.isRunning = True
+        self.senderThread = Thread(target=self.run, daemon=True)
+        self.senderThread.start()
+
+    def sendEvent(self, packets):
+        ''' Queues a list of packets that must not be dropped (e.g., a new user) '''
+
+        with self.lock:
+            self.queue.append((packets, False))
+            self.lock.notify()
+
+    def sendFrame(self, packets):
+        ''' Queues a list of packets that make up one frame, dropping the oldest waiting frame
+          if there are already too many '''
+
+        dropped = False
+        with self.lock:
+            if self.framesQueued >= self.queueSize:
+                for item in self.queue:  # find the oldest frame (events stay where they are)
+                    if item[1]:
+                        self.queue.remove(item)
+                        break
+                self.framesQueued = self.framesQueued - 1
+                self.framesDropped = self.framesDropped + 1
+                dropped = True
+
+            self.queue.append((packets, True))
+            self.framesQueued = self.framesQueued + 1
+            self.lock.notify()
+
+        if dropped and self.onDrop is not None:
+            self.onDrop()
+
+    def run(self):
+        ''' Sends queued packets as they arrive (in the sender thread), until closed and the queue is empty '''
+
+        while True:
+            with self.lock:
+                while self.isRunning and len(self.queue) == 0:
+                    self.lock.wait()
+                if len(self.queue) == 0:  # closed, and nothing left to send
+                    return
+                packets, isFrame = self.queue.popleft()
+                if isFrame:
+                    self.framesQueued = self.framesQueued - 1
+
+            for packet in packets:
+                try:
+                    self.oscClient.send(packet)
+                except OSError:
+                    self.sendErrors = self.sendErrors + 1
+
+            if isFrame:
+                self.framesSent = self.framesSent + 1
+            else:
+                self.eventsSent = self.eventsSent + 1
+
+    def close(self):
+        ''' Sends whatever is still queued, and stops the sender thread '''
+
+        with self.lock:
+            self.isRunning = False
+            self.lock.notify()
+        self.senderThread.join()
+
+    def stats(self):
+        ''' Returns the sender's counters, as text '''
+
+        return (self.ipAddress + ":" + str(self.port) + " - " + str(self.framesSent) + " frames sent, " +
+                str(self.framesDropped) + " dropped, " + str(self.eventsSent) + " events sent, " +
+                str(self.sendErrors) + " send errors")
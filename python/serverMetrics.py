@@ -0,0 +1,131 @@
+# serverMetrics.py
+#
+# Runtime metrics of the Kuatro Server - how many messages of each type come in, and how long
+# their handlers take - and the JSON text the server reports its metrics as (see KuatroServer.getStats).
+#
+# Handler times are kept in Latency Histograms.  A histogram counts how many times fell in each
+# power-of-two bucket (1-2 microseconds, 2-4, 4-8, ..., up to about 30 seconds), so recording a
+# time costs a few integer operations, and takes no memory, however many times are recorded.
+# Quantiles (e.g., the median or 99th percentile) are read off the buckets, so they are accurate
+# to within a factor of two - plenty to tell if a handler takes microseconds or milliseconds.
+#
+# This module is used by the Kuatro Server only (Jython).
+#
+#  See README file for full instructions on using the Kuatro System
+
+from java.lang import System
+from array import array
+
+# number of power-of-two buckets (in microseconds) of a Latency Histogram (the last bucket holds anything longer)
+HISTOGRAM_BUCKETS = 25
+
+
+class LatencyHistogram():
+
+   def __init__(self):
+
+      self.counts = array('l', [0] * HISTOGRAM_BUCKETS)   # how many times fell in each bucket
+      self.count = 0                                      # how many times were recorded
+      self.total = 0                                      # and their sum (nanoseconds)
+      self.max = 0                                        # the longest time (nanoseconds)
+
+   def record(self, nanoseconds):
+      '''Counts a time (in nanoseconds)'''
+
+      self.count = self.count + 1
+      self.total = self.total + nanoseconds
+      if nanoseconds > self.max:
+         self.max = nanoseconds
+
+      bucket = 0                       # find the bucket (bucket i holds 2^i to 2^(i+1) microseconds)
+      microseconds = nanoseconds / 1000
+      while microseconds > 1 and bucket < HISTOGRAM_BUCKETS - 1:
+         microseconds = microseconds >> 1
+         bucket = bucket + 1
+      self.counts[bucket] = self.counts[bucket] + 1
+
+   def quantile(self, fraction):
+      '''Returns (an upper bound of) the time, in microseconds, that 'fraction' (0 to 1) of the
+         recorded times did not exceed, e.g., quantile(0.99) is the 99th percentile'''
+
+      if self.count == 0:
+         return 0
+
+      needed = fraction * self.count
+      seen = 0
+      for bucket in range(HISTOGRAM_BUCKETS):
+         seen = seen + self.counts[bucket]
+         if seen >= needed:
+            return 2 ** (bucket + 1)
+      return 2 ** HISTOGRAM_BUCKETS
+
+   def stats(self):
+      '''Returns the histogram's summary, as a dictionary (times in microseconds)'''
+
+      mean = 0.0
+      if self.count > 0:
+         mean = self.total / 1000.0 / self.count
+
+      return {"count": self.count, "mean": round(mean, 1), "p50": self.quantile(0.5),
+              "p99": self.quantile(0.99), "max": round(self.max / 1000.0, 1)}
+
+
+class ServerMetrics():
+
+   def __init__(self):
+
+      self.startTime = System.currentTimeMillis()   # when the server started (milliseconds)
+      self.messageCounts = {}                       # how many messages of each type came in, as {address: count}
+      self.handlerTimes = {}                        # how long their handlers took, as {address: LatencyHistogram}
+
+   def timed(self, address, handler, onError=None):
+      '''Returns an OSC message handler that counts the messages 'handler' handles, and how long it takes.
+         If 'handler' fails, onError (if given) is called with the address and the exception.'''
+
+      self.messageCounts[address] = 0
+      self.handlerTimes[address] = LatencyHistogram()
+      histogram = self.handlerTimes[address]
+
+      def timedHandler(message):
+         start = System.nanoTime()
+         try:
+            try:
+               handler(message)
+            except Exception, e:
+               if onError is not None:
+                  onError(address, e)
+               raise
+         finally:
+            self.messageCounts[address] = self.messageCounts[address] + 1
+            histogram.record(System.nanoTime() - start)
+
+      return timedHandler
+
+   def stats(self):
+      '''Returns the message counts and handler times, as a dictionary'''
+
+      messages = {}
+      for address in self.messageCounts.keys():
+         messages[address] = {"count": self.messageCounts[address], "handlerTime": self.handlerTimes[address].stats()}
+
+      return {"uptime": (System.currentTimeMillis() - self.startTime) / 1000.0, "messages": messages}
+
+
+def toJson(value):
+   '''Returns 'value' (a dictionary, list, tuple, string, number, boolean or None) as JSON text'''
+
+   if value is None:
+      return "null"
+   elif value is True:
+      return "true"
+   elif value is False:
+      return "false"
+   elif isinstance(value, dict):
+      return "{" + ", ".join([toJson(str(key)) + ": " + toJson(value[key]) for key in value.keys()]) + "}"
+   elif isinstance(value, (list, tuple)):
+      return "[" + ", ".join([toJson(item) for item in value]) + "]"
+   elif isinstance(value, (int, long, float)):
+      return repr(value).rstrip("L")
+   else:
+      text = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\t", "\\t")
+      return '"' + text + '"'
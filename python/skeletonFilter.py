@@ -0,0 +1,84 @@
+# skeletonFilter.py
+#
+# Smoothing of whole skeleton frames (see skeletonFrame.py) with the One-Euro filter.
+#
+# This is the Kuatro Client's version of the JointFilter (see jointFilter.py, for how the filter
+# works and how to tune it).  All joints of all bodies are filtered at once, with numpy, and the
+# filter state and scratch space are allocated up front, so filtering a frame allocates nothing.
+#
+# This module is used by Kuatro Clients only (CPython), as it needs numpy.
+
+import math
+import numpy
+
+from skeletonFrame import BODY_COUNT, JOINT_COUNT
+from jointFilter import MIN_CUTOFF, BETA, DERIVATIVE_CUTOFF, DEFAULT_FRAME_TIME, smoothingFactor
+
+
+class SkeletonFilter():
+    ''' One-Euro filters for all joints of all bodies in a skeleton frame. '''
+
+    def __init__(self, minCutoff=MIN_CUTOFF, beta=BETA, derivativeCutoff=DERIVATIVE_CUTOFF):
+
+        self.minCutoff = minCutoff
+        self.beta = beta
+        self.derivativeCutoff = derivativeCutoff
+
+        shape = (BODY_COUNT, JOINT_COUNT, 3)
+        self.positions = numpy.zeros(shape, dtype=numpy.float32)   # filtered x, y, z of each joint
+        self.speeds = numpy.zeros(shape, dtype=numpy.float32)      # filtered speed along x, y, z (mm per second)
+        self.valid = numpy.zeros((BODY_COUNT, JOINT_COUNT), dtype=bool)   # True if the joint has been filtered before
+        self.lastTimestamp = None                                  # when the last frame was captured
+
+        # scratch space
+        self.tracked = numpy.zeros(BODY_COUNT, dtype=bool)
+        self.present = numpy.zeros((BODY_COUNT, JOINT_COUNT), dtype=bool)
+        self.fresh = numpy.zeros((BODY_COUNT, JOINT_COUNT), dtype=bool)
+        self.change = numpy.zeros(shape, dtype=numpy.float32)
+        self.factors = numpy.zeros(shape, dtype=numpy.float32)
+
+    def filter(self, frame, filtered):
+        '''Copies skeleton 'frame' into skeleton frame 'filtered', with its joint positions smoothed.'''
+
+        filtered[()] = frame
+        positions = filtered['positions']
+
+        timestamp = float(filtered['timestamp'])
+        frameTime = DEFAULT_FRAME_TIME
+        if self.lastTimestamp is not None and timestamp > self.lastTimestamp:
+            frameTime = timestamp - self.lastTimestamp
+        self.lastTimestamp = timestamp
+
+        # joints to filter - those of tracked bodies (coordinates of 0, 0, 0 means the joint is lost)
+        numpy.not_equal(filtered['tracked'], 0, out=self.tracked)
+        numpy.any(positions, axis=2, out=self.present)
+        numpy.logical_and(self.present, self.tracked[:, None], out=self.present)
+
+        # new joints start from where they are
+        numpy.greater(self.present, self.valid, out=self.fresh)   # present, but not valid
+        numpy.copyto(self.positions, positions, where=self.fresh[:, :, None])
+        numpy.copyto(self.speeds, 0, where=self.fresh[:, :, None])
+
+        # smooth the speed...
+        numpy.subtract(positions, self.positions, out=self.change)
+        self.change *= 1.0 / frameTime
+        self.change -= self.speeds
+        self.change *= smoothingFactor(self.derivativeCutoff, frameTime)
+        self.speeds += self.change
+
+        # ...and use it to find each joint's cutoff frequency, and so its smoothing factor, 1 / (1 + 1 / (2 pi cutoff frameTime))
+        numpy.abs(self.speeds, out=self.factors)
+        self.factors *= self.beta
+        self.factors += self.minCutoff
+        self.factors *= 2 * math.pi * frameTime
+        numpy.reciprocal(self.factors, out=self.factors)
+        self.factors += 1
+        numpy.reciprocal(self.factors, out=self.factors)
+
+        # smooth the positions
+        numpy.subtract(positions, self.positions, out=self.change)
+        self.change *= self.factors
+        self.positions += self.change
+
+        numpy.copyto(positions, self.positions, where=self.present[:, :, None])
+        self.valid[...] = self.present   # lost joints start over when they come back
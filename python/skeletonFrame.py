@@ -0,0 +1,34 @@
+# skeletonFrame.py
+#
+# The layout of a skeleton frame, as captured by a Kuatro Client.
+#
+# A skeleton frame holds everything a depth sensor reports in one frame, for all
+# bodies it can track: whether each body is tracked, its hand states, and the position
+# (in millimetres) and tracking state of every one of its joints.  Frames are numpy
+# records with a fixed size, so the same layout is used for live capture, for recording
+# to (and replaying from) files, and for generating synthetic load.
+#
+# This module is used by Kuatro Clients only (CPython), as it needs numpy.
+
+import numpy
+
+BODY_COUNT  = 6    # bodies tracked by a Kinect 2.0
+JOINT_COUNT = 25   # joints per body
+
+LEFT  = 0          # hand state indices
+RIGHT = 1
+
+FRAME_DTYPE = numpy.dtype([
+    ('timestamp',      '<f8'),                             # capture time (seconds since the client started)
+    ('sequence',       '<u4'),                             # frame number, as captured
+    ('tracked',        'u1',  (BODY_COUNT,)),              # 1 if the body is tracked, 0 otherwise
+    ('handStates',     'u1',  (BODY_COUNT, 2)),            # left and right hand states of each body
+    ('trackingStates', 'u1',  (BODY_COUNT, JOINT_COUNT)),  # tracking state of each joint
+    ('positions',      '<f4', (BODY_COUNT, JOINT_COUNT, 3))  # x, y, z of each joint (millimetres)
+])
+
+
+def newFrame():
+    '''Returns an empty skeleton frame (no bodies tracked).'''
+
+    return numpy.zeros((), dtype=FRAME_DTYPE)
@@ -0,0 +1,98 @@
+# skeletonRecording.py
+#
+# Records skeleton frames to a file, and reads them back.
+#
+# A recording is a small header followed by one fixed-size record per frame (see
+# skeletonFrame.py), so a recording can be memory-mapped and any frame found by its
+# position.  The frames' timestamps are in increasing order, so they double as a time
+# index - see SkeletonRecording.seek().
+#
+# Header layout (little endian, HEADER_SIZE bytes):
+#
+#    magic (4 bytes), version, recordSize, bodyCount, jointCount (unsigned ints),
+#    clientID (string, padded with zeros)
+#
+# This module is used by Kuatro Clients only (CPython), as it needs numpy.
+
+import os
+import struct
+import numpy
+
+from skeletonFrame import FRAME_DTYPE, BODY_COUNT, JOINT_COUNT
+
+MAGIC = b"KSKL"
+VERSION = 1
+HEADER_FORMAT = "<4sIIII44s"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)   # 64 bytes
+
+
+class SkeletonRecorder():
+    ''' Appends skeleton frames to a recording file. '''
+
+    def __init__(self, filename, clientID):
+
+        self.filename = filename
+        self.frameCount = 0
+
+        self.file = open(filename, "wb")
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, FRAME_DTYPE.itemsize,
+                                    BODY_COUNT, JOINT_COUNT, clientID.encode("utf-8")))
+
+    def record(self, frame):
+        ''' Appends a frame to the recording '''
+
+        self.file.write(frame.tobytes())
+        self.frameCount = self.frameCount + 1
+
+    def close(self):
+        ''' Finishes the recording '''
+
+        self.file.close()
+
+
+class SkeletonRecording():
+    ''' A recording of skeleton frames, memory-mapped for reading.  Frames are available
+        in the 'frames' array (a numpy array of FRAME_DTYPE records). '''
+
+    def __init__(self, filename):
+
+        self.filename = filename
+
+        # check the header, to make sure we can read this file
+        headerFile = open(filename, "rb")
+        header = headerFile.read(HEADER_SIZE)
+        headerFile.close()
+
+        magic, version, recordSize, bodyCount, jointCount, clientID = struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(filename + " is not a skeleton recording (or was made by another version).")
+        if recordSize != FRAME_DTYPE.itemsize or bodyCount != BODY_COUNT or jointCount != JOINT_COUNT:
+            raise ValueError(filename + " was recorded with a different frame layout.")
+
+        self.clientID = clientID.rstrip(b"\0").decode("utf-8")  # the device the frames were recorded from
+
+        # map the frames (an interrupted recording may end with a partial frame, so leave it out)
+        frameCount = (os.path.getsize(filename) - HEADER_SIZE) // FRAME_DTYPE.itemsize
+        if frameCount > 0:
+            self.frames = numpy.memmap(filename, dtype=FRAME_DTYPE, mode="r", offset=HEADER_SIZE, shape=(frameCount,))
+        else:
+            self.frames = numpy.zeros(0, dtype=FRAME_DTYPE)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def duration(self):
+        ''' Returns the length of the recording (in seconds) '''
+
+        if len(self.frames) == 0:
+            return 0.0
+        return float(self.frames['timestamp'][-1] - self.frames['timestamp'][0])
+
+    def seek(self, seconds):
+        ''' Returns the index of the first frame captured at least 'seconds' after the
+            start of the recording '''
+
+        if len(self.frames) == 0:
+            return 0
+        timestamps = self.frames['timestamp']
+        return int(numpy.searchsorted(timestamps, timestamps[0] + seconds))
@@ -0,0 +1,151 @@
+# skeletonSimulator.py
+#
+# Procedurally animated bodies, for generating synthetic Kuatro traffic without a Kinect.
+#
+# Each simulated body walks along its own path through the sensor's field of view,
+# swinging its arms and legs, and every few seconds reaches forward with one hand
+# (crossing the veil).  Bodies also come and go - they stay for a while, leave, and
+# come back - so new and lost users are exercised too.
+#
+# Joint positions are in millimetres, in the sensor's coordinate space (as sent by the
+# Kuatro Client), for all 25 Kinect joints (see jointConstants.py).
+#
+# This module is shared by the load generator (CPython) and the server benchmark (Jython),
+# so it must stay compatible with both.
+
+import math
+import random
+
+from jointConstants import *
+
+# standing pose - offset of each joint from SPINE_BASE (in millimetres)
+STANDING_POSE = [
+   (   0,    0,    0),   # SPINE_BASE
+   (   0,  300,    0),   # SPINE_MID
+   (   0,  550,    0),   # NECK
+   (   0,  700,    0),   # HEAD
+   (-180,  480,    0),   # SHOULDER_LEFT
+   (-250,  200,    0),   # ELBOW_LEFT
+   (-270,  -30,    0),   # WRIST_LEFT
+   (-280, -110,    0),   # HAND_LEFT
+   ( 180,  480,    0),   # SHOULDER_RIGHT
+   ( 250,  200,    0),   # ELBOW_RIGHT
+   ( 270,  -30,    0),   # WRIST_RIGHT
+   ( 280, -110,    0),   # HAND_RIGHT
+   ( -90,  -50,    0),   # HIP_LEFT
+   (-100, -450,    0),   # KNEE_LEFT
+   (-100, -850,    0),   # ANKLE_LEFT
+   (-100, -900, -100),   # FOOT_LEFT
+   (  90,  -50,    0),   # HIP_RIGHT
+   ( 100, -450,    0),   # KNEE_RIGHT
+   ( 100, -850,    0),   # ANKLE_RIGHT
+   ( 100, -900, -100),   # FOOT_RIGHT
+   (   0,  480,    0),   # SPINE_SHOULDER
+   (-285, -190,    0),   # HAND_TIP_LEFT
+   (-250, -120,  -30),   # THUMB_LEFT
+   ( 285, -190,    0),   # HAND_TIP_RIGHT
+   ( 250, -120,  -30)    # THUMB_RIGHT
+]
+
+# limbs - the joints that rotate together, and the joint they rotate around
+LEFT_ARM  = (SHOULDER_LEFT,  (ELBOW_LEFT, WRIST_LEFT, HAND_LEFT, HAND_TIP_LEFT, THUMB_LEFT))
+RIGHT_ARM = (SHOULDER_RIGHT, (ELBOW_RIGHT, WRIST_RIGHT, HAND_RIGHT, HAND_TIP_RIGHT, THUMB_RIGHT))
+LEFT_LEG  = (HIP_LEFT,       (KNEE_LEFT, ANKLE_LEFT, FOOT_LEFT))
+RIGHT_LEG = (HIP_RIGHT,      (KNEE_RIGHT, ANKLE_RIGHT, FOOT_RIGHT))
+
+# the space bodies walk in (millimetres)
+MIN_X, MAX_X = -1500, 1500
+MIN_Z, MAX_Z =  1800, 4000
+FLOOR_Y = -100    # height of SPINE_BASE
+
+STEPS_PER_SECOND = 1.8   # walking pace
+REACH_PERIOD = 6.0       # how often a body reaches forward (seconds)
+REACH_TIME = 2.0         # and for how long
+JITTER = 3.0             # sensor noise (standard deviation, in millimetres)
+
+
+class SimulatedBody():
+   ''' A procedurally animated body. '''
+
+   def __init__(self, seed, stayTime=30.0, awayTime=5.0):
+
+      self.random = random.Random(seed)   # each body moves in its own way (but the same way every time)
+
+      # the body's path - a Lissajous curve through the space
+      self.pathSpeedX = self.random.uniform(0.05, 0.15)       # cycles per second
+      self.pathSpeedZ = self.random.uniform(0.05, 0.15)
+      self.pathPhaseX = self.random.uniform(0, 2 * math.pi)
+      self.pathPhaseZ = self.random.uniform(0, 2 * math.pi)
+
+      self.reachOffset = self.random.uniform(0, REACH_PERIOD)  # when it reaches forward
+
+      # how long the body stays in the space, and how long it is away
+      self.stayTime = stayTime
+      self.awayTime = awayTime
+      self.presenceOffset = self.random.uniform(0, stayTime + awayTime)
+
+   def isPresent(self, t):
+      '''Returns True if the body is in the space at time 't' (in seconds)'''
+
+      return (t + self.presenceOffset) % (self.stayTime + self.awayTime) < self.stayTime
+
+   def reach(self, t):
+      '''Returns which hand is reaching forward at time 't' (LEFT_ARM, RIGHT_ARM, or None),
+         and how far (0 to 1)'''
+
+      cycle = (t + self.reachOffset) % (2 * REACH_PERIOD)
+      if cycle < REACH_TIME:
+         arm = LEFT_ARM
+      elif REACH_PERIOD <= cycle < REACH_PERIOD + REACH_TIME:
+         arm = RIGHT_ARM
+         cycle = cycle - REACH_PERIOD
+      else:
+         return None, 0.0
+
+      return arm, math.sin(math.pi * cycle / REACH_TIME)   # out and back in
+
+   def handStates(self, t):
+      '''Returns the left and right hand states at time 't' (open while reaching, closed otherwise)'''
+
+      arm, amount = self.reach(t)
+      left = right = HAND_CLOSED
+      if arm is LEFT_ARM and amount > 0.5:
+         left = HAND_OPEN
+      elif arm is RIGHT_ARM and amount > 0.5:
+         right = HAND_OPEN
+
+      return left, right
+
+   def joints(self, t):
+      '''Returns the x, y, z position of each of the 25 joints at time 't' (in millimetres)'''
+
+      # where the body is
+      baseX = (MIN_X + MAX_X) / 2.0 + (MAX_X - MIN_X) / 2.0 * math.sin(2 * math.pi * self.pathSpeedX * t + self.pathPhaseX)
+      baseZ = (MIN_Z + MAX_Z) / 2.0 + (MAX_Z - MIN_Z) / 2.0 * math.sin(2 * math.pi * self.pathSpeedZ * t + self.pathPhaseZ)
+
+      # how its limbs swing (arms and legs in opposite phase)
+      swing = 0.4 * math.sin(2 * math.pi * STEPS_PER_SECOND / 2 * t)
+      angles = {LEFT_ARM: swing, RIGHT_ARM: -swing, LEFT_LEG: -swing, RIGHT_LEG: swing}
+
+      arm, amount = self.reach(t)
+      if arm is not None:
+         angles[arm] = angles[arm] + (math.pi / 2 - angles[arm]) * amount   # raise the arm towards the sensor
+
+      pose = list(STANDING_POSE)
+      for limb in angles:
+         pivot, limbJoints = limb
+         pivotX, pivotY, pivotZ = pose[pivot]
+         cosine = math.cos(angles[limb])
+         sine = math.sin(angles[limb])
+         for joint in limbJoints:
+            x, y, z = pose[joint]
+            dy = y - pivotY
+            dz = z - pivotZ
+            pose[joint] = (x, pivotY + dy * cosine - dz * sine, pivotZ + dz * cosine + dy * sine)
+
+      jitter = self.random.gauss
+      positions = []
+      for x, y, z in pose:
+         positions.append((baseX + x + jitter(0, JITTER), FLOOR_Y + y + jitter(0, JITTER), baseZ + z + jitter(0, JITTER)))
+
+      return positions
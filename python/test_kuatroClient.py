@@ -0,0 +1,64 @@
+# test_kuatroClient.py
+#
+# Checks that the body frames the Kuatro Client packs for the wire (see packBodyFrame() and
+# packCalibratedFrame()) are read back by the server as they were sent (see bodyFrame.py).
+#
+# Run with:  python -m unittest test_kuatroClient
+
+import unittest
+
+import numpy
+from pythonosc.osc_message import OscMessage
+
+from kuatroClient import packBodyFrame, packCalibratedFrame
+from bodyFrame import decodeBodies, decodeCalibratedBodies, COORDINATE_MAX
+from skeletonFrame import BODY_COUNT, JOINT_COUNT
+
+
+def twoBodies():
+    ''' Returns (tracked, handStates, send, trackingStates, positions) of a frame with two tracked
+      bodies, which send different numbers of joints '''
+
+    tracked = numpy.zeros(BODY_COUNT, dtype=numpy.uint8)
+    tracked[[1, 4]] = 1
+    handStates = numpy.zeros((BODY_COUNT, 2), dtype=numpy.uint8)
+    handStates[1] = [2, 3]
+    handStates[4] = [4, 1]
+    send = numpy.zeros((BODY_COUNT, JOINT_COUNT), dtype=bool)
+    send[1, [0, 7]] = True
+    send[4, [0, 4, 11]] = True
+    trackingStates = numpy.full((BODY_COUNT, JOINT_COUNT), 2, dtype=numpy.uint8)
+    positions = numpy.arange(BODY_COUNT * JOINT_COUNT * 3, dtype=numpy.float32).reshape(BODY_COUNT, JOINT_COUNT, 3) + 0.5
+
+    return tracked, handStates, send, trackingStates, positions
+
+
+class PackFrameTest(unittest.TestCase):
+
+    def testBodyFrameRoundTrip(self):
+        tracked, handStates, send, trackingStates, positions = twoBodies()
+
+        packet = packBodyFrame("device", 12, 400, True, tracked, handStates, send, trackingStates, positions)
+        args = OscMessage(packet.dgram).params
+
+        self.assertEqual(args[:4], ["device", 12, 400, 1])
+        expected = [(userID, int(handStates[userID, 0]), int(handStates[userID, 1]),
+                     [(jointID, 2) + tuple(float(value) for value in positions[userID, jointID]) for jointID in numpy.flatnonzero(send[userID])])
+                    for userID in [1, 4]]
+        self.assertEqual(decodeBodies(args, 4), expected)
+
+    def testCalibratedFrameRoundTrip(self):
+        tracked, handStates, send, trackingStates, positions = twoBodies()
+        calibration = (3, 7, numpy.zeros(3, dtype=numpy.float32), numpy.ones(3, dtype=numpy.float32))
+
+        packet = packCalibratedFrame(calibration, 12, 400, False, tracked, handStates, send, trackingStates, positions)
+        args = OscMessage(packet.dgram).params
+
+        self.assertEqual(args[:5], [3, 12, 400, 0, 7])
+        bodies = decodeCalibratedBodies(args, 5, COORDINATE_MAX, COORDINATE_MAX, COORDINATE_MAX)
+        self.assertEqual([(userID, len(joints)) for userID, leftHandState, rightHandState, joints in bodies], [(1, 2), (4, 3)])
+        self.assertEqual(bodies[1][3][2][:2], (11, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# traceBuffer.py
+#
+# A Trace Buffer remembers the last few thousand things the Kuatro Server did (e.g., frames received,
+# users added, messages sent to views), so we can see what happened without printing as it happens
+# (printing slows the server down, which changes the very timing we are trying to debug).
+#
+# Each trace record is a fixed-size set of numbers:
+#
+#    timestamp, event, device, user, joint, value
+#
+# where timestamp is in seconds, event is one of the event types below, device is the device index
+# (-1 if none), user is a user ID, joint is a joint ID (-1 if none), and value depends on the event
+# (e.g., the frame sequence of a FRAME event, or the message type of a VIEW_MESSAGE event).
+#
+# Records are kept in arrays allocated up front, and the oldest record is overwritten once the
+# buffer is full, so recording takes no memory and only a few assignments.  The buffer may be
+# dumped to a binary file (TRACE_RECORD_FORMAT records, after a TRACE_HEADER_FORMAT header),
+# and read back with readTrace(), or printed with:
+#
+#    python traceBuffer.py trace.bin
+#
+# This module is shared by the Kuatro Server (Jython), and tools that analyze traces (CPython),
+# so it must stay compatible with both.
+
+import struct
+import time
+import sys
+from array import array
+
+# how many records a Trace Buffer holds (older records are overwritten beyond this)
+TRACE_SIZE = 65536
+
+# trace file layout - a header (magic number, and number of records), followed by the records
+TRACE_MAGIC = 0x4B545243   # "KTRC"
+TRACE_HEADER_FORMAT = ">II"
+TRACE_RECORD_FORMAT = ">diiiii"
+
+# event types
+FRAME = 1            # a body frame was processed (value is its sequence number)
+FRAME_SKIPPED = 2    # a body frame was skipped (value is its sequence number)
+NEW_USER = 3         # a user was added (user is the virtual world user ID, value the device's user ID)
+LOST_USER = 4        # a user was removed (user is the virtual world user ID, value the device's user ID)
+JOINT = 5            # a user's joint was updated (value is its tracking state)
+VIEW_MESSAGE = 6     # a message was sent to the views (value is its message type, see MESSAGE_TYPES)
+ERROR = 7            # a message handler failed (value is its message type, see MESSAGE_TYPES)
+
+EVENT_NAMES = {FRAME: "frame", FRAME_SKIPPED: "frameSkipped", NEW_USER: "newUser", LOST_USER: "lostUser",
+               JOINT: "joint", VIEW_MESSAGE: "viewMessage", ERROR: "error"}
+
+# message types (OSC addresses) traced by their position in this list
+MESSAGE_TYPES = ["/kuatro/newUser", "/kuatro/lostUser", "/kuatro/jointCoordinates", "/kuatro/handState",
+                 "/kuatro/registerDevice", "/kuatro/calibrateDevice", "/kuatro/registerView", "/kuatro/processing",
+                 "/kuatro/bodyFrame", "/kuatro/subscription", "/kuatro/calibration", "/kuatro/calibratedFrame",
+                 "/kuatro/worldState", "/kuatro/stats", "/kuatro/calibrationStart", "/kuatro/calibrationStop",
+                 "/kuatro/selectDevice", "/kuatro/dumpTrace", "/kuatro/redirect",
+                 "/kuatro/snapshot", "/kuatro/resync", "/kuatro/rollbackCalibration"]
+
+
+def messageType(address):
+   '''Returns the message type of an OSC address, as traced (-1 if it is not in MESSAGE_TYPES)'''
+
+   if address in MESSAGE_TYPES:
+      return MESSAGE_TYPES.index(address)
+   return -1
+
+
+class TraceBuffer():
+
+   def __init__(self, size=TRACE_SIZE):
+
+      self.size = size
+      self.times = array('d', [0.0] * size)   # timestamp of each record
+      self.fields = array('i', [0] * (size * 5))   # event, device, user, joint, value of each record (record i starts at i * 5)
+      self.next = 0                            # where the next record goes
+      self.count = 0                           # how many records were recorded (including overwritten ones)
+
+   def record(self, event, device=-1, user=-1, joint=-1, value=0):
+      '''Adds a record to the trace (overwriting the oldest record, if the buffer is full)'''
+
+      index = self.next
+      self.times[index] = time.time()
+      base = index * 5
+      fields = self.fields
+      fields[base] = event
+      fields[base + 1] = device
+      fields[base + 2] = user
+      fields[base + 3] = joint
+      fields[base + 4] = value
+      self.next = (index + 1) % self.size
+      self.count = self.count + 1
+
+   def records(self):
+      '''Returns the records in the buffer, oldest first, as a list of
+         (timestamp, event, device, user, joint, value) tuples'''
+
+      if self.count < self.size:
+         indices = range(0, self.count)
+      else:
+         indices = list(range(self.next, self.size)) + list(range(0, self.next))
+
+      fields = self.fields
+      return [(self.times[index], fields[index * 5], fields[index * 5 + 1], fields[index * 5 + 2],
+               fields[index * 5 + 3], fields[index * 5 + 4]) for index in indices]
+
+   def dump(self, fileName):
+      '''Writes the records in the buffer, oldest first, to a binary trace file (see readTrace)'''
+
+      records = self.records()
+
+      traceFile = open(fileName, "wb")
+      try:
+         traceFile.write(struct.pack(TRACE_HEADER_FORMAT, TRACE_MAGIC, len(records)))
+         for record in records:
+            traceFile.write(struct.pack(TRACE_RECORD_FORMAT, *record))
+      finally:
+         traceFile.close()
+
+      return len(records)
+
+
+def readTrace(fileName):
+   '''Returns the records of a trace file (see TraceBuffer.dump), oldest first, as a list of
+      (timestamp, event, device, user, joint, value) tuples'''
+
+   traceFile = open(fileName, "rb")
+   try:
+      data = traceFile.read()
+   finally:
+      traceFile.close()
+
+   headerSize = struct.calcsize(TRACE_HEADER_FORMAT)
+   recordSize = struct.calcsize(TRACE_RECORD_FORMAT)
+
+   magic, count = struct.unpack(TRACE_HEADER_FORMAT, data[:headerSize])
+   if magic != TRACE_MAGIC:
+      raise ValueError(fileName + " is not a Kuatro trace file")
+
+   return [struct.unpack(TRACE_RECORD_FORMAT, data[headerSize + i * recordSize:headerSize + (i + 1) * recordSize])
+           for i in range(count)]
+
+
+def formatRecord(record):
+   '''Returns a trace record as a line of text'''
+
+   timestamp, event, device, user, joint, value = record
+
+   text = "%.3f %s device %d user %d joint %d" % (timestamp, EVENT_NAMES.get(event, str(event)), device, user, joint)
+   if event == VIEW_MESSAGE or event == ERROR:
+      if 0 <= value < len(MESSAGE_TYPES):
+         return text + " " + MESSAGE_TYPES[value]
+   return text + " value " + str(value)
+
+
+if __name__ == '__main__':
+
+   for record in readTrace(sys.argv[1]):
+      print(formatRecord(record))
@@ -0,0 +1,248 @@
+# viewFilter.py
+#
+# A View Filter says what a Kuatro View wants to be sent - which joints, which optional message types
+# (hand states and processing coordinates), which users, and which region of the virtual world - so
+# the server sends each view only that (instead of everything any view uses).
+#
+# Views declare their filter when they register (see parseViewRegistration).  The filter is compiled
+# then, into one predicate per message type that only makes the checks the view asked for, so that
+# deciding about a message takes a dictionary lookup and (at most) a few comparisons.  Views that
+# declare the same filter are grouped (see groupViews), so each message is checked, and each body
+# frame is filtered and packed, once per group rather than once per view.
+#
+# New and lost user messages (and snapshots) always go to all views, so every view knows who is in
+# the virtual world - filters only apply to the users' data.  The users and region a view asked for
+# apply to all of a user's data alike (joint coordinates, hand states, processing coordinates and
+# body frames) - a user is in the region when their location (their SPINE_BASE) is, so a view gets
+# either all of a user's joints, or none.
+#
+# This module is used by the Kuatro Server and Aggregator only (Jython).
+#
+#  See README file for full instructions on using the Kuatro System
+
+from bodyFrame import encodeBodies
+import fnmatch
+
+# the messages a filter applies to (see KuatroServer)
+JOINT_COORDINATES_MESSAGE = "/kuatro/jointCoordinates"
+HAND_STATE_MESSAGE = "/kuatro/handState"
+PROCESSING_MESSAGE = "/kuatro/processing"
+
+SPINE_BASE = 0   # Kinect joint ID used as a user's location in the virtual world (for regions)
+
+
+class ViewFilter():
+
+   def __init__(self, joints=None, messages=None, users=None, region=None):
+
+      self.joints = joints         # the joint IDs the view wants (None for all)
+      self.messages = messages     # the optional message types the view wants (None for all)
+      self.users = users           # the virtual world user IDs the view wants (None for all)
+      self.region = region         # where users should be (their SPINE_BASE) for the view to want them, as (minX, minY, minZ, maxX, maxY, maxZ) (None for anywhere)
+
+      # filters that say the same thing are equal (so their views are grouped, see groupViews)
+      self.key = (sortedTuple(joints), sortedTuple(messages), sortedTuple(users), region)
+
+      # whether body frames go to the view as they are (nothing to leave out)
+      self.passesAllBodies = joints is None and users is None and region is None
+
+      # compile the checks, once
+      self.jointSet = None
+      if joints is not None:
+         self.jointSet = set(joints)
+      self.userSet = None
+      if users is not None:
+         self.userSet = set(users)
+
+      self.predicates = {}         # what decides whether the view wants a message, as {address: predicate(args, locations)}
+      for address in [JOINT_COORDINATES_MESSAGE, HAND_STATE_MESSAGE, PROCESSING_MESSAGE]:
+         self.predicates[address] = self.compile(address)
+
+   def compile(self, address):
+      '''Returns a predicate, predicate(args, locations), that says whether the view wants a message sent to
+         'address', where 'locations' are the users' locations, as {userID: (x, y, z)} (making only the
+         checks this filter needs)'''
+
+      if self.messages is not None and address not in self.messages and address != JOINT_COORDINATES_MESSAGE:
+         return lambda args, locations: False   # an optional message the view did not ask for
+
+      jointSet = self.jointSet
+      userSet = self.userSet
+      region = self.region
+
+      # all three messages start with the (virtual world) user ID - joint coordinates:  userID, jointID, trackingState, x, y, z,
+      # hand states:  userID, hand, handState, processing coordinates:  userID, x, y
+      checks = []
+      if address == JOINT_COORDINATES_MESSAGE and jointSet is not None:
+         checks.append(lambda args, locations: args[1] in jointSet)
+      if userSet is not None:
+         checks.append(lambda args, locations: args[0] in userSet)
+      if region is not None:
+         checks.append(lambda args, locations: isUserInRegion(region, locations, args[0]))
+
+      if not checks:
+         return lambda args, locations: True
+      if len(checks) == 1:
+         return checks[0]
+      return lambda args, locations: allTrue(checks, args, locations)
+
+   def accepts(self, address, args, locations):
+      '''Returns whether the view wants a message, given the users' locations, as {userID: (x, y, z)}
+         (messages the filter does not apply to always pass)'''
+
+      predicate = self.predicates.get(address)
+      return predicate is None or predicate(args, locations)
+
+   def filterBodies(self, bodies):
+      '''Returns the bodies (as in bodyFrame.py) the view wants, with only the joints it wants'''
+
+      if self.passesAllBodies:
+         return bodies
+
+      jointSet = self.jointSet
+      userSet = self.userSet
+      region = self.region
+
+      filtered = []
+      for userID, leftHandState, rightHandState, joints in bodies:
+         if userSet is not None and userID not in userSet:
+            continue
+
+         if region is not None:   # where the user is (their SPINE_BASE, or else their first joint)
+            location = None
+            for joint in joints:
+               if joint[0] == SPINE_BASE or location is None:
+                  location = joint
+            if location is None or not isInRegion(region, location[2], location[3], location[4]):
+               continue
+
+         if jointSet is not None:
+            joints = [joint for joint in joints if joint[0] in jointSet]
+
+         filtered.append((userID, leftHandState, rightHandState, joints))
+
+      return filtered
+
+
+def sortedTuple(values):
+   '''Returns the values, sorted, as a tuple (or None, if None)'''
+
+   if values is None:
+      return None
+   values = list(values)
+   values.sort()
+   return tuple(values)
+
+
+def isInRegion(region, x, y, z):
+   '''Returns whether x, y, z is inside region (minX, minY, minZ, maxX, maxY, maxZ)'''
+
+   return region[0] <= x <= region[3] and region[1] <= y <= region[4] and region[2] <= z <= region[5]
+
+
+def isUserInRegion(region, locations, userID):
+   '''Returns whether a user's location (see locations, as {userID: (x, y, z)}) is inside region
+      (users whose location is not known are not)'''
+
+   location = locations.get(userID)
+   return location is not None and isInRegion(region, location[0], location[1], location[2])
+
+
+def allTrue(checks, args, locations):
+   '''Returns whether all checks pass for the message arguments'''
+
+   for check in checks:
+      if not check(args, locations):
+         return False
+   return True
+
+
+def parseViewRegistration(args, defaultJoints, defaultMessages):
+   '''Returns (ipAddress, port, viewFilter) from the arguments of a view's registration:
+
+         ipAddress, port, jointCount, jointID*jointCount, messageType*,
+            ["users", userCount, userID*userCount], ["region", minX, minY, minZ, maxX, maxY, maxZ]
+
+      where message types may be patterns (e.g., "/kuatro/*"), matched against defaultMessages (the
+      optional message types there are), and "users" and "region" are optional.  Views that declare
+      no joints and message types get defaultJoints and defaultMessages.'''
+
+   ipAddress = args[0]
+   port = args[1]
+
+   if len(args) <= 2:
+      return ipAddress, port, ViewFilter(list(defaultJoints), list(defaultMessages))
+
+   jointCount = args[2]
+   joints = [args[i] for i in range(3, 3 + jointCount)]
+   messages = []
+   users = None
+   region = None
+
+   i = 3 + jointCount
+   while i < len(args):
+      if args[i] == "users":
+         userCount = args[i + 1]
+         users = [args[j] for j in range(i + 2, i + 2 + userCount)]
+         i = i + 2 + userCount
+      elif args[i] == "region":
+         region = tuple([args[j] for j in range(i + 1, i + 7)])
+         i = i + 7
+      else:
+         pattern = args[i]
+         for messageType in defaultMessages:
+            if fnmatch.fnmatchcase(messageType, pattern) and messageType not in messages:
+               messages.append(messageType)
+         if pattern not in messages and "*" not in pattern and "?" not in pattern:
+            messages.append(pattern)
+         i = i + 1
+
+   return ipAddress, port, ViewFilter(joints, messages, users, region)
+
+
+def groupViews(viewSenders):
+   '''Returns the View Senders grouped by their views' filters, as [(viewFilter, viewSenders)]
+      (views with equal filters are in the same group)'''
+
+   groups = []
+   keys = []
+   for viewSender in viewSenders:
+      viewFilter = viewSender.viewFilter
+      if viewFilter.key in keys:
+         groups[keys.index(viewFilter.key)][1].append(viewSender)
+      else:
+         keys.append(viewFilter.key)
+         groups.append((viewFilter, [viewSender]))
+   return groups
+
+
+def sendFilteredValue(viewGroups, key, address, args, locations):
+   '''Queues a value message (see ViewSender.sendValue) with the views that want it, given the users'
+      locations (their SPINE_BASE), as {userID: (x, y, z)}'''
+
+   for viewFilter, viewSenders in viewGroups:
+      if viewFilter.accepts(address, args, locations):
+         for viewSender in viewSenders:
+            viewSender.sendValue(key, address, args)
+
+
+def sendFilteredBodies(viewGroups, key, address, sequence, bodies):
+   '''Queues a body frame (or world state) message - sequence, then the bodies, as in bodyFrame.py -
+      as a value with all views, each with the bodies and joints it wants (views that want none
+      of them get nothing).  Each group's message is packed once.'''
+
+   everything = None   # the message with all bodies (packed once, for all views that want everything)
+
+   for viewFilter, viewSenders in viewGroups:
+      if viewFilter.passesAllBodies:
+         if everything is None:
+            everything = (sequence,) + tuple(encodeBodies(bodies))
+         args = everything
+      else:
+         filtered = viewFilter.filterBodies(bodies)
+         if not filtered:
+            continue
+         args = (sequence,) + tuple(encodeBodies(filtered))
+
+      for viewSender in viewSenders:
+         viewSender.sendValue(key, address, args)
@@ -0,0 +1,144 @@
+# viewSender.py
+#
+# A View Sender sends OSC messages to one Kuatro View from its own thread, so that the Kuatro
+# Server's OSC listener never waits on a view - a slow (or dead) view only falls behind itself.
+#
+# Messages wait in a queue, in the order they were sent.  Events (e.g., new and lost users) are
+# always delivered.  Values (e.g., joint coordinates) are only worth sending while they are fresh,
+# so a value replaces the one still waiting about the same thing (e.g., the same user's joint), and
+# when VIEW_QUEUE_SIZE values are already waiting, the oldest value is dropped to make room.  A value
+# that replaces another takes its place at the back of the queue (not the older one's place), so
+# numbered messages (e.g., body frames from several devices) are always sent in the order they
+# were numbered.
+#
+# This module is used by the Kuatro Server only (Jython).
+#
+#  See README file for full instructions on using the Kuatro System
+
+from osc import OscOut
+from threading import Thread, Condition
+from collections import deque
+import time
+
+# how many values may wait to be sent to a view (older values are dropped beyond this)
+VIEW_QUEUE_SIZE = 64
+
+
+class ViewSender():
+
+   def __init__(self, ipAddress, port, queueSize=VIEW_QUEUE_SIZE, viewFilter=None):
+
+      self.ipAddress = ipAddress
+      self.port = port
+      self.queueSize = queueSize   # how many values may wait to be sent
+      self.viewFilter = viewFilter # what the view wants to be sent (see viewFilter.py)
+
+      self.queue = deque()         # [address, args, queueTime, key] items, in the order they were sent (key is None for events)
+      self.values = {}             # the values waiting to be sent, as {key: item}
+      self.lock = Condition()      # guards the queue, and wakes up the sender thread
+
+      # counters
+      self.eventsSent = 0          # events sent to the view
+      self.valuesSent = 0          # values sent to the view
+      self.valuesReplaced = 0      # values replaced by a newer one before they were sent
+      self.valuesDropped = 0       # values dropped because the view fell behind
+      self.sendErrors = 0          # messages that could not be sent
+      self.lastLag = 0.0           # how long the last message waited to be sent (seconds)
+      self.maxLag = 0.0            # and the longest any message waited
+      self.sendRate = 0.0          # messages sent per second (updated by the server, see KuatroServer.updateRates)
+      self.lastMessagesSent = 0    # messages sent at the last update
+
+      self.oscOut = OscOut(ipAddress, port)   # setup the OSC Connection to the view
+
+      self.isRunning = True
+      self.senderThread = Thread(target=self.run)
+      self.senderThread.setDaemon(True)
+      self.senderThread.start()
+
+   def sendEvent(self, address, args):
+      ''' Queues a message that must be delivered (e.g., a new user) '''
+
+      self.lock.acquire()
+      try:
+         self.queue.append([address, args, time.time(), None])
+         self.lock.notify()
+      finally:
+         self.lock.release()
+
+   def sendValue(self, key, address, args):
+      ''' Queues a message that only matters until a newer one about the same thing, 'key', is
+          sent (e.g., a user's joint) - it replaces the one still waiting, if any (and is queued
+          behind everything sent before it, as the older one was) '''
+
+      self.lock.acquire()
+      try:
+         oldItem = self.values.get(key)
+         if oldItem is not None:   # the older value was not sent yet, so send this one instead
+            self.queue.remove(oldItem)
+            del self.values[key]
+            self.valuesReplaced = self.valuesReplaced + 1
+
+         elif len(self.values) >= self.queueSize:
+            for oldItem in self.queue:    # find the oldest value (events stay where they are)
+               if oldItem[3] is not None:
+                  self.queue.remove(oldItem)
+                  del self.values[oldItem[3]]
+                  break
+            self.valuesDropped = self.valuesDropped + 1
+
+         item = [address, args, time.time(), key]
+         self.queue.append(item)
+         self.values[key] = item
+         self.lock.notify()
+      finally:
+         self.lock.release()
+
+   def run(self):
+      ''' Sends queued messages as they arrive (in the sender thread), until closed and the queue is empty '''
+
+      while True:
+         self.lock.acquire()
+         try:
+            while self.isRunning and len(self.queue) == 0:
+               self.lock.wait()
+            if len(self.queue) == 0:   # closed, and nothing left to send
+               return
+            address, args, queueTime, key = self.queue.popleft()
+            if key is not None:
+               del self.values[key]
+         finally:
+            self.lock.release()
+
+         try:
+            self.oscOut.sendMessage(address, *args)
+         except Exception, e:
+            self.sendErrors = self.sendErrors + 1
+
+         lag = time.time() - queueTime
+         self.lastLag = lag
+         if lag > self.maxLag:
+            self.maxLag = lag
+
+         if key is None:
+            self.eventsSent = self.eventsSent + 1
+         else:
+            self.valuesSent = self.valuesSent + 1
+
+   def close(self):
+      ''' Sends whatever is still queued, and stops the sender thread '''
+
+      self.lock.acquire()
+      try:
+         self.isRunning = False
+         self.lock.notify()
+      finally:
+         self.lock.release()
+      self.senderThread.join()
+
+   def stats(self):
+      ''' Returns the sender's counters, as text '''
+
+      return (self.ipAddress + ":" + str(self.port) + " - " + str(self.eventsSent) + " events sent, " +
+              str(self.valuesSent) + " values sent, " + str(self.valuesReplaced) + " replaced, " +
+              str(self.valuesDropped) + " dropped, " + str(self.sendErrors) + " send errors, lag " +
+              str(int(self.lastLag * 1000)) + " ms (max " + str(int(self.maxLag * 1000)) + " ms)")